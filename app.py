@@ -1,7 +1,18 @@
 # app.py
-import io, zipfile, re, hashlib
+import io, os, zipfile, re, hashlib
 import streamlit as st
-from core.queue_builder import read_3mf, compose_sequence, build_final_3mf
+from core.cache import LRUCache
+from core.estimator import estimate_plate_cached, format_duration, queue_timeline
+from core.scheduler import optimize_sequence_cached
+from core.gcode_loop import CHANGE_BLOCK_FIXED, build_wait_block
+from core.queue_builder import (REPRODUCIBLE_DATE_TIME, read_3mf_many_cached, read_plate_cached, iter_sequence,
+                                build_final_3mf, queue_cache_key, minify_plate_cached, minify_report_line)
+from core.jobs import CANCELLED, DONE, BuildExecutor, sequence_bytes
+from core.metrics import Metrics
+from core.output import build_to_file
+from core.sequence import SequencePlan
+from core.split import BUNDLE_MIME, build_parts, part_names, split_plan, write_bundle
+from core.dispatch import bundle_artifacts, dispatch, load_printers, stats_rows
 
 APP_NAME  = "PrintLooper — Auto Swap for 3MF"
 LOGO_PATH = "assets/PrintLooper.png"
@@ -23,6 +34,43 @@ h1, h2, h3 { background: linear-gradient(90deg,#e6e6e6,#8AE234);
 """, unsafe_allow_html=True)
 
 # ========== Helpers ==========
+# Caché de parseo compartida por todas las sesiones (clave: MD5 del .3mf subido).
+# PRINTLOOPER_PARSE_CACHE_MB: presupuesto en memoria; PRINTLOOPER_CACHE_DIR: nivel en disco,
+# con su propio presupuesto en PRINTLOOPER_PARSE_DISK_MB.
+@st.cache_resource
+def get_parse_cache() -> LRUCache:
+    budget_mb = float(os.environ.get("PRINTLOOPER_PARSE_CACHE_MB", "1024"))
+    disk_mb = float(os.environ.get("PRINTLOOPER_PARSE_DISK_MB", "4096"))
+    disk_dir = os.environ.get("PRINTLOOPER_CACHE_DIR") or None
+    return LRUCache(int(budget_mb * 1024 * 1024),
+                    disk_dir=os.path.join(disk_dir, "parse") if disk_dir else None,
+                    max_disk_bytes=int(disk_mb * 1024 * 1024))
+
+# Caché de colas ya construidas (clave: digest de cada .3mf + modo, repeticiones y bloque).
+# Guarda OutputFile (el .3mf queda en disco, en PRINTLOOPER_CACHE_DIR/build o en el
+# temp del sistema); el presupuesto cuenta el tamaño de esos archivos. Un archivo
+# se borra cuando sale de la caché y ninguna sesión lo sigue usando.
+@st.cache_resource
+def get_build_cache() -> LRUCache:
+    budget_mb = float(os.environ.get("PRINTLOOPER_BUILD_CACHE_MB", "2048"))
+    return LRUCache(int(budget_mb * 1024 * 1024))
+
+# Hilos para builds en segundo plano, compartidos por todas las sesiones
+@st.cache_resource
+def get_build_executor() -> BuildExecutor:
+    return BuildExecutor(int(os.environ.get("PRINTLOOPER_BUILD_WORKERS", "2")))
+
+# Impresoras a las que se puede enviar la cola (PRINTLOOPER_PRINTERS: config JSON,
+# ver core/dispatch.py). Sin config, la sección de envío no aparece.
+@st.cache_resource
+def get_printers() -> list:
+    path = os.environ.get("PRINTLOOPER_PRINTERS")
+    return load_printers(path) if path else []
+
+def build_output_dir() -> str | None:
+    cache_dir = os.environ.get("PRINTLOOPER_CACHE_DIR") or None
+    return os.path.join(cache_dir, "build") if cache_dir else None
+
 PLATE_NUM_RE = re.compile(r"plate_(\d+)\.gcode$", re.IGNORECASE)
 def select_preview_from_files(files: dict, plate_name: str) -> bytes | None:
     if not plate_name: return None
@@ -37,94 +85,24 @@ def select_preview_from_files(files: dict, plate_name: str) -> bytes | None:
             return files[ok]
     return None
 
-# --- Secuencia: cálculo de pasos (lista)
-def compute_sequence_preview(models, mode, wait_enabled, wait_mode, wait_minutes, target_bed):
-    steps = []
-    total_prints = sum(m["repeats"] for m in models)
-    if total_prints == 0:
-        return steps
-
-    def add_wait_and_swap(step_index, is_last_print):
-        if is_last_print:
-            return step_index
-        if wait_enabled:
-            if wait_mode == "time":
-                steps.append({"#": step_index, "Acción": "Esperar", "Detalle": f"{wait_minutes:.1f} min"})
-                step_index += 1
-            else:
-                steps.append({"#": step_index, "Acción": "Esperar", "Detalle": f"Cama ≤ {int(target_bed)}°C"})
-                step_index += 1
-        steps.append({"#": step_index, "Acción": "Cambio de placa", "Detalle": "Bloque G-code fijo"})
-        step_index += 1
-        return step_index
-
-    idx = 1
-    printed = 0
-
-    if mode == "serial":
-        for m in models:
-            for r in range(1, m["repeats"] + 1):
-                steps.append({"#": idx, "Acción": "Imprimir", "Modelo": m["name"], "Repetición": r})
-                idx += 1
-                printed += 1
-                idx = add_wait_and_swap(idx, printed == total_prints)
-    else:  # interleaved
-        max_r = max(m["repeats"] for m in models)
-        for r in range(1, max_r + 1):
-            for m in models:
-                if r <= m["repeats"]:
-                    steps.append({"#": idx, "Acción": "Imprimir", "Modelo": m["name"], "Repetición": r})
-                    idx += 1
-                    printed += 1
-                    idx = add_wait_and_swap(idx, printed == total_prints)
-    return steps
-
-# ========== BLOQUE DE CAMBIO (FIJO, SIN CICLOS) ==========
-CHANGE_BLOCK_FIXED = """;======== Starting custom sequence =================          ; Bloque inicial personalizado
-
-;======== Starting to change plates =================         ; Inicio de la secuencia de cambio de placas
-                              ;G91; 
-  
-
-                            ; G380 S2 Z266 F1200 
-
-
-G90                         ; Vuelve a modo absoluto
-
-G28 Y                       ; Home solo del eje Y
-G91                         ; Modo relativo
-G380 S2 Z30 F1200           ; Movimiento/probing Z especial (según firmware)
-G90                         ; Vuelve a modo absoluto
-M211 Y0 Z0                  ; (Opcional) desactiva límites suaves en Y/Z
-G91                         ; Modo relativo
-G90                         ; Vuelve a modo absoluto
-
-; ----- Secuencia de expulsión en Y -----
-G1 Y250 F2000
-G1 Y266 F500
-G1 Z260 F500                ; Ajusta Z a 260 mm durante el ciclo
-G1 Y150 F500
-G1 Y35 F1000
-G1 Y0 F2500
-G91
-G380 S3 Z0 F1200          ; Baja Z 15 mm (proceso de expulsión)
-G90
-
-G1 Y266 F2000
-G1 Y53  F2000
-G1 Y100 F2000
-G1 Y266 F2000
-G1 Y250 F8000
-G1 Y266 F8000
-G1 Y0   F1000
-G1 Y150 F1000
-G1 Z100 F1000
-G28 Y           
-
-;======== Finish to change plates =================           ; Fin de la secuencia de cambio de placas
-
-
-"""
+# --- Secuencia: resumen por runs del plan (una fila por run, no por paso)
+def sequence_preview_rows(plan: SequencePlan, models, wait_label: str | None, timeline=None):
+    rows = []
+    first = 1
+    total = plan.total_prints
+    for k, run in enumerate(plan.runs):
+        last = first + run.prints - 1
+        rows.append({
+            "Impresiones": f"{first}" if first == last else f"{first}–{last}",
+            "Patrón": " → ".join(models[i]["name"] for i in run.models),
+            "Vueltas": run.count,
+            "Entre impresiones": (f"⏳ {wait_label} + 🔁 cambio" if wait_label else "🔁 cambio")
+                                 if total > 1 else "—",
+        })
+        if timeline is not None:
+            rows[-1]["Duración (aprox.)"] = format_duration(timeline["runs"][k])
+        first = last + 1
+    return rows
 
 # ========== Header ==========
 c1, c2 = st.columns([0.22, 0.78])
@@ -139,9 +117,17 @@ with c2:
 with st.sidebar:
     st.markdown("### Parámetros")
     mode = st.radio(
-        "Orden de impresión", ["serial","interleaved"],
-        format_func=lambda x: "Serie" if x=="serial" else "Intercalado",
-        help="Serie: imprime todas las repeticiones de un modelo y luego el siguiente. Intercalado: alterna modelos por turno."
+        "Orden de impresión", ["serial","interleaved","optimized"],
+        format_func=lambda x: {"serial": "Serie", "interleaved": "Intercalado", "optimized": "Optimizado"}[x],
+        help="Serie: imprime todas las repeticiones de un modelo y luego el siguiente. Intercalado: alterna modelos por turno. "
+             "Optimizado: el orden de menor duración estimada (tiene en cuenta cuánto tarda la cama en enfriar y calentar)."
+    )
+
+    minify_enabled = st.checkbox(
+        "Reducir G-code", value=False,
+        help="Quita comentarios (salvo los marcadores que usan la impresora y la app), líneas vacías, "
+             "F y ejes que no cambian y ceros de más. Los movimientos quedan iguales; el archivo pesa menos "
+             "y se transfiere más rápido a la impresora."
     )
 
     st.markdown("---")
@@ -167,6 +153,29 @@ with st.sidebar:
         help="Temperatura de cama a la que debe enfriar antes del cambio. Se usa M140 S0 + M190 R<temp>."
     )
 
+    st.markdown("---")
+    st.markdown("### ✂️ Dividir en partes")
+    split_enabled = st.checkbox(
+        "Dividir colas grandes", value=False,
+        help="Arma varios .3mf más chicos (cada uno con su apagado) y los entrega juntos en un .zip. "
+             "Una falla cerca del final sólo afecta a esa parte."
+    )
+    split_prints = st.number_input("Impresiones máximas por parte (0 = sin límite)", min_value=0, value=0, step=1,
+                                   disabled=not split_enabled)
+    split_mb = st.number_input("MB de G-code máximos por parte (0 = sin límite)", min_value=0.0, value=0.0,
+                               step=50.0, disabled=not split_enabled)
+    split_hours = st.number_input("Horas estimadas máximas por parte (0 = sin límite)", min_value=0.0, value=0.0,
+                                  step=1.0, disabled=not split_enabled)
+
+    st.markdown("---")
+    st.markdown("### 🩺 Diagnóstico")
+    trace_memory = st.checkbox(
+        "Medir memoria pico (tracemalloc)", value=False,
+        help="Agrega la memoria pico de cada etapa al diagnóstico. Hace el build bastante más lento."
+    )
+    # se completa al final, con las etapas del último build de la sesión
+    diagnostics_panel = st.container()
+
 with st.expander("Bloque G-code fijo que se insertará entre repeticiones"):
     st.code(CHANGE_BLOCK_FIXED, language="gcode")
 
@@ -179,86 +188,304 @@ uploads = st.file_uploader(
 models = []
 if uploads:
     cols = st.columns(len(uploads))
-    for i, up in enumerate(uploads):
-        data = up.read()
-        meta = read_3mf(data)
+    datas = [up.getvalue() for up in uploads]
+    # Los que no están en caché se parsean en paralelo (un proceso por núcleo)
+    parsed = read_3mf_many_cached(datas, get_parse_cache())
+    for i, (up, data, res) in enumerate(zip(uploads, datas, parsed)):
+        if res["error"]:
+            with cols[i]:
+                st.error(f"{up.name}: no se pudo leer el .3mf ({res['error']})")
+            continue
+        meta = res["meta"]
+        plates = meta["plates"]
+        selections = []  # (plate_name, repeticiones) elegidos en esta tarjeta
         with cols[i]:
             st.markdown('<div class="card">', unsafe_allow_html=True)
-            st.markdown(f"**{up.name}**  \n<span class='small'>/{meta['plate_name'].split('/')[-1].split('.')[0]}</span>",
-                        unsafe_allow_html=True)
-            preview = select_preview_from_files(meta["files"], meta["plate_name"])
-            st.image(preview if preview else "https://via.placeholder.com/320x200?text=No+preview",
-                     use_container_width=True)
-            reps = st.number_input(
-                "Repeticiones", min_value=1, value=1, step=1, key=f"reps_{i}",
-                help="Cuántas veces se imprimirá este modelo dentro de la cola."
-            )
+            if len(plates) <= 1:
+                st.markdown(f"**{up.name}**  \n<span class='small'>/{meta['plate_name'].split('/')[-1].split('.')[0]}</span>",
+                            unsafe_allow_html=True)
+                preview = select_preview_from_files(meta["files"], meta["plate_name"])
+                st.image(preview if preview else "https://via.placeholder.com/320x200?text=No+preview",
+                         use_container_width=True)
+                reps = st.number_input(
+                    "Repeticiones", min_value=1, value=1, step=1, key=f"reps_{i}",
+                    help="Cuántas veces se imprimirá este modelo dentro de la cola."
+                )
+                selections.append((meta["plate_name"], int(reps)))
+            else:
+                # Proyecto con varios plates: cada uno con sus repeticiones (0 = no se imprime).
+                # Sólo se parsean los plates elegidos.
+                st.markdown(f"**{up.name}**  \n<span class='small'>{len(plates)} plates</span>",
+                            unsafe_allow_html=True)
+                for p in plates:
+                    label = f"Plate {p['plate']}" if p["plate"] is not None else p["name"].split("/")[-1]
+                    if p["preview"]:
+                        st.image(meta["files"][p["preview"]], caption=label, width=160)
+                    reps = st.number_input(
+                        f"Repeticiones — {label}", min_value=0, step=1,
+                        value=1 if p["name"] == meta["plate_name"] else 0, key=f"reps_{i}_{p['name']}",
+                        help=f"Cuántas veces se imprimirá {label} ({p['size'] / 1e6:.1f} MB de G-code). 0 = no se imprime."
+                    )
+                    selections.append((p["name"], int(reps)))
             st.markdown('</div>', unsafe_allow_html=True)
-        models.append({
-            "name": up.name, "raw": data, "repeats": int(reps),
-            "plate_name": meta["plate_name"], "core": meta["core"],
-            "shutdown": meta["shutdown"], "files": meta["files"],
-        })
+        for plate_name, reps in selections:
+            if reps < 1:
+                continue
+            try:
+                plate_meta = read_plate_cached(meta, plate_name, get_parse_cache())
+            except Exception as e:
+                with cols[i]:
+                    st.error(f"{up.name}: no se pudo leer {plate_name} ({e})")
+                continue
+            plate_num = PLATE_NUM_RE.search(plate_name)
+            models.append({
+                "name": up.name if len(plates) <= 1 else
+                        f"{up.name} · plate {plate_num.group(1) if plate_num else plate_name}",
+                "raw": data, "repeats": reps, "digest": meta["digest"],
+                "plate_name": plate_meta["plate_name"], "core": plate_meta["core"],
+                "shutdown": plate_meta["shutdown"], "files": meta["files"],
+                "stages": plate_meta.get("stages", []),
+            })
+
+# ========== Reducción del G-code (una vez por plate, antes de repetirlo) ==========
+minified = []
+if models and minify_enabled:
+    with st.spinner("Reduciendo G-code…"):
+        minified = [minify_plate_cached(m, get_parse_cache()) for m in models]
+    for m, entry in zip(models, minified):
+        m["core"], m["core_digest"] = entry["core"], entry["core_digest"]
+        m["stages"] = [*m["stages"], entry["stage"]]
+
+# ========== Construcción del bloque de cambio (pre-wait + fijo) ==========
+pre_wait_block = build_wait_block(wait_mode, wait_minutes, target_bed) if wait_enabled else ""
+
+change_block_final = pre_wait_block + CHANGE_BLOCK_FIXED
 
 # ========== Secuencia (previa) — LISTA VISIBLE ==========
 if models:
     st.markdown("### 🔄 Secuencia de impresión")
-    preview_steps = compute_sequence_preview(
-        models=models,
-        mode=mode,
-        wait_enabled=wait_enabled,
-        wait_mode=wait_mode,
-        wait_minutes=wait_minutes,
-        target_bed=target_bed
-    )
-    total_prints = sum(m["repeats"] for m in models)
-    total_swaps  = sum(1 for s in preview_steps if s["Acción"] == "Cambio de placa")
-    total_waits  = sum(1 for s in preview_steps if s["Acción"] == "Esperar")
-    st.caption(f"Impresiones: {total_prints} • Esperas: {total_waits} • Cambios: {total_swaps}")
-
-    for s in preview_steps:
-        if s["Acción"] == "Imprimir":
-            st.write(f"{s['#']}. 🖨️ {s.get('Modelo','-')} — repetición {s.get('Repetición','-')}")
-        elif s["Acción"] == "Esperar":
-            st.write(f"{s['#']}. ⏳ Esperar {s['Detalle']}")
+    # Duración estimada: un estimado por plate (en caché) + los cambios según la temperatura
+    # con que termina cada impresión
+    with st.spinner("Estimando tiempos…"):
+        estimates = [estimate_plate_cached(m, get_parse_cache()) for m in models]
+    schedule = None
+    if mode == "optimized":
+        schedule = optimize_sequence_cached(models, change_block_final, estimates, get_parse_cache())
+        plan = schedule["plan"]
+    else:
+        plan = SequencePlan.for_mode([m["repeats"] for m in models], mode)
+    timeline = queue_timeline(models, plan, change_block_final, estimates)
+    wait_label = None
+    if wait_enabled:
+        wait_label = f"Esperar {wait_minutes:.1f} min" if wait_mode == "time" else f"Cama ≤ {int(target_bed)}°C"
+    total_swaps = plan.total_swaps
+    total_waits = total_swaps if wait_enabled else 0
+    st.caption(f"Impresiones: {plan.total_prints} • Esperas: {total_waits} • Cambios: {total_swaps}")
+    st.caption(f"⏱️ Total aprox.: {format_duration(timeline['total_s'])} "
+               f"(impresión {format_duration(timeline['print_s'])}, "
+               f"esperas y cambios {format_duration(timeline['change_s'])}) • "
+               f"🧵 Filamento aprox.: {timeline['filament_g']:.0f} g")
+    if minified:
+        st.caption("📦 " + minify_report_line(minified, [m["repeats"] for m in models])[2:])
+    if schedule is not None:
+        st.caption(f"🧠 Orden optimizado: serie {format_duration(schedule['serial_s'])}, "
+                   f"intercalado {format_duration(schedule['interleaved_s'])}.")
+    st.dataframe(sequence_preview_rows(plan, models, wait_label, timeline), hide_index=True,
+                 use_container_width=True)
+    parts = None
+    if split_enabled and (split_prints or split_mb or split_hours):
+        parts = split_plan(plan, models, change_block_final, max_prints=int(split_prints),
+                           max_bytes=int(split_mb * 1e6) or None, max_hours=split_hours or None,
+                           estimates=estimates)
+        if len(parts) > 1:
+            st.caption(f"✂️ Se arma en {len(parts)} partes: " +
+                       " • ".join(f"{p.total_prints} impr." for p in parts))
         else:
-            st.write(f"{s['#']}. 🔁 {s['Detalle']}")
+            parts = None
 
 st.markdown("---")
 
-# ========== Construcción del bloque de cambio (pre-wait + fijo) ==========
-pre_wait_block = ""
-if wait_enabled:
-    if wait_mode == "time" and wait_minutes > 0:
-        seconds = int(wait_minutes * 60)
-        pre_wait_block = (
-            "; PrintLooper: esperar por tiempo antes del cambio de placa\n"
-            "M140 S0\n"
-            f"G4 S{seconds}\n"
-        )
-    elif wait_mode == "temp":
-        pre_wait_block = (
-            "; PrintLooper: enfriar cama a temperatura objetivo antes del cambio de placa\n"
-            "M140 S0\n"
-            f"M190 R{int(target_bed)}\n"
+# ========== Generar 3MF compuesto ==========
+# El build corre en segundo plano (get_build_executor); la sesión guarda el BuildJob
+# y cada rerun sólo consulta su estado, así que tocar widgets no reinicia el trabajo.
+if models and st.button("Generar 3MF compuesto", help="Construye un único .3mf con todos los modelos y sus repeticiones, insertando el bloque G-code fijo entre cada impresión."):
+    prev_job = st.session_state.get("build_job")
+    if prev_job is not None and not prev_job.done:
+        prev_job.leave()  # si otra sesión sigue ese build, continúa para ella
+    # un envío en curso sigue con su archivo; sólo se olvida el resultado de uno terminado
+    if st.session_state.get("dispatch_job") is not None and st.session_state["dispatch_job"].done:
+        del st.session_state["dispatch_job"]
+    seq_items = [{"name": m["name"], "core": m["core"], "shutdown": m["shutdown"], "repeats": m["repeats"]}
+                 for m in models]
+    base = models[0]
+    # El orden optimizado sale de una búsqueda acotada por tiempo: va en la clave tal cual se mostró
+    cache_key = queue_cache_key(models, change_block_final, mode, base, minify=minify_enabled,
+                                **({"plan": [[list(r.models), r.count] for r in plan.runs]} if schedule else {}))
+    report_lines = [minify_report_line(minified, [m["repeats"] for m in models])] if minified else []
+    report_lines += schedule["report_lines"] if schedule else []
+    build_cache = get_build_cache()
+    out_dir = build_output_dir()
+
+    def run_build(job):
+        # Etapas: las de read_3mf de cada entrada (guardadas en el meta) + las del build
+        metrics = job.metrics = Metrics(trace_memory)
+        for m in models:
+            metrics.extend(m["stages"], prefix=f"{m['name']}: ")
+        # Build reproducible: la misma cola pedida de nuevo sale de la caché.
+        # Los segmentos van directo a la entrada del ZIP (sin armar el G-code completo)
+        # y el .3mf se escribe a un archivo temporal; la descarga se lee de ahí al hacer clic
+        # (Streamlit lee el archivo entero a memoria en ese momento: no va en streaming al navegador)
+        return build_cache.get_or_compute(
+            cache_key,
+            lambda: build_to_file(
+                lambda fp: build_final_3mf(base["files"], base["plate_name"],
+                                           job.track(iter_sequence(seq_items, change_block_final, mode, plan)),
+                                           reproducible=True, out=fp, metrics=metrics,
+                                           report_lines=report_lines),
+                dir=out_dir),
+            lambda o: o.size,
         )
 
-change_block_final = pre_wait_block + CHANGE_BLOCK_FIXED
+    file_name = f"queue_{base['name'].rsplit('.',1)[0]}.3mf"
+    if parts is not None:
+        # Cola dividida: las partes se arman en paralelo y se entregan en un .zip
+        cache_key = queue_cache_key(models, change_block_final, mode, base, minify=minify_enabled,
+                                    parts=[[[list(r.models), r.count] for r in p.runs] for p in parts])
 
-# ========== Generar 3MF compuesto ==========
-if uploads and st.button("Generar 3MF compuesto", help="Construye un único .3mf con todos los modelos y sus repeticiones, insertando el bloque G-code fijo entre cada impresión."):
-    try:
-        seq_items = [{"name": m["name"], "core": m["core"], "shutdown": m["shutdown"], "repeats": m["repeats"]}
-                     for m in models]
-        composite_gcode = compose_sequence(seq_items, change_block_final, mode)
-        base = models[0]
-        final_3mf = build_final_3mf(base["files"], base["plate_name"], composite_gcode)
-
-        st.success("✅ Cola compuesta generada.")
+        def run_build(job):
+            metrics = job.metrics = Metrics(trace_memory)
+            for m in models:
+                metrics.extend(m["stages"], prefix=f"{m['name']}: ")
+
+            def build_bundle():
+                outputs = build_parts(base["files"], base["plate_name"], seq_items, change_block_final, parts,
+                                      reproducible=True, dir=out_dir, report_lines=report_lines,
+                                      metrics=metrics, wrap=job.track)
+                try:
+                    return build_to_file(
+                        lambda fp: write_bundle(part_names(file_name, len(parts)), outputs, fp,
+                                                date_time=REPRODUCIBLE_DATE_TIME),
+                        dir=out_dir, suffix=".zip")
+                finally:
+                    for o in outputs:
+                        o.cleanup()
+
+            return build_cache.get_or_compute(cache_key, build_bundle, lambda o: o.size)
+
+    # El job (y con él el archivo de salida) vive lo que viva la sesión (ver OutputFile).
+    # Si otra sesión ya está armando la misma cola se sigue ese job en vez de esperarlo a ciegas.
+    st.session_state["build_job"] = get_build_executor().submit(
+        run_build, sequence_bytes(seq_items, plan, change_block_final), key=cache_key)
+    st.session_state["build_file_name"] = file_name if parts is None else file_name.rsplit(".", 1)[0] + ".zip"
+
+def jobs_running() -> bool:
+    return any(job is not None and not job.done
+               for job in (st.session_state.get("build_job"), st.session_state.get("dispatch_job")))
+
+def render_dispatch(output, file_name: str, bundle: bool):
+    printers = get_printers()
+    if not printers:
+        return
+    st.markdown("#### 📡 Enviar a impresoras")
+    names = st.multiselect("Impresoras", [p.name for p in printers], default=[p.name for p in printers],
+                           key="dispatch_printers")
+    distribute = bundle and st.checkbox("Repartir las partes (una por impresora, en ronda)", value=True,
+                                        key="dispatch_distribute")
+    send_job = st.session_state.get("dispatch_job")
+    busy = send_job is not None and not send_job.done
+    if st.button("📡 Enviar", disabled=busy or not names, key="dispatch_send",
+                 help="Sube la cola por FTPS a todas las impresoras elegidas a la vez; "
+                      "un envío cortado se retoma donde quedó."):
+        chosen = [p for p in printers if p.name in names]
+        artifacts = bundle_artifacts(output.path) if bundle else [(file_name, output)]
+        sizes = [a[1].size for a in artifacts]
+        total = sum(sizes) if distribute else sum(sizes) * len(chosen)
+
+        def run_dispatch(job):
+            def progress(_printer, n):
+                job.bytes_done += n
+            results = dispatch(artifacts, chosen, distribute=distribute, progress=progress,
+                               cancelled=lambda: job.cancel_requested)
+            job.check()
+            return results
+
+        st.session_state["dispatch_job"] = send_job = get_build_executor().submit(run_dispatch, total)
+        st.rerun()
+    if send_job is None:
+        return
+    if not send_job.done:
+        st.progress(send_job.progress, text=f"Enviando… {send_job.bytes_done / 1e6:.1f} MB • {send_job.elapsed:.0f} s")
+        if send_job.cancel_requested:
+            st.caption("Cancelando…")
+        elif st.button("Cancelar envío", key=f"cancel_dispatch_{send_job.id}"):
+            send_job.cancel()
+    elif send_job.status == DONE:
+        results = send_job.result
+        failed = [r["printer"] for r in results if not r["ok"]]
+        sent = sum(r["sent"] for r in results)
+        summary = (f"{sent / 1e6:.1f} MB a {len(results)} impresoras en {send_job.elapsed:.1f} s "
+                   f"({sent / max(send_job.elapsed, 1e-9) / 1e6:.1f} MB/s en total)")
+        if failed:
+            st.warning(f"⚠️ Falló el envío a {', '.join(failed)}. Enviado: {summary}. "
+                       "Volver a enviar retoma lo que quedó a medias.")
+        else:
+            st.success(f"📡 Enviado: {summary}.")
+        st.dataframe(stats_rows(results), hide_index=True, use_container_width=True)
+    elif send_job.status == CANCELLED:
+        st.warning("Envío cancelado (lo ya subido se retoma al volver a enviar).")
+    else:
+        st.error(f"Error al enviar: {send_job.error}")
+
+def render_build_job():
+    job = st.session_state.get("build_job")
+    if job is None:
+        return
+    if not job.done:
+        st.progress(job.progress, text=f"Generando… {job.segments} segmentos • "
+                                       f"{job.bytes_done / 1e6:.1f} MB de G-code procesados • {job.elapsed:.0f} s")
+        if job.shared:
+            st.caption("🔗 Otra sesión está generando la misma cola: se comparte ese build.")
+        if job.cancel_requested:
+            st.caption("Cancelando…")
+        elif st.button("Cancelar", key=f"cancel_build_{job.id}"):
+            if not job.leave():
+                # lo siguen otras sesiones: el build continúa para ellas, ésta lo suelta
+                del st.session_state["build_job"]
+                st.rerun()
+        return
+    if st.session_state.get("build_polling") and not jobs_running():
+        # terminó: un rerun completo deja de refrescar el fragmento
+        st.session_state["build_polling"] = False
+        st.rerun()
+    if job.status == DONE:
+        output = job.result
+        file_name = st.session_state.get("build_file_name", "queue.3mf")
+        bundle = file_name.endswith(".zip")
+        st.success(f"✅ {'Partes generadas' if bundle else 'Cola compuesta generada'} "
+                   f"({output.size / 1e6:.1f} MB, {job.elapsed:.1f} s).")
         st.download_button(
-            "⬇️ Descargar 3MF compuesto", data=final_3mf,
-            file_name=f"queue_{models[0]['name'].rsplit('.',1)[0]}.3mf",
-            mime="application/vnd.ms-package.3dmanufacturing-3dmodel+xml"
+            "⬇️ Descargar partes (.zip)" if bundle else "⬇️ Descargar 3MF compuesto", data=output.open,
+            file_name=file_name,
+            mime=BUNDLE_MIME if bundle else "application/vnd.ms-package.3dmanufacturing-3dmodel+xml"
         )
-    except Exception as e:
-        st.error(f"Error: {e}")
+        render_dispatch(output, file_name, bundle)
+    elif job.status == CANCELLED:
+        st.warning("Build cancelado.")
+    else:
+        st.error(f"Error: {job.error}")
+
+build_job = st.session_state.get("build_job")
+st.session_state["build_polling"] = jobs_running()
+st.fragment(render_build_job, run_every=1.0 if st.session_state["build_polling"] else None)()
+
+with diagnostics_panel:
+    if build_job is None or build_job.metrics is None:
+        st.caption("Generá una cola para ver el tiempo de cada etapa.")
+    elif not build_job.done:
+        st.caption("Build en curso…")
+    else:
+        stages = build_job.metrics.stages
+        st.dataframe(build_job.metrics.rows(), hide_index=True, use_container_width=True)
+        if not any(s["stage"].endswith("zip_write") for s in stages):
+            st.caption("La cola salió de la caché: sólo se muestran las etapas de lectura.")
+        st.caption(f"Total medido: {build_job.metrics.total_wall:.2f} s")
@@ -0,0 +1,5 @@
+# bench/__init__.py
+"""
+Benchmarks de PrintLooper: generador de .3mf sintéticos (bench.synthetic) y
+harness con baselines JSON (bench.run). Uso: python -m bench --help
+"""
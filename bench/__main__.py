@@ -0,0 +1,4 @@
+# bench/__main__.py
+from .run import main
+
+raise SystemExit(main())
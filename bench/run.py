@@ -0,0 +1,174 @@
+# bench/run.py
+"""
+Harness de benchmarks: mide read_3mf, split_core_and_shutdown,
+normalize_existing_change_sections, minify_gcode, compose_sequence y build_final_3mf sobre
+.3mf sintéticos de varios tamaños y cantidades de repeticiones.
+
+    python -m bench                               # corre y compara contra bench/baseline.json
+    python -m bench --update-baseline             # guarda los resultados como baseline
+    python -m bench --sizes 1 8 32 --repeats 1 10 100 --memory
+
+Cada caso se corre `--rounds` veces y se queda el mejor tiempo. Si un caso
+tarda más que baseline * --threshold (y la diferencia supera --min-delta),
+el comando termina con código 1. La baseline depende de la máquina: generarla
+en la misma donde se compara.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from core.gcode_loop import normalize_existing_change_sections, split_core_and_shutdown
+from core.metrics import Metrics, format_bytes
+from core.pipeline import minify_gcode
+from core.queue_builder import build_final_3mf, compose_sequence, iter_sequence, read_3mf
+
+from .synthetic import synthetic_3mf
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+CHANGE_BLOCK = ";========Starting to change plates =================\nG91;\nG380 S3 Z-20 F1200\n" \
+               "G380 S2 Z30 F1200\nG90;\n;========Finish to change plates =================\n"
+
+# Un caso: (id, función que corre la etapa y devuelve (bytes_in, bytes_out))
+Case = Tuple[str, Callable[[], Tuple[int, int]]]
+
+
+def build_cases(sizes_mb: List[float], repeats: List[int], max_output_mb: float) -> Iterator[Case]:
+    for size in sizes_mb:
+        data = synthetic_3mf(int(size * (1 << 20)))
+        meta = read_3mf(data)
+        text = meta["core"] + meta["shutdown"]
+        tag = f"{size:g}MB"
+
+        def run_read(data=data):
+            m = read_3mf(data)
+            return len(data), m["gcode_size"]
+
+        def run_split(text=text):
+            core, _ = split_core_and_shutdown(text)
+            return len(text), len(core)
+
+        def run_normalize(text=text):
+            new_text, _, _ = normalize_existing_change_sections(text, 3, 20.0, 30.0, [])
+            return len(text), len(new_text)
+
+        def run_minify(text=meta["core"]):
+            return len(text), len(minify_gcode(text))
+
+        yield f"read_3mf[{tag}]", run_read
+        yield f"split_core_and_shutdown[{tag}]", run_split
+        yield f"normalize_existing_change_sections[{tag}]", run_normalize
+        yield f"minify_gcode[{tag}]", run_minify
+
+        items = [{"name": "a", "core": meta["core"], "shutdown": meta["shutdown"], "repeats": 1}]
+        for reps in repeats:
+            if size * reps > max_output_mb:
+                continue
+            seq = [{**items[0], "repeats": reps}]
+
+            def run_compose(seq=seq):
+                out = compose_sequence(seq, CHANGE_BLOCK, "serial")
+                return len(seq[0]["core"]), len(out)
+
+            def run_build(seq=seq, meta=meta):
+                with tempfile.TemporaryFile() as fp:
+                    size_out = build_final_3mf(meta["files"], meta["plate_name"],
+                                               iter_sequence(seq, CHANGE_BLOCK, "serial"),
+                                               reproducible=True, out=fp)
+                return len(seq[0]["core"]) * seq[0]["repeats"], size_out
+
+            yield f"compose_sequence[{tag}x{reps}]", run_compose
+            yield f"build_final_3mf[{tag}x{reps}]", run_build
+
+
+def measure(case_id: str, fn: Callable[[], Tuple[int, int]], rounds: int, memory: bool) -> Dict:
+    """Mejor tiempo de `rounds` corridas (+ una con tracemalloc si memory)."""
+    best: Optional[Dict] = None
+    for _ in range(max(1, rounds)):
+        metrics = Metrics()
+        with metrics.stage(case_id) as stage:
+            stage["bytes_in"], stage["bytes_out"] = fn()
+        if best is None or stage["wall_s"] < best["wall_s"]:
+            best = stage
+    if memory:
+        metrics = Metrics(trace_memory=True)
+        with metrics.stage(case_id) as stage:
+            fn()
+        best["peak_bytes"] = stage["peak_bytes"]
+    return {k: v for k, v in best.items() if k != "stage"}
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], threshold: float,
+            min_delta: float) -> List[str]:
+    """Mensajes de regresión (tiempo y, si ambos la tienen, memoria pico)."""
+    problems = []
+    for case_id, cur in results.items():
+        ref = baseline.get(case_id)
+        if ref is None:
+            continue
+        if cur["wall_s"] > ref["wall_s"] * threshold and cur["wall_s"] - ref["wall_s"] > min_delta:
+            problems.append(f"{case_id}: {cur['wall_s']:.3f} s vs {ref['wall_s']:.3f} s "
+                            f"(x{cur['wall_s'] / ref['wall_s']:.2f})")
+        if cur.get("peak_bytes") and ref.get("peak_bytes") and cur["peak_bytes"] > ref["peak_bytes"] * threshold:
+            problems.append(f"{case_id}: memoria pico {format_bytes(cur['peak_bytes'])} vs "
+                            f"{format_bytes(ref['peak_bytes'])}")
+    return problems
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m bench", description="Benchmarks de PrintLooper.")
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 8],
+                        help="Tamaños del G-code del plate, en MB.")
+    parser.add_argument("--repeats", type=int, nargs="+", default=[1, 10, 100],
+                        help="Repeticiones para compose_sequence / build_final_3mf.")
+    parser.add_argument("--max-output-mb", type=float, default=1024,
+                        help="Saltea combinaciones tamaño x repeticiones más grandes que esto.")
+    parser.add_argument("--rounds", type=int, default=3, help="Corridas por caso (se toma la mejor).")
+    parser.add_argument("--memory", action="store_true", help="Medir memoria pico con tracemalloc (una corrida extra).")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Archivo JSON de baseline.")
+    parser.add_argument("--update-baseline", action="store_true", help="Guardar los resultados como baseline.")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="Regresión si el caso tarda más que baseline * threshold.")
+    parser.add_argument("--min-delta", type=float, default=0.005,
+                        help="Diferencias menores (en segundos) no cuentan como regresión.")
+    parser.add_argument("--output", help="Guardar también los resultados en este JSON.")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    results: Dict[str, Dict] = {}
+    print(f"{'caso':<50} {'tiempo':>9} {'cpu':>9} {'entrada':>10} {'salida':>10} {'memoria':>10}")
+    for case_id, fn in build_cases(args.sizes, args.repeats, args.max_output_mb):
+        r = results[case_id] = measure(case_id, fn, args.rounds, args.memory)
+        print(f"{case_id:<50} {r['wall_s']:>8.3f}s {r['cpu_s']:>8.3f}s {format_bytes(r['bytes_in']):>10} "
+              f"{format_bytes(r['bytes_out']):>10} {format_bytes(r['peak_bytes']):>10}", flush=True)
+
+    doc = {
+        "meta": {"python": platform.python_version(), "platform": platform.platform(),
+                 "date": time.strftime("%Y-%m-%d %H:%M:%S"), "rounds": args.rounds},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(doc, f, indent=2, sort_keys=True)
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(doc, f, indent=2, sort_keys=True)
+        print(f"Baseline guardada en {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"No hay baseline en {args.baseline} (correr con --update-baseline).")
+        return 0
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+    problems = compare(results, baseline, args.threshold, args.min_delta)
+    for p in problems:
+        print(f"REGRESIÓN  {p}", file=sys.stderr)
+    if not problems:
+        print(f"Sin regresiones contra {args.baseline} (umbral x{args.threshold:g}).")
+    return 1 if problems else 0
@@ -0,0 +1,122 @@
+# bench/synthetic.py
+"""
+.3mf sintéticos con la forma de los de Bambu Studio, del tamaño que se pida:
+
+  - Metadata/plate_N.gcode: header, config, secciones 'change plates' con
+    ciclos G380, capas de G1 y, al final, '; END_OF_PRINT' + apagado.
+  - Metadata/plate_N.gcode.md5, plate_N.png (preview) y project_settings.config.
+  - 3D/3dmodel.model (XML grande y comprimible) y una textura (bytes al azar,
+    no comprimible).
+
+Todo sale de una semilla, así que el mismo pedido da los mismos bytes.
+"""
+import hashlib
+import io
+import random
+import zipfile
+from typing import List
+
+HEADER = (
+    "; HEADER_BLOCK_START\n"
+    "; BambuStudio 01.09.00.70\n"
+    "; model printing time: 1h 2m 3s; total estimated time: 1h 10m 0s\n"
+    "; total layer number: {layers}\n"
+    "; filament_density: 1.24\n"
+    "; HEADER_BLOCK_END\n\n"
+    "; CONFIG_BLOCK_START\n"
+    "; layer_height = 0.2\n"
+    "; nozzle_temperature = 220\n"
+    "; hot_plate_temp = 65\n"
+    "; CONFIG_BLOCK_END\n\n"
+    "M140 S65\nM104 S220\nM190 S65\nM109 S220\nG90\nM83\nG28\n"
+)
+
+CHANGE_SECTION = (
+    ";========Starting to change plates =================\n"
+    "G91;\n"
+    "{cycles}"
+    "G90;\n"
+    "G28 X\n"
+    ";========Finish to change plates =================\n"
+)
+
+SHUTDOWN = (
+    "; filament end gcode \n"
+    "M106 P3 S0\n"
+    "; END_OF_PRINT\n"
+    "M400 ; wait for buffer to clear\n"
+    "G92 E0 ; zero the extruder\n"
+    "G1 E-0.8 F1800 ; retract\n"
+    "M104 S0 ; turn off hotend\n"
+    "M140 S0 ; turn off bed\n"
+    "M106 S0 ; turn off fan\n"
+    "M84 ; disable motors\n"
+)
+
+
+def change_section(cycles: int = 2, down_mm: float = 20.0, up_mm: float = 30.0) -> str:
+    lines = "".join(f"G380 S3 Z-{down_mm:g} F1200\nG380 S2 Z{up_mm:g} F1200\n" for _ in range(cycles))
+    return CHANGE_SECTION.format(cycles=lines)
+
+
+def synthetic_gcode(target_bytes: int, change_sections: int = 2, cycles: int = 2,
+                    seed: int = 0) -> str:
+    """
+    G-code de ~target_bytes: las secciones 'change plates' quedan repartidas
+    en el cuerpo, como en los archivos ya preparados para el A1.
+    """
+    rng = random.Random(seed)
+    section = change_section(cycles)
+    body: List[str] = []
+    size = 0
+    layer = 0
+    z = 0.0
+    while size < target_bytes:
+        layer += 1
+        z += 0.2
+        lines = [f"; CHANGE_LAYER\n; Z_HEIGHT: {z:.2f}\n; LAYER_HEIGHT: 0.2\nG1 Z{z:.2f} F600\n"]
+        x, y = rng.uniform(20, 200), rng.uniform(20, 200)
+        for _ in range(200):
+            x = min(250.0, max(0.0, x + rng.uniform(-5, 5)))
+            y = min(250.0, max(0.0, y + rng.uniform(-5, 5)))
+            lines.append(f"G1 X{x:.3f} Y{y:.3f} E{rng.uniform(0.01, 0.5):.5f}\n")
+            if rng.random() < 0.05:
+                lines.append(f"G1 F{rng.choice((1200, 3000, 6000, 12000))}\n")
+        chunk = "".join(lines)
+        body.append(chunk)
+        size += len(chunk)
+    if change_sections:
+        step = max(1, len(body) // (change_sections + 1))
+        for k in range(change_sections, 0, -1):
+            body.insert(min(len(body), k * step), section)
+    return HEADER.format(layers=layer) + "".join(body) + SHUTDOWN
+
+
+def synthetic_3mf(gcode_bytes: int, plates: int = 1, model_bytes: int = 4 << 20,
+                  texture_bytes: int = 2 << 20, change_sections: int = 2, cycles: int = 2,
+                  md5: bool = True, seed: int = 0) -> bytes:
+    """Arma el .3mf completo en memoria (un G-code por plate, distinto por semilla)."""
+    rng = random.Random(seed)
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("[Content_Types].xml",
+                   '<?xml version="1.0" encoding="UTF-8"?>\n<Types xmlns="http://schemas.openxmlformats.org/'
+                   'package/2006/content-types"><Default Extension="model" ContentType="application/'
+                   'vnd.ms-package.3dmanufacturing-3dmodel+xml"/></Types>\n')
+        vertex = '<vertex x="{:.4f}" y="{:.4f}" z="{:.4f}"/>\n'
+        model = io.StringIO()
+        model.write('<?xml version="1.0" encoding="UTF-8"?>\n<model unit="millimeter"><resources><object id="1">'
+                    "<mesh><vertices>\n")
+        while model.tell() < model_bytes:
+            model.write(vertex.format(rng.uniform(0, 250), rng.uniform(0, 250), rng.uniform(0, 50)))
+        model.write("</vertices></mesh></object></resources></model>\n")
+        z.writestr("3D/3dmodel.model", model.getvalue())
+        z.writestr("3D/Textures/texture_1.png", rng.randbytes(texture_bytes))
+        for p in range(1, plates + 1):
+            g = synthetic_gcode(gcode_bytes, change_sections, cycles, seed=seed + p)
+            z.writestr(f"Metadata/plate_{p}.gcode", g)
+            if md5:
+                z.writestr(f"Metadata/plate_{p}.gcode.md5", hashlib.md5(g.encode("utf-8")).hexdigest() + "\n")
+            z.writestr(f"Metadata/plate_{p}.png", b"\x89PNG\r\n\x1a\n" + rng.randbytes(32 << 10))
+        z.writestr("Metadata/project_settings.config", '{\n  "printer_model": "Bambu Lab A1"\n}\n')
+    return out.getvalue()
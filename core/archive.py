@@ -0,0 +1,480 @@
+# core/archive.py
+import io
+import os
+import struct
+import time
+import zlib
+import zipfile
+from collections.abc import Mapping
+from typing import BinaryIO, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+# Límite a partir del cual un campo de 32 bits no alcanza y hace falta ZIP64
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_COUNT_LIMIT = 0xFFFF
+
+_LOCAL_HEADER = struct.Struct("<4sHHHHHLLLHH")
+_CENTRAL_DIR = struct.Struct("<4s4B4H3L5H2L")
+_END_RECORD = struct.Struct("<4sHHHHLLH")
+_END_RECORD64 = struct.Struct("<4sQHHLLQQQQ")
+_END_LOCATOR64 = struct.Struct("<4sLQL")
+
+_FLAG_ENCRYPTED = 0x1
+_FLAG_DATA_DESCRIPTOR = 0x8
+_FLAG_UTF8 = 0x800
+
+Source = Union[bytes, bytearray, memoryview, str, os.PathLike]
+
+
+def _dos_datetime(date_time: Tuple[int, int, int, int, int, int]) -> Tuple[int, int]:
+    y, mo, d, h, mi, s = date_time
+    return (h << 11) | (mi << 5) | (s // 2), ((y - 1980) << 9) | (mo << 5) | d
+
+
+def _strip_zip64_extra(extra: bytes) -> bytes:
+    """Quita el campo ZIP64 (id 0x0001) del 'extra'; lo regenera ZipWriter."""
+    out = []
+    i = 0
+    while i + 4 <= len(extra):
+        tag, size = struct.unpack_from("<HH", extra, i)
+        if tag != 0x0001:
+            out.append(extra[i:i + 4 + size])
+        i += 4 + size
+    return b"".join(out)
+
+
+# --- CRC32 combinable ---------------------------------------------------------------
+# crc32(A + B) se puede obtener de crc32(A), crc32(B) y len(B) aplicando a crc32(A)
+# el operador lineal "agregar len(B) bytes en cero" (matriz 32x32 sobre GF(2)),
+# igual que crc32_combine() de zlib (que el módulo zlib de Python no expone).
+
+def _gf2_times(mat: List[int], vec: int) -> int:
+    out = 0
+    i = 0
+    while vec:
+        if vec & 1:
+            out ^= mat[i]
+        vec >>= 1
+        i += 1
+    return out
+
+
+def _gf2_compose(a: List[int], b: List[int]) -> List[int]:
+    """Matriz de aplicar b y después a."""
+    return [_gf2_times(a, col) for col in b]
+
+
+def crc32_shift(length: int) -> List[int]:
+    """Operador para crc32_combine con un segundo bloque de `length` bytes."""
+    op = [1 << n for n in range(32)]                  # identidad
+    square = [0xEDB88320] + [1 << n for n in range(31)]  # un bit en cero
+    for _ in range(3):                                # -> un byte en cero
+        square = _gf2_compose(square, square)
+    while length:
+        if length & 1:
+            op = _gf2_compose(square, op)
+        length >>= 1
+        if length:
+            square = _gf2_compose(square, square)
+    return op
+
+
+def crc32_combine(crc1: int, crc2: int, shift: List[int]) -> int:
+    """crc32(A + B) a partir de crc32(A), crc32(B) y crc32_shift(len(B))."""
+    return _gf2_times(shift, crc1) ^ crc2
+
+
+class DeflatedSegment(NamedTuple):
+    """
+    Bloque de texto comprimido una sola vez para repetirlo dentro de una entrada:
+    deflate crudo cerrado en un límite de byte (Z_SYNC_FLUSH, sin bloque final),
+    así que se puede concatenar cuantas veces haga falta.
+    """
+    data: bytes
+    crc: int
+    size: int
+    shift: List[int]
+
+
+def deflate_segment(data: bytes, level: int = zlib.Z_DEFAULT_COMPRESSION) -> DeflatedSegment:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    payload = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    return DeflatedSegment(payload, zlib.crc32(data), len(data), crc32_shift(len(data)))
+
+
+class _BufferReader(io.RawIOBase):
+    """
+    Lector seekable sobre un buffer (bytearray, memoryview, mmap) sin copiarlo:
+    io.BytesIO sólo evita la copia con bytes.
+    """
+
+    def __init__(self, buf):
+        super().__init__()
+        self._buf = memoryview(buf).cast("B")
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self._buf) if size is None or size < 0 else min(len(self._buf), self._pos + size)
+        data = self._buf[self._pos:end].tobytes()
+        self._pos = max(self._pos, end)
+        return data
+
+    def readall(self) -> bytes:
+        return self.read()
+
+    def readinto(self, b) -> int:
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._buf)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def close(self) -> None:
+        self._buf.release()
+        super().close()
+
+
+class Lazy3MF(Mapping):
+    """
+    Vista perezosa de un .3mf: al abrirlo sólo se lee el directorio central
+    (una vez; los accesos siguientes van directo a la cabecera local de cada
+    miembro). Se comporta como un dict nombre->bytes (lo que devolvía read_3mf
+    antes), pero cada miembro se descomprime recién cuando se accede, y raw()
+    permite copiar los bytes comprimidos tal cual sin inflarlos.
+    La fuente puede ser un buffer en memoria (no se copia: con bytes se guarda
+    el mismo objeto) o la ruta de un archivo.
+    """
+
+    def __init__(self, source: Source):
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            self._data: Optional[Union[bytes, bytearray, memoryview]] = source
+            self._path: Optional[str] = None
+        else:
+            self._data = None
+            self._path = os.fspath(source)
+        with self._open() as fp, zipfile.ZipFile(fp, "r", allowZip64=True) as z:
+            self._infos: Dict[str, zipfile.ZipInfo] = {i.filename: i for i in z.infolist()}
+
+    def __reduce__(self):
+        if self._path is not None:
+            return (Lazy3MF, (self._path,))
+        return (Lazy3MF, (self._data if isinstance(self._data, bytes) else bytes(self._data),))
+
+    def _open(self) -> BinaryIO:
+        # Un handle nuevo por acceso: se puede leer desde varios hilos a la vez
+        if isinstance(self._data, bytes):
+            return io.BytesIO(self._data)  # con bytes, BytesIO comparte el buffer
+        if self._data is not None:
+            return _BufferReader(self._data)
+        return open(self._path, "rb")
+
+    def _member(self, name: str) -> Tuple[zipfile.ZipInfo, BinaryIO]:
+        """Handle nuevo posicionado al comienzo de los datos comprimidos del miembro."""
+        info = self._infos[name]
+        if info.flag_bits & _FLAG_ENCRYPTED:
+            raise ValueError(f"Entrada cifrada no soportada: {name}")
+        fp = self._open()
+        try:
+            fp.seek(info.header_offset)
+            header = fp.read(_LOCAL_HEADER.size)
+            if len(header) != _LOCAL_HEADER.size or header[:4] != b"PK\x03\x04":
+                raise zipfile.BadZipFile(f"Cabecera local inválida para {name}")
+            name_len, extra_len = struct.unpack_from("<HH", header, 26)
+            fp.seek(info.header_offset + _LOCAL_HEADER.size + name_len + extra_len)
+        except BaseException:
+            fp.close()
+            raise
+        return info, fp
+
+    @property
+    def size(self) -> int:
+        """Tamaño del archivo .3mf fuente en bytes."""
+        if self._data is not None:
+            with memoryview(self._data) as view:
+                return view.nbytes
+        return os.path.getsize(self._path)
+
+    def __getitem__(self, name: str) -> bytes:
+        if name not in self._infos:
+            raise KeyError(name)
+        with self.open(name) as f:
+            return f.read()
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._infos)
+
+    def __len__(self) -> int:
+        return len(self._infos)
+
+    def __contains__(self, name) -> bool:
+        return name in self._infos
+
+    def getinfo(self, name: str) -> zipfile.ZipInfo:
+        return self._infos[name]
+
+    def infolist(self) -> List[zipfile.ZipInfo]:
+        return list(self._infos.values())
+
+    def open(self, name: str) -> BinaryIO:
+        """Abre un miembro para lectura en streaming (descomprime por bloques y valida el CRC)."""
+        info, fp = self._member(name)
+        return zipfile.ZipExtFile(fp, "r", info, None, True)
+
+    def raw(self, name: str) -> Tuple[zipfile.ZipInfo, bytes]:
+        """Devuelve (ZipInfo, datos comprimidos) del miembro, sin descomprimir."""
+        info, fp = self._member(name)
+        with fp:
+            data = fp.read(info.compress_size)
+        if len(data) != info.compress_size:
+            raise zipfile.BadZipFile(f"Datos truncados en {name}")
+        return info, data
+
+
+class _EntryWriter:
+    """Stream de escritura de una entrada deflate de ZipWriter (ver open_entry)."""
+
+    def __init__(self, owner: "ZipWriter", zinfo: zipfile.ZipInfo, level: int):
+        self.closed = False
+        self._owner = owner
+        self._zinfo = zinfo
+        self._level = level
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        self._pending = False
+        self._crc = 0
+        self._file_size = 0
+        self._compress_size = 0
+
+    def __enter__(self) -> "_EntryWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+
+    @property
+    def file_size(self) -> int:
+        """Bytes sin comprimir escritos hasta ahora."""
+        return self._file_size
+
+    @property
+    def compress_size(self) -> int:
+        """Bytes comprimidos emitidos hasta ahora (completo recién después de close())."""
+        return self._compress_size
+
+    def write(self, data) -> int:
+        n = len(data)
+        if n:
+            self._crc = zlib.crc32(data, self._crc)
+            self._file_size += n
+            self._emit(self._compressor.compress(data))
+            self._pending = True
+        return n
+
+    def write_segment(self, seg: DeflatedSegment) -> None:
+        """Empalma un segmento ya comprimido (ver deflate_segment) sin recomprimirlo."""
+        if self._pending:
+            # Cerrar lo comprimido hasta acá en un límite de byte y arrancar un
+            # compresor nuevo: el siguiente no puede referenciar datos anteriores.
+            self._emit(self._compressor.flush(zlib.Z_SYNC_FLUSH))
+            self._compressor = zlib.compressobj(self._level, zlib.DEFLATED, -15)
+            self._pending = False
+        self._emit(seg.data)
+        self._crc = crc32_combine(self._crc, seg.crc, seg.shift)
+        self._file_size += seg.size
+
+    def _emit(self, chunk: bytes) -> None:
+        if chunk:
+            self._owner._fp.write(chunk)
+            self._compress_size += len(chunk)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self._emit(self._compressor.flush())
+        zinfo = self._zinfo
+        zinfo.CRC = self._crc
+        zinfo.file_size = self._file_size
+        zinfo.compress_size = self._compress_size
+        self._owner._finish_entry(zinfo)
+        self.closed = True
+
+
+class ZipWriter:
+    """
+    Escritor de ZIP mínimo (con ZIP64) pensado para armar el .3mf de salida:
+      - writestr(): entrada nueva comprimida con deflate.
+      - write_raw(): copia una entrada ya comprimida (p.ej. Lazy3MF.raw) sin
+        inflar ni volver a comprimir.
+      - open_entry(): stream de escritura para entradas grandes; acepta tanto
+        bytes como segmentos pre-comprimidos (write_segment).
+    El destino tiene que ser seekable (BytesIO, archivo temporal...): los
+    tamaños/CRC de las entradas en streaming se corrigen al cerrarlas.
+    """
+
+    def __init__(self, fp: BinaryIO, level: int = zlib.Z_DEFAULT_COMPRESSION):
+        if not fp.seekable():
+            raise ValueError("ZipWriter necesita un destino seekable.")
+        self._fp = fp
+        self._base = fp.tell()
+        self._level = level
+        self._entries: List[zipfile.ZipInfo] = []
+        self._names = set()
+        self._open_entry: Optional[_EntryWriter] = None
+        self.closed = False
+
+    def __enter__(self) -> "ZipWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            # salida a medias: no tiene sentido escribir el directorio central
+            self.closed = True
+
+    # --- entradas -----------------------------------------------------------------
+    def _new_info(self, name: str, date_time=None) -> zipfile.ZipInfo:
+        if self._open_entry is not None:
+            raise ValueError("Hay una entrada en streaming sin cerrar.")
+        if name in self._names:
+            raise ValueError(f"Entrada duplicada: {name}")
+        zinfo = zipfile.ZipInfo(name, date_time=date_time or time.localtime(time.time())[:6])
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+        zinfo.external_attr = 0o600 << 16
+        zinfo.CRC = 0
+        return zinfo
+
+    def _write_local_header(self, zinfo: zipfile.ZipInfo, zip64: bool) -> None:
+        name, flags = self._encode_name(zinfo)
+        extra = zinfo.extra
+        file_size, compress_size = zinfo.file_size, zinfo.compress_size
+        version = 20
+        if zip64:
+            extra = struct.pack("<HHQQ", 0x0001, 16, file_size, compress_size) + extra
+            file_size = compress_size = ZIP64_LIMIT
+            version = 45
+        dostime, dosdate = _dos_datetime(zinfo.date_time)
+        self._fp.write(_LOCAL_HEADER.pack(
+            b"PK\x03\x04", version, flags, zinfo.compress_type, dostime, dosdate,
+            zinfo.CRC, compress_size, file_size, len(name), len(extra)))
+        self._fp.write(name)
+        self._fp.write(extra)
+
+    @staticmethod
+    def _encode_name(zinfo: zipfile.ZipInfo) -> Tuple[bytes, int]:
+        flags = zinfo.flag_bits & ~(_FLAG_DATA_DESCRIPTOR | _FLAG_UTF8)
+        try:
+            return zinfo.filename.encode("ascii"), flags
+        except UnicodeEncodeError:
+            return zinfo.filename.encode("utf-8"), flags | _FLAG_UTF8
+
+    def _add(self, zinfo: zipfile.ZipInfo, payload: bytes) -> None:
+        zinfo.header_offset = self._fp.tell() - self._base
+        zip64 = zinfo.file_size > ZIP64_LIMIT or zinfo.compress_size > ZIP64_LIMIT
+        self._write_local_header(zinfo, zip64)
+        self._fp.write(payload)
+        self._entries.append(zinfo)
+        self._names.add(zinfo.filename)
+
+    def writestr(self, name: str, data: Union[bytes, str], date_time=None) -> None:
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        zinfo = self._new_info(name, date_time)
+        compressor = zlib.compressobj(self._level, zlib.DEFLATED, -15)
+        payload = compressor.compress(data) + compressor.flush()
+        zinfo.CRC = zlib.crc32(data)
+        zinfo.file_size = len(data)
+        zinfo.compress_size = len(payload)
+        self._add(zinfo, payload)
+
+    def write_raw(self, src: zipfile.ZipInfo, raw: bytes, name: Optional[str] = None) -> None:
+        """Copia una entrada comprimida tal cual (mismo método, CRC y tamaños)."""
+        zinfo = self._new_info(name or src.filename, src.date_time)
+        zinfo.compress_type = src.compress_type
+        zinfo.CRC = src.CRC
+        zinfo.file_size = src.file_size
+        zinfo.compress_size = len(raw)
+        zinfo.flag_bits = src.flag_bits
+        zinfo.external_attr = src.external_attr
+        zinfo.create_system = src.create_system
+        zinfo.comment = src.comment
+        zinfo.extra = _strip_zip64_extra(src.extra)
+        self._add(zinfo, raw)
+
+    def open_entry(self, name: str, date_time=None) -> _EntryWriter:
+        """
+        Abre una entrada deflate para escribirla por partes. Hay que cerrarla
+        (o usarla como context manager) antes de escribir otra entrada.
+        """
+        zinfo = self._new_info(name, date_time)
+        zinfo.header_offset = self._fp.tell() - self._base
+        # Cabecera provisoria con ZIP64: el tamaño final puede superar 4 GB
+        self._write_local_header(zinfo, zip64=True)
+        self._open_entry = _EntryWriter(self, zinfo, self._level)
+        return self._open_entry
+
+    def _finish_entry(self, zinfo: zipfile.ZipInfo) -> None:
+        end = self._fp.tell()
+        self._fp.seek(self._base + zinfo.header_offset)
+        self._write_local_header(zinfo, zip64=True)
+        self._fp.seek(end)
+        self._entries.append(zinfo)
+        self._names.add(zinfo.filename)
+        self._open_entry = None
+
+    # --- cierre -------------------------------------------------------------------
+    def close(self) -> None:
+        if self.closed:
+            return
+        if self._open_entry is not None:
+            self._open_entry.close()
+        fp = self._fp
+        cd_start = fp.tell() - self._base
+        for zinfo in self._entries:
+            name, flags = self._encode_name(zinfo)
+            file_size, compress_size, offset = zinfo.file_size, zinfo.compress_size, zinfo.header_offset
+            zip64_fields = []
+            if file_size > ZIP64_LIMIT or compress_size > ZIP64_LIMIT:
+                zip64_fields += [file_size, compress_size]
+                file_size = compress_size = ZIP64_LIMIT
+            if offset > ZIP64_LIMIT:
+                zip64_fields.append(offset)
+                offset = ZIP64_LIMIT
+            extra = zinfo.extra
+            version = 20
+            if zip64_fields:
+                extra = struct.pack("<HH" + "Q" * len(zip64_fields), 0x0001,
+                                    8 * len(zip64_fields), *zip64_fields) + extra
+                version = 45
+            dostime, dosdate = _dos_datetime(zinfo.date_time)
+            fp.write(_CENTRAL_DIR.pack(
+                b"PK\x01\x02", version, zinfo.create_system, version, 0, flags,
+                zinfo.compress_type, dostime, dosdate, zinfo.CRC, compress_size, file_size,
+                len(name), len(extra), len(zinfo.comment), 0, zinfo.internal_attr,
+                zinfo.external_attr, offset))
+            fp.write(name)
+            fp.write(extra)
+            fp.write(zinfo.comment)
+        cd_end = fp.tell() - self._base
+        count, cd_size = len(self._entries), cd_end - cd_start
+        if count > ZIP64_COUNT_LIMIT or cd_start > ZIP64_LIMIT or cd_size > ZIP64_LIMIT:
+            fp.write(_END_RECORD64.pack(b"PK\x06\x06", 44, 45, 45, 0, 0,
+                                        count, count, cd_size, cd_start))
+            fp.write(_END_LOCATOR64.pack(b"PK\x06\x07", 0, cd_end, 1))
+            count = min(count, ZIP64_COUNT_LIMIT)
+            cd_size = min(cd_size, ZIP64_LIMIT)
+            cd_start = min(cd_start, ZIP64_LIMIT)
+        fp.write(_END_RECORD.pack(b"PK\x05\x06", 0, 0, count, count, cd_size, cd_start, 0))
+        fp.flush()
+        self.closed = True
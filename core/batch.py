@@ -0,0 +1,238 @@
+# core/batch.py
+"""
+Motor de trabajos sin interfaz: arma colas .3mf a partir de una especificación
+(dict / JSON), igual que el botón "Generar 3MF compuesto" de la app.
+
+Especificación de un trabajo:
+
+    {
+      "files": [{"path": "a.3mf", "repeats": 3}, {"path": "b.3mf", "plate": 2, "repeats": 1}],
+      "mode": "serial",                     # "serial" | "interleaved" | "optimized"
+      "wait": {"mode": "temp", "target_bed": 35},   # o {"mode": "time", "minutes": 2}; null = sin espera
+      "change_block": {"template": "cambio.gcode", "cycles": 2, "down_mm": 20, "up_mm": 30},
+      "split": {"max_prints": 20, "max_mb": 500, "max_hours": 12},   # opcional
+      "minify": false,                      # true: reducir el G-code (ver core.pipeline.minify_gcode)
+      "output": "queue_a.3mf",
+      "reproducible": true
+    }
+
+"plate" es opcional (por defecto el plate 1 o el primer G-code); un mismo .3mf
+puede aparecer varias veces con plates distintos y se lee una sola vez.
+"change_block" es opcional (por defecto CHANGE_BLOCK_FIXED); con "cycles" la
+plantilla pasa por build_change_block_from_template. Las rutas relativas se
+resuelven contra el directorio del archivo de especificación.
+Con "split" la cola se divide en partes (límites opcionales: impresiones, MB de
+G-code sin comprimir, horas estimadas); si sale más de una, la salida es un
+.zip (queue_a.zip) con queue_a_parte01de03.3mf, ... cada una con su apagado.
+Con "mode": "optimized" el orden sale de core.scheduler (cada plate se estima
+una vez) y la explicación queda en Metadata/queue_report.txt.
+"""
+import json
+import os
+import time
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+from .gcode_loop import CHANGE_BLOCK_FIXED, build_change_block_from_template, build_wait_block
+from .estimator import estimate_gcode
+from .metrics import Metrics
+from .queue_builder import (PLATE_NUM_RE, REPRODUCIBLE_DATE_TIME, build_final_3mf, iter_sequence,
+                            minify_plate, minify_report_line, read_3mf, read_plate)
+from .scheduler import optimize_sequence
+from .sequence import SequencePlan
+from .split import build_parts, part_names, split_plan, write_bundle
+
+MODES = ("serial", "interleaved", "optimized")
+SPLIT_LIMITS = ("max_prints", "max_mb", "max_hours")
+
+
+def load_jobs(path: str) -> List[Dict]:
+    """Lee un archivo JSON con un trabajo o una lista de trabajos."""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    jobs = data if isinstance(data, list) else [data]
+    base_dir = os.path.dirname(os.path.abspath(path))
+    for job in jobs:
+        job.setdefault("base_dir", base_dir)
+    return jobs
+
+
+def _resolve(job: Dict, path: str) -> str:
+    return path if os.path.isabs(path) else os.path.join(job.get("base_dir") or os.getcwd(), path)
+
+
+def change_block_for(job: Dict) -> str:
+    """Bloque que va entre impresiones: espera (si hay) + bloque de cambio."""
+    wait = job.get("wait") or {}
+    pre_wait_block = build_wait_block(wait.get("mode", ""), float(wait.get("minutes", 0)),
+                                      float(wait.get("target_bed", 0))) if wait else ""
+    spec = job.get("change_block") or {}
+    template = CHANGE_BLOCK_FIXED
+    if spec.get("template"):
+        with open(_resolve(job, spec["template"]), "r", encoding="utf-8") as f:
+            template = f.read()
+    if spec.get("cycles") is not None:
+        template = build_change_block_from_template(int(spec["cycles"]), float(spec.get("down_mm", 20)),
+                                                    float(spec.get("up_mm", 30)), template)
+    return pre_wait_block + template
+
+
+def _spec_label(f: Dict) -> str:
+    """Entrada de "files" como se escribe en la línea de comandos (a.3mf@2), para los mensajes."""
+    return f"{f.get('path')}@{f['plate']}" if f.get("plate") is not None else str(f.get("path"))
+
+
+def model_name(path: str, meta: Dict) -> str:
+    """
+    Nombre de un modelo en reportes y mensajes: el del archivo, y si el .3mf
+    tiene varios plates también el plate ("a.3mf · plate 2", como en la app).
+    """
+    name = os.path.basename(path)
+    if len(meta.get("plates", ())) <= 1:
+        return name
+    m = PLATE_NUM_RE.search(meta["plate_name"] or "")
+    return f"{name} · plate {m.group(1) if m else meta['plate_name']}"
+
+
+def validate_job(job: Dict) -> None:
+    if not job.get("files"):
+        raise ValueError("El trabajo no tiene archivos ('files').")
+    if job.get("mode", "serial") not in MODES:
+        raise ValueError(f"Modo inválido: {job.get('mode')!r} (usar {' / '.join(MODES)}).")
+    for f in job["files"]:
+        if int(f.get("repeats", 1)) < 1:
+            raise ValueError(f"Repeticiones inválidas para {_spec_label(f)}: {f.get('repeats')}")
+    for key, value in (job.get("split") or {}).items():
+        if key not in SPLIT_LIMITS:
+            raise ValueError(f"Límite de división desconocido: {key!r} (usar {' / '.join(SPLIT_LIMITS)}).")
+        if value is not None and float(value) < 0:
+            raise ValueError(f"Límite de división inválido: {key} = {value}")
+
+
+def run_job(job: Dict) -> Dict:
+    """
+    Arma la cola de un trabajo y la escribe en job["output"]. Devuelve un
+    resumen {"output", "prints", "parts", "bytes", "seconds"}.
+    """
+    validate_job(job)
+    t0 = time.perf_counter()
+    models = []
+    parsed: Dict[str, Dict] = {}
+    for f in job["files"]:
+        path = _resolve(job, f["path"])
+        try:
+            if path not in parsed:
+                with open(path, "rb") as fp:
+                    parsed[path] = read_3mf(fp.read(), plate=f.get("plate"))
+            meta = read_plate(parsed[path], f.get("plate"))
+        except ValueError as e:
+            # "El .3mf no tiene el plate 3": con dos entradas del mismo archivo, ¿cuál?
+            raise ValueError(f"{_spec_label(f)}: {e}") from e
+        if not meta["plate_name"]:
+            raise ValueError(f"{f['path']}: no tiene G-code de plate.")
+        models.append({"name": model_name(f["path"], meta), "path": path, "core": meta["core"],
+                       "shutdown": meta["shutdown"], "repeats": int(f.get("repeats", 1)),
+                       "files": meta["files"], "plate_name": meta["plate_name"], "digest": meta["digest"],
+                       "stages": meta["stages"]})
+    base = models[0]
+    change_block = change_block_for(job)
+    mode = job.get("mode", "serial")
+    split = job.get("split") or {}
+    estimates: Dict[tuple, Dict] = {}
+
+    def estimates_for() -> List[Dict]:
+        # una estimación por plate, aunque aparezca varias veces en la cola
+        for m in models:
+            key = (m["path"], m["plate_name"])
+            if key not in estimates:
+                estimates[key] = estimate_gcode(m["core"])
+        return [estimates[(m["path"], m["plate_name"])] for m in models]
+
+    plan, report_lines = None, []
+    if job.get("minify"):
+        # cada plate se reduce una vez, antes de repetirlo
+        minified: Dict[tuple, Dict] = {}
+        for m in models:
+            key = (m["path"], m["plate_name"])
+            if key not in minified:
+                minified[key] = minify_plate(m)
+        entries = [minified[(m["path"], m["plate_name"])] for m in models]
+        report_lines.append(minify_report_line(entries, [m["repeats"] for m in models]))
+        for m, entry in zip(models, entries):
+            m["core"], m["core_digest"] = entry["core"], entry["core_digest"]
+    if mode == "optimized":
+        schedule = optimize_sequence(models, change_block, estimates_for())
+        plan = schedule["plan"]
+        report_lines += schedule["report_lines"]
+    parts = None
+    if split:
+        plan = plan or SequencePlan.for_mode([m["repeats"] for m in models], mode)
+        parts = split_plan(plan, models, change_block, max_prints=split.get("max_prints"),
+                           max_bytes=int(float(split.get("max_mb") or 0) * 1e6) or None,
+                           max_hours=split.get("max_hours"),
+                           estimates=estimates_for() if split.get("max_hours") else None)
+        if len(parts) < 2:
+            parts = None
+    output = job.get("output") or f"queue_{os.path.splitext(os.path.basename(base['path']))[0]}.3mf"
+    output = _resolve(job, output)
+    reproducible = bool(job.get("reproducible", False))
+    metrics = None
+    if not reproducible:
+        # las etapas van a Metadata/queue_report.txt (con tiempos: no en modo reproducible)
+        metrics = Metrics()
+        for m in {(m["path"], m["plate_name"]): m for m in models}.values():
+            metrics.extend(m["stages"], prefix=f"{m['name']}: ")
+    if parts is not None:
+        # varias partes: el destino es un .zip con queue_parte01de0N.3mf, ...
+        names = part_names(os.path.splitext(os.path.basename(output))[0] + ".3mf", len(parts))
+        output = os.path.splitext(output)[0] + ".zip"
+    # Se escribe a un temporal junto al destino y se renombra al terminar: nunca
+    # queda un .3mf a medias con el nombre final.
+    out_dir = os.path.dirname(output) or "."
+    fd, tmp = tempfile.mkstemp(dir=out_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w+b") as fp:
+            if parts is None:
+                size = build_final_3mf(base["files"], base["plate_name"],
+                                       iter_sequence(models, change_block, mode, plan),
+                                       reproducible=reproducible, out=fp, metrics=metrics,
+                                       report_lines=report_lines)
+            else:
+                outputs = build_parts(base["files"], base["plate_name"], models, change_block, parts,
+                                      reproducible=reproducible, dir=out_dir, report_lines=report_lines,
+                                      metrics=metrics)
+                try:
+                    size = write_bundle(names, outputs, fp,
+                                        date_time=REPRODUCIBLE_DATE_TIME if reproducible else None)
+                finally:
+                    for o in outputs:
+                        o.cleanup()
+        os.replace(tmp, output)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return {"output": output, "prints": sum(m["repeats"] for m in models),
+            "parts": len(parts) if parts else 1, "bytes": size, "seconds": time.perf_counter() - t0}
+
+
+def _run_job_safe(job: Dict) -> Dict:
+    try:
+        return {"ok": True, **run_job(job)}
+    except Exception as e:
+        return {"ok": False, "output": job.get("output"), "error": f"{type(e).__name__}: {e}"}
+
+
+def run_batch(jobs: List[Dict], max_workers: Optional[int] = None) -> List[Dict]:
+    """
+    Corre muchos trabajos en paralelo (un proceso por núcleo). Devuelve un
+    resumen por trabajo, en orden; los errores quedan en su propio resultado.
+    """
+    workers = min(len(jobs), max_workers or os.cpu_count() or 1)
+    if workers <= 1:
+        return [_run_job_safe(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        return list(pool.map(_run_job_safe, jobs))
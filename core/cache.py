@@ -0,0 +1,185 @@
+# core/cache.py
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+class LRUCache:
+    """
+    Caché LRU con presupuesto de memoria en bytes (no en cantidad de entradas),
+    con un nivel opcional en disco:
+      - memoria: OrderedDict clave->(valor, tamaño); al pasarse de max_bytes se
+        descartan las entradas menos usadas.
+      - disco (disk_dir): cada valor se guarda además como pickle; si no está en
+        memoria se busca ahí y se vuelve a subir a memoria. Tiene su propio
+        presupuesto (max_disk_bytes, por defecto el mismo de memoria): al
+        pasarse se borran los pickles usados hace más tiempo. Los que ya había
+        en el directorio (de una ejecución anterior) entran al índice por fecha
+        de modificación.
+    Es thread-safe, así que se puede compartir entre sesiones de Streamlit, y
+    get_or_compute calcula cada clave una sola vez aunque la pidan varios
+    hilos a la vez: los demás esperan ese resultado.
+    """
+
+    def __init__(self, max_bytes: int, disk_dir: Optional[str] = None,
+                 max_disk_bytes: Optional[int] = None):
+        self.max_bytes = int(max_bytes)
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = int(max_bytes if max_disk_bytes is None else max_disk_bytes)
+        self._items: "OrderedDict[str, Tuple[Any, int]]" = OrderedDict()
+        self._bytes = 0
+        self._disk: "OrderedDict[str, int]" = OrderedDict()   # clave -> tamaño del pickle
+        self._disk_bytes = 0
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._index_disk()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    @property
+    def used_bytes(self) -> int:
+        return self._bytes
+
+    @property
+    def disk_bytes(self) -> int:
+        return self._disk_bytes
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.pkl")
+
+    def _index_disk(self) -> None:
+        found = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.name.endswith(".pkl") and entry.is_file():
+                st = entry.stat()
+                found.append((st.st_mtime, entry.name[:-4], st.st_size))
+        for _, key, size in sorted(found):
+            self._disk[key] = size
+            self._disk_bytes += size
+        with self._lock:
+            self._evict_disk()
+
+    def _evict_disk(self) -> None:
+        # con el lock tomado
+        while self._disk_bytes > self.max_disk_bytes and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            try:
+                os.remove(self._disk_path(key))
+            except FileNotFoundError:
+                pass  # lo borró otro proceso que comparte el directorio
+
+    def _store(self, key: str, value: Any, nbytes: int) -> None:
+        # con el lock tomado
+        old = self._items.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+        if nbytes > self.max_bytes:
+            return  # no entra nunca: queda sólo en disco (si hay)
+        self._items[key] = (value, nbytes)
+        self._bytes += nbytes
+        while self._bytes > self.max_bytes:
+            _, (_, evicted) = self._items.popitem(last=False)
+            self._bytes -= evicted
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                self._items.move_to_end(key)
+                if key in self._disk:
+                    self._disk.move_to_end(key)
+                self.hits += 1
+                return item[0]
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                with open(path, "rb") as f:
+                    value, nbytes = pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                pass
+            else:
+                try:
+                    os.utime(path)  # para el orden de _index_disk en la próxima ejecución
+                except OSError:
+                    pass
+                with self._lock:
+                    if key in self._disk:
+                        self._disk.move_to_end(key)
+                    self._store(key, value, nbytes)
+                    self.hits += 1
+                return value
+        with self._lock:
+            self.misses += 1
+        return default
+
+    def put(self, key: str, value: Any, nbytes: int) -> None:
+        with self._lock:
+            self._store(key, value, nbytes)
+        if self.disk_dir:
+            # escritura atómica: otro proceso/sesión nunca ve un pickle a medias
+            fd, tmp = tempfile.mkstemp(dir=self.disk_dir, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    pickle.dump((value, nbytes), f, protocol=pickle.HIGHEST_PROTOCOL)
+                size = os.path.getsize(tmp)
+                if size > self.max_disk_bytes:
+                    os.remove(tmp)  # no entra en el presupuesto del disco
+                    return
+                os.replace(tmp, self._disk_path(key))
+            except BaseException:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+            with self._lock:
+                self._disk_bytes += size - self._disk.pop(key, 0)
+                self._disk[key] = size
+                self._evict_disk()
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any],
+                       sizeof: Callable[[Any], int]) -> Any:
+        missing = object()
+        while True:
+            value = self.get(key, missing)
+            if value is not missing:
+                return value
+            with self._lock:
+                item = self._items.get(key)
+                if item is not None:  # se guardó entre el get y el lock
+                    return item[0]
+                pending = self._pending.get(key)
+                owner = pending is None
+                if owner:
+                    pending = self._pending[key] = Future()
+            if not owner:
+                try:
+                    return pending.result()
+                except BaseException:
+                    # falló (o se canceló) el cálculo de otro: se intenta de nuevo acá
+                    continue
+            try:
+                value = compute()
+                self.put(key, value, sizeof(value))
+            except BaseException as e:
+                pending.set_exception(e)
+                raise
+            else:
+                pending.set_result(value)
+                return value
+            finally:
+                with self._lock:
+                    del self._pending[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
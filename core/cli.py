@@ -0,0 +1,148 @@
+# core/cli.py
+"""
+Línea de comandos de PrintLooper (python -m core).
+
+    python -m core build a.3mf:3 b.3mf:2 -o cola.3mf --mode interleaved --wait-temp 35
+    python -m core build a.3mf:3 b.3mf:2 --mode optimized --wait-temp 35   # orden de menor duración
+    python -m core build a.3mf:40 --max-hours 12 -o cola.3mf        # cola.zip con partes de ≤ 12 h
+    python -m core build proyecto.3mf@1:2 proyecto.3mf@3:1    # plates 1 y 3 del mismo .3mf
+    python -m core run trabajos/*.json --jobs 8
+    python -m core send cola.3mf --printers impresoras.json          # a todas las impresoras a la vez
+    python -m core send cola.zip --printers impresoras.json --distribute   # partes repartidas entre impresoras
+"""
+import argparse
+import os
+import sys
+from typing import List, Optional
+
+from .batch import MODES, load_jobs, run_batch
+from .dispatch import MAX_RETRIES, bundle_artifacts, dispatch, load_printers
+
+
+def _parse_file_arg(value: str) -> dict:
+    # "ruta.3mf:3" -> 3 repeticiones; sin ":N" -> 1. "ruta.3mf@2:3" -> plate 2
+    path, sep, reps = value.rpartition(":")
+    if sep and reps.isdigit() and path:
+        spec = {"path": path, "repeats": int(reps)}
+    else:
+        spec = {"path": value, "repeats": 1}
+    path, sep, plate = spec["path"].rpartition("@")
+    if sep and plate.isdigit() and path:
+        spec.update(path=path, plate=int(plate))
+    return spec
+
+
+def _job_from_args(args: argparse.Namespace) -> dict:
+    wait = None
+    if args.wait_minutes is not None:
+        wait = {"mode": "time", "minutes": args.wait_minutes}
+    elif args.wait_temp is not None:
+        wait = {"mode": "temp", "target_bed": args.wait_temp}
+    change_block = None
+    if args.change_block or args.cycles is not None:
+        change_block = {"template": args.change_block, "cycles": args.cycles,
+                        "down_mm": args.down_mm, "up_mm": args.up_mm}
+    return {
+        "files": [_parse_file_arg(f) for f in args.files],
+        "mode": args.mode,
+        "wait": wait,
+        "change_block": change_block,
+        "split": {k: v for k, v in (("max_prints", args.max_prints), ("max_mb", args.max_mb),
+                                    ("max_hours", args.max_hours)) if v},
+        "minify": args.minify,
+        "output": args.output,
+        "reproducible": args.reproducible,
+        "base_dir": os.getcwd(),
+    }
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m core",
+                                     description="PrintLooper: arma colas .3mf con cambio de placa automático.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    b = sub.add_parser("build", help="Arma una cola a partir de archivos .3mf.")
+    b.add_argument("files", nargs="+", metavar="ARCHIVO[@PLATE][:N]",
+                   help="Archivo .3mf, opcionalmente con plate y repeticiones (a.3mf:3, a.3mf@2:3).")
+    b.add_argument("-o", "--output", help="Archivo de salida (por defecto queue_<primero>.3mf).")
+    b.add_argument("--mode", choices=MODES, default="serial", help="Orden de impresión (optimized: el de menor duración estimada).")
+    wait = b.add_mutually_exclusive_group()
+    wait.add_argument("--wait-minutes", type=float, help="Esperar N minutos antes de cada cambio (G4).")
+    wait.add_argument("--wait-temp", type=float, help="Esperar a que la cama baje a N °C (M190 R).")
+    b.add_argument("--change-block", help="Archivo con el bloque/plantilla de cambio de placa.")
+    b.add_argument("--cycles", type=int, help="Ciclos G380 a generar en la plantilla ({{CYCLES}}).")
+    b.add_argument("--down-mm", type=float, default=20.0, help="Descenso Z por ciclo (mm).")
+    b.add_argument("--up-mm", type=float, default=30.0, help="Ascenso Z por ciclo (mm).")
+    b.add_argument("--reproducible", action="store_true", help="Salida idéntica para entradas idénticas.")
+    b.add_argument("--minify", action="store_true",
+                   help="Reducir el G-code: comentarios (salvo marcadores), F y ejes que no cambian, ceros de más.")
+    split = b.add_argument_group("división en partes", "Con algún límite, si la cola no entra en una parte "
+                                                       "la salida es un .zip con un .3mf por parte.")
+    split.add_argument("--max-prints", type=int, help="Impresiones máximas por parte.")
+    split.add_argument("--max-mb", type=float, help="MB máximos de G-code (sin comprimir) por parte.")
+    split.add_argument("--max-hours", type=float, help="Horas estimadas máximas por parte.")
+
+    r = sub.add_parser("run", help="Corre uno o más archivos JSON de trabajos, en paralelo.")
+    r.add_argument("specs", nargs="+", help="Archivos JSON (un trabajo o una lista de trabajos).")
+    r.add_argument("-j", "--jobs", type=int, default=None, help="Procesos en paralelo (por defecto, uno por núcleo).")
+
+    s = sub.add_parser("send", help="Envía colas terminadas a las impresoras (FTPS/FTP), en paralelo.")
+    s.add_argument("files", nargs="+", metavar="ARCHIVO", help="Archivos .3mf (o .zip de partes) a enviar.")
+    s.add_argument("--printers", required=True, help="Config JSON de impresoras (ver core/dispatch.py).")
+    s.add_argument("--only", nargs="+", metavar="NOMBRE", help="Enviar sólo a estas impresoras.")
+    s.add_argument("--distribute", action="store_true",
+                   help="Repartir los archivos en ronda (uno por impresora) en vez de mandar todos a todas.")
+    s.add_argument("--retries", type=int, default=MAX_RETRIES, help="Reintentos por archivo (retomando el envío).")
+    return parser
+
+
+def _send(args: argparse.Namespace) -> int:
+    printers = load_printers(args.printers)
+    if args.only:
+        missing = set(args.only) - {p.name for p in printers}
+        if missing:
+            raise SystemExit(f"Impresoras desconocidas: {', '.join(sorted(missing))}")
+        printers = [p for p in printers if p.name in args.only]
+    artifacts = []
+    for f in args.files:
+        # un .zip de partes (build con --max-*) se envía parte por parte
+        artifacts += bundle_artifacts(f) if f.lower().endswith(".zip") else [(os.path.basename(f), f)]
+    results = dispatch(artifacts, printers, distribute=args.distribute, retries=args.retries)
+    failed = 0
+    for res in results:
+        if res["ok"]:
+            extra = "".join(f", {n} {label}" for n, label in (
+                (sum(1 for f in res["files"] if f["resumed_from"]), "retomados"),
+                (sum(1 for f in res["files"] if f["skipped"]), "ya estaban"),
+                (sum(1 for f in res["files"] if f["replaced"]), "reemplazados")) if n)
+            print(f"OK     {res['printer']}  ({len(res['files'])} archivos{extra}, {res['sent'] / 1e6:.1f} MB, "
+                  f"{res['seconds']:.1f} s, {res['mb_s']:.2f} MB/s)")
+        else:
+            failed += 1
+            for f in res["files"]:
+                if f["error"]:
+                    print(f"ERROR  {res['printer']}: {f['name']}: {f['error']}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.command == "send":
+        return _send(args)
+    if args.command == "build":
+        jobs = [_job_from_args(args)]
+        workers = 1
+    else:
+        jobs = [job for path in args.specs for job in load_jobs(path)]
+        workers = args.jobs
+    results = run_batch(jobs, workers)
+    failed = 0
+    for res in results:
+        if res["ok"]:
+            parts = f", {res['parts']} partes" if res.get("parts", 1) > 1 else ""
+            print(f"OK     {res['output']}  ({res['prints']} impresiones{parts}, "
+                  f"{res['bytes'] / 1e6:.1f} MB, {res['seconds']:.1f} s)")
+        else:
+            failed += 1
+            print(f"ERROR  {res.get('output') or '-'}: {res['error']}", file=sys.stderr)
+    return 1 if failed else 0
@@ -0,0 +1,505 @@
+# core/dispatch.py
+"""
+Envío de colas terminadas a varias impresoras a la vez, por FTPS o FTP.
+
+Las Bambu Lab (A1 incluida) aceptan FTPS implícito en el puerto 990 con el
+usuario "bblp" y el código de acceso LAN como clave; el archivo queda en la
+tarjeta SD, listo para imprimir desde la pantalla. Config de impresoras (JSON):
+
+    [
+      {"name": "A1-01", "host": "192.168.1.51", "password": "12345678"},
+      {"name": "A1-02", "host": "192.168.1.52", "password": "87654321", "connections": 2},
+      {"name": "banco", "host": "127.0.0.1", "port": 2121, "tls": "none", "user": "u", "password": "p"}
+    ]
+
+    printers = load_printers("impresoras.json")
+    results = dispatch([("cola.3mf", output)], printers)      # output: ruta, OutputFile o bytes
+
+La coordinación es asyncio: cada impresora tiene un pool de conexiones
+(ConnectionPool, hasta `connections` abiertas, reutilizadas entre archivos) y
+todas avanzan en paralelo. ftplib es bloqueante, así que cada operación FTP
+corre en un hilo de un pool propio, con uno por conexión posible (el executor
+por defecto de asyncio tiene pocos y frenaría una granja de 20 impresoras).
+
+Un envío cortado se retoma, pero sólo si el archivo remoto es el mismo: junto a
+cada archivo se sube un manifiesto `<nombre>.sha256` (formato de sha256sum) con
+el digest del contenido completo. Antes de subir se lee ese manifiesto y SIZE:
+  - manifiesto igual y tamaño igual: ya está, no se vuelve a subir;
+  - manifiesto igual y tamaño menor: se sigue desde ahí (REST + STOR);
+  - sin manifiesto, distinto o tamaño mayor (p.ej. otra cola con el mismo
+    nombre): se borra el remoto, se escribe el manifiesto nuevo y se sube
+    desde 0.
+El manifiesto se escribe antes que el archivo, así que un envío cortado deja
+siempre un manifiesto que describe lo que se estaba subiendo. Cada intento
+fallido descarta la conexión y reintenta (hasta `retries` veces) con una nueva.
+
+Para probar sin impresoras alcanza un servidor FTP local, p.ej.
+`python -m pyftpdlib -p 2121 -w -u u -P p -d /tmp/ftp` con una impresora
+{"host": "127.0.0.1", "port": 2121, "tls": "none", "user": "u", "password": "p"}.
+"""
+import asyncio
+import ftplib
+import hashlib
+import io
+import json
+import os
+import ssl
+import time
+import zipfile
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, BinaryIO, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+TLS_MODES = ("implicit", "explicit", "none")
+BLOCK_SIZE = 256 << 10
+MAX_RETRIES = 3
+RETRY_DELAY_S = 1.0
+MANIFEST_SUFFIX = ".sha256"
+
+# (nombre remoto, origen): el origen es una ruta, bytes o algo con open() y size
+# (un OutputFile de core.output, una parte de un .zip: ZipMember)
+Artifact = Tuple[str, Any]
+
+
+class Printer(NamedTuple):
+    name: str
+    host: str
+    password: str = ""
+    user: str = "bblp"
+    port: int = 990
+    tls: str = "implicit"        # "implicit" (Bambu, puerto 990) | "explicit" (AUTH TLS) | "none"
+    remote_dir: str = "/"
+    connections: int = 1         # conexiones simultáneas a esta impresora
+    verify_tls: bool = False     # las impresoras usan un certificado autofirmado
+    timeout: float = 30.0
+
+
+class DispatchCancelled(Exception):
+    """El envío se canceló (ver dispatch(..., cancelled=))."""
+
+
+class ZipMember(NamedTuple):
+    """Una entrada de un .zip (p.ej. una parte de core.split.write_bundle) como origen de envío."""
+    zip_path: str
+    name: str
+    size: int
+
+    def open(self) -> BinaryIO:
+        # el ZipExtFile mantiene abierto el archivo aunque se cierre el ZipFile
+        with zipfile.ZipFile(self.zip_path) as zf:
+            return zf.open(self.name)
+
+
+def bundle_artifacts(zip_path: str) -> List[Artifact]:
+    """Las partes de un .zip de core.split, en orden, listas para dispatch()."""
+    with zipfile.ZipFile(zip_path) as zf:
+        return [(os.path.basename(info.filename), ZipMember(zip_path, info.filename, info.file_size))
+                for info in zf.infolist() if not info.is_dir()]
+
+
+def printer_from_dict(spec: Dict) -> Printer:
+    unknown = set(spec) - set(Printer._fields)
+    if unknown:
+        raise ValueError(f"Campos desconocidos en la impresora {spec.get('name')!r}: {', '.join(sorted(unknown))}")
+    if not spec.get("host"):
+        raise ValueError(f"La impresora {spec.get('name')!r} no tiene 'host'.")
+    printer = Printer(**{"name": spec.get("name") or spec["host"], **spec})
+    if printer.tls not in TLS_MODES:
+        raise ValueError(f"TLS inválido para {printer.name}: {printer.tls!r} (usar {' / '.join(TLS_MODES)}).")
+    return printer._replace(port=int(printer.port), connections=max(1, int(printer.connections)))
+
+
+def load_printers(path: str) -> List[Printer]:
+    """Lee la config de impresoras: una lista JSON o {"printers": [...]}."""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    specs = data.get("printers", []) if isinstance(data, dict) else data
+    printers = [printer_from_dict(s) for s in specs]
+    names = [p.name for p in printers]
+    if len(set(names)) != len(names):
+        raise ValueError("Hay nombres de impresora repetidos en la config.")
+    return printers
+
+
+# --- conexiones -------------------------------------------------------------------
+
+class _SessionReuseMixin:
+    # El servidor FTPS de las impresoras exige que el canal de datos reuse la
+    # sesión TLS del de control (como vsftpd con require_ssl_reuse).
+    def ntransfercmd(self, cmd, rest=None):
+        conn, size = ftplib.FTP.ntransfercmd(self, cmd, rest)
+        if self._prot_p:
+            conn = self.context.wrap_socket(conn, server_hostname=self.host, session=self.sock.session)
+        return conn, size
+
+
+class ExplicitFTPS(_SessionReuseMixin, ftplib.FTP_TLS):
+    """FTPS explícito (AUTH TLS sobre el puerto de FTP)."""
+
+
+class ImplicitFTPS(_SessionReuseMixin, ftplib.FTP_TLS):
+    """FTPS implícito: TLS desde el primer byte de la conexión de control (puerto 990)."""
+
+    def __init__(self, *args, **kwargs):
+        self._sock = None
+        super().__init__(*args, **kwargs)
+
+    @property
+    def sock(self):
+        return self._sock
+
+    @sock.setter
+    def sock(self, value):
+        if value is not None and not isinstance(value, ssl.SSLSocket):
+            value = self.context.wrap_socket(value, server_hostname=self.host)
+        self._sock = value
+
+
+def _tls_context(verify: bool) -> ssl.SSLContext:
+    context = ssl.create_default_context()
+    if not verify:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+def connect(printer: Printer) -> ftplib.FTP:
+    """Abre y autentica una conexión (bloqueante), en modo binario y en remote_dir."""
+    if printer.tls == "none":
+        ftp = ftplib.FTP(timeout=printer.timeout)
+    else:
+        cls = ImplicitFTPS if printer.tls == "implicit" else ExplicitFTPS
+        ftp = cls(context=_tls_context(printer.verify_tls), timeout=printer.timeout)
+    try:
+        ftp.connect(printer.host, printer.port)
+        ftp.login(printer.user, printer.password)
+        if printer.tls != "none":
+            ftp.prot_p()
+        ftp.voidcmd("TYPE I")
+        if printer.remote_dir not in ("", "/"):
+            ftp.cwd(printer.remote_dir)
+    except BaseException:
+        _close(ftp)
+        raise
+    return ftp
+
+
+def _close(ftp: ftplib.FTP) -> None:
+    try:
+        ftp.close()
+    except OSError:
+        pass
+
+
+def _quit(ftp: ftplib.FTP) -> None:
+    try:
+        ftp.quit()
+    except (OSError, EOFError, ftplib.Error):
+        _close(ftp)
+
+
+def _alive(ftp: ftplib.FTP) -> bool:
+    try:
+        ftp.voidcmd("NOOP")
+        return True
+    except (OSError, EOFError, ftplib.Error):
+        _close(ftp)
+        return False
+
+
+class ConnectionPool:
+    """
+    Conexiones a una impresora: hasta printer.connections en uso a la vez; las
+    que terminan bien quedan abiertas para el próximo archivo, las que fallan
+    se descartan.
+    """
+
+    def __init__(self, printer: Printer, executor: Optional[Executor] = None):
+        self.printer = printer
+        self.executor = executor
+        self.opened = 0
+        self._idle: List[ftplib.FTP] = []
+        self._slots = asyncio.Semaphore(printer.connections)
+
+    def __repr__(self) -> str:
+        return f"ConnectionPool({self.printer.name!r}, abiertas={self.opened}, libres={len(self._idle)})"
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        """Corre una operación FTP bloqueante en el executor del pool."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[ftplib.FTP]:
+        async with self._slots:
+            ftp = None
+            while self._idle and ftp is None:
+                candidate = self._idle.pop()
+                if await self.run(_alive, candidate):
+                    ftp = candidate
+            if ftp is None:
+                ftp = await self.run(connect, self.printer)
+                self.opened += 1
+            try:
+                yield ftp
+            except BaseException:
+                _close(ftp)
+                raise
+            self._idle.append(ftp)
+
+    async def close(self) -> None:
+        idle, self._idle = self._idle, []
+        for ftp in idle:
+            await self.run(_quit, ftp)
+
+
+# --- transferencias ---------------------------------------------------------------
+
+def _open_source(source: Any) -> Tuple[Callable[[], BinaryIO], int]:
+    """(abrir, tamaño) de un origen de Artifact."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        data = bytes(source)
+        return (lambda: io.BytesIO(data)), len(data)
+    if hasattr(source, "open") and hasattr(source, "size"):
+        return source.open, int(source.size)
+    path = os.fspath(source)
+    return (lambda: open(path, "rb")), os.path.getsize(path)
+
+
+def remote_size(ftp: ftplib.FTP, name: str) -> Optional[int]:
+    """Tamaño del archivo remoto (None si no existe)."""
+    try:
+        return ftp.size(name)
+    except ftplib.error_perm:
+        return None
+
+
+def source_digest(source: Any) -> str:
+    """SHA-256 (hex) del contenido de un origen de Artifact."""
+    opener, _ = _open_source(source)
+    digest = hashlib.sha256()
+    with opener() as fp:
+        for block in iter(lambda: fp.read(BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def manifest_name(name: str) -> str:
+    return name + MANIFEST_SUFFIX
+
+
+def read_manifest(ftp: ftplib.FTP, name: str) -> Optional[str]:
+    """Digest del manifiesto remoto de `name` (None si no hay o no se entiende)."""
+    try:
+        conn = ftp.transfercmd(f"RETR {manifest_name(name)}")
+    except ftplib.error_perm:
+        return None
+    chunks = []
+    try:
+        while True:
+            block = conn.recv(4096)
+            if not block:
+                break
+            chunks.append(block)
+    finally:
+        conn.close()
+    ftp.voidresp()
+    fields = b"".join(chunks).decode("ascii", "replace").split()
+    digest = fields[0].lower() if fields else ""
+    if len(digest) != 64 or any(c not in "0123456789abcdef" for c in digest):
+        return None
+    return digest
+
+
+def write_manifest(ftp: ftplib.FTP, name: str, digest: str) -> None:
+    store(ftp, manifest_name(name), io.BytesIO(f"{digest}  {name}\n".encode("ascii")))
+
+
+def _delete(ftp: ftplib.FTP, name: str) -> None:
+    try:
+        ftp.delete(name)
+    except ftplib.error_perm:
+        pass  # no existía
+
+
+def store(ftp: ftplib.FTP, name: str, fp: BinaryIO, offset: int = 0,
+          progress: Optional[Callable[[int], None]] = None,
+          cancelled: Optional[Callable[[], bool]] = None) -> int:
+    """
+    Sube fp a `name` desde `offset` (REST + STOR si offset > 0) y devuelve los
+    bytes enviados. Bloqueante.
+    """
+    fp.seek(offset)
+    conn = ftp.transfercmd(f"STOR {name}", rest=offset or None)
+    sent = 0
+    try:
+        while True:
+            if cancelled is not None and cancelled():
+                raise DispatchCancelled("Envío cancelado.")
+            block = fp.read(BLOCK_SIZE)
+            if not block:
+                break
+            conn.sendall(block)
+            sent += len(block)
+            if progress is not None:
+                progress(len(block))
+        if isinstance(conn, ssl.SSLSocket):
+            try:
+                conn.unwrap()
+            except (OSError, ssl.SSLError):
+                pass  # algunos servidores cierran sin esperar el close_notify
+    finally:
+        conn.close()
+    ftp.voidresp()
+    return sent
+
+
+def _upload(ftp: ftplib.FTP, name: str, source: Any, digest: str, record: Dict,
+            advance: Callable[[int], None], cancelled: Optional[Callable[[], bool]]) -> None:
+    opener, size = _open_source(source)
+    record["bytes"] = size
+    remote = remote_size(ftp, name)
+    same = remote is not None and read_manifest(ftp, name) == digest
+    if same and remote == size:
+        record["skipped"] = True
+        advance(size)
+        return
+    if same and remote < size:
+        offset = remote
+        record["resumed_from"] = offset
+        advance(offset)
+    else:
+        # no se puede probar que el remoto sea este contenido: se reemplaza entero
+        offset = 0
+        if remote is not None:
+            record["replaced"] = True
+            _delete(ftp, name)
+        write_manifest(ftp, name, digest)
+    position = offset
+
+    def on_block(n: int) -> None:
+        nonlocal position
+        record["sent"] += n
+        position += n
+        advance(position)
+
+    with opener() as fp:
+        store(ftp, name, fp, offset, on_block, cancelled)
+    final = remote_size(ftp, name)
+    if final is not None and final != size:
+        raise ftplib.error_temp(f"451 el archivo remoto quedó con {final} bytes de {size}")
+
+
+async def _send_one(pool: ConnectionPool, name: str, source: Any, digest: str, retries: int,
+                    progress: Optional[Callable[[str, int], None]],
+                    cancelled: Optional[Callable[[], bool]]) -> Dict:
+    record = {"name": name, "bytes": 0, "sent": 0, "resumed_from": 0, "skipped": False,
+              "replaced": False, "attempts": 0, "seconds": 0.0, "error": None}
+    reported = 0
+
+    def advance(position: int) -> None:
+        # el progreso avanza por posición confirmada: un reintento que retoma
+        # (o vuelve a empezar) no cuenta dos veces los mismos bytes
+        nonlocal reported
+        if position > reported:
+            if progress is not None:
+                progress(pool.printer.name, position - reported)
+            reported = position
+
+    t0 = time.perf_counter()
+    while True:
+        record["attempts"] += 1
+        try:
+            async with pool.connection() as ftp:
+                await pool.run(_upload, ftp, name, source, digest, record, advance, cancelled)
+            break
+        except DispatchCancelled as e:
+            record["error"] = str(e)
+            break
+        except (OSError, EOFError, ftplib.Error) as e:
+            permanent = isinstance(e, ftplib.error_perm)  # 5xx: clave, permisos, ruta
+            if permanent or record["attempts"] > retries or (cancelled is not None and cancelled()):
+                record["error"] = f"{type(e).__name__}: {e}"
+                break
+            # la conexión ya se descartó; el próximo intento retoma según SIZE y el manifiesto
+            await asyncio.sleep(RETRY_DELAY_S * record["attempts"])
+    record["seconds"] = time.perf_counter() - t0
+    return record
+
+
+def _printer_stats(printer: Printer, files: List[Dict], seconds: float, opened: int) -> Dict:
+    sent = sum(f["sent"] for f in files)
+    return {"printer": printer.name, "host": printer.host, "ok": all(f["error"] is None for f in files),
+            "files": files, "sent": sent, "seconds": seconds, "connections": opened,
+            "mb_s": sent / seconds / 1e6 if seconds > 0 else 0.0}
+
+
+async def dispatch_async(artifacts: Sequence[Artifact], printers: Sequence[Printer],
+                         distribute: bool = False, retries: int = MAX_RETRIES,
+                         progress: Optional[Callable[[str, int], None]] = None,
+                         cancelled: Optional[Callable[[], bool]] = None) -> List[Dict]:
+    """
+    Sube los artefactos a las impresoras, todas en paralelo. Por defecto cada
+    impresora recibe todos; con distribute=True se reparten en ronda (p.ej. las
+    partes de core.split: parte 1 a la primera impresora, parte 2 a la
+    segunda...). `progress(nombre_impresora, bytes)` se llama desde los hilos
+    de transferencia; `cancelled()` se consulta entre bloques y corta los
+    envíos pendientes (quedan como error, y se retoman en el próximo envío).
+    Devuelve una entrada por impresora con cada archivo
+    ({"name", "bytes", "sent", "resumed_from", "skipped", "replaced",
+    "attempts", "seconds", "error"}) y el total: bytes enviados, segundos, MB/s,
+    conexiones abiertas y "ok".
+    """
+    if not printers:
+        raise ValueError("No hay impresoras configuradas.")
+    assigned: Dict[str, List[Artifact]] = {p.name: [] for p in printers}
+    for k, artifact in enumerate(artifacts):
+        targets = [printers[k % len(printers)]] if distribute else printers
+        for p in targets:
+            assigned[p.name].append(artifact)
+
+    async def run(printer: Printer, executor: Executor) -> Dict:
+        pool = ConnectionPool(printer, executor)
+        t0 = time.perf_counter()
+        try:
+            files = await asyncio.gather(*(_send_one(pool, name, source, digests[id(source)], retries,
+                                                     progress, cancelled)
+                                           for name, source in assigned[printer.name]))
+        finally:
+            await pool.close()
+        return _printer_stats(printer, list(files), time.perf_counter() - t0, pool.opened)
+
+    workers = sum(p.connections for p in printers)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="printlooper-ftp") as executor:
+        # un digest por artefacto (no por impresora): se lee cada archivo una vez
+        loop = asyncio.get_running_loop()
+        sources = list({id(source): source for _, source in artifacts}.values())
+        hashed = await asyncio.gather(*(loop.run_in_executor(executor, source_digest, src) for src in sources))
+        digests = {id(src): h for src, h in zip(sources, hashed)}
+        return list(await asyncio.gather(*(run(p, executor) for p in printers)))
+
+
+def dispatch(artifacts: Sequence[Artifact], printers: Sequence[Printer], **kwargs) -> List[Dict]:
+    """dispatch_async desde código sin loop (CLI, hilos de la app)."""
+    return asyncio.run(dispatch_async(artifacts, printers, **kwargs))
+
+
+def stats_rows(results: Sequence[Dict]) -> List[Dict]:
+    """Filas para una tabla (st.dataframe): una por impresora."""
+    rows = []
+    for r in results:
+        errors = [f"{f['name']}: {f['error']}" for f in r["files"] if f["error"]]
+        resumed = sum(1 for f in r["files"] if f["resumed_from"])
+        skipped = sum(1 for f in r["files"] if f["skipped"])
+        replaced = sum(1 for f in r["files"] if f["replaced"])
+        rows.append({
+            "Impresora": r["printer"],
+            "Estado": "✅" if r["ok"] else "❌ " + "; ".join(errors),
+            "Archivos": len(r["files"]),
+            "Enviado (MB)": round(r["sent"] / 1e6, 1),
+            "Tiempo (s)": round(r["seconds"], 1),
+            "MB/s": round(r["mb_s"], 2),
+            "Retomados": resumed,
+            "Ya estaban": skipped,
+            "Reemplazados": replaced,
+        })
+    return rows
@@ -0,0 +1,455 @@
+# core/estimator.py
+"""
+Estimador de tiempo de impresión y filamento, vectorizado con NumPy.
+
+El G-code se recorre en bloques de líneas completas (~4 MB). Cada bloque se
+tokeniza sobre los bytes (sin un bucle Python por línea): letra + número de
+cada comando fuera de los comentarios, armados en una tabla filas x letras.
+Sobre esa tabla se calculan, también con arrays:
+
+  - modos G90/G91 y M82/M83, posiciones (G92, G28), avance F y aceleración M204;
+  - largo de cada movimiento (G0/G1, arcos G2/G3 con I/J, G380 del A1);
+  - velocidades de unión por "junction deviation" y tiempo de cada segmento con
+    un perfil trapezoidal (acelerar, crucero, frenar);
+  - pausas G4 y esperas de temperatura M109/M190 (S: calentar, R: ambos sentidos)
+    según las tasas de calentamiento/enfriamiento del perfil; durante un G4 la
+    cama o el hotend se acercan a la temperatura pedida (p.ej. se enfrían).
+
+El planificador es una aproximación (una pasada hacia adelante y otra hacia
+atrás por bloque, no el de firmware): sirve para planificar una cola, no para
+clavar el minuto. El estado de la máquina pasa de un bloque al siguiente.
+
+    est = estimate_gcode(meta["core"])
+    timeline = queue_timeline(items, plan, change_block, [est_a, est_b])
+"""
+import math
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from .cache import LRUCache
+from .gcode_loop import md5_bytes
+from .pipeline import chunk_text
+from .queue_builder import core_id
+from .sequence import SequencePlan
+
+CHUNK_SIZE = 4 << 20
+
+
+class MachineProfile(NamedTuple):
+    """Parámetros de la máquina (por defecto, una Bambu Lab A1)."""
+    max_speed: float = 500.0          # mm/s
+    accel: float = 10000.0            # mm/s² (M204 S lo cambia)
+    junction_deviation: float = 0.01  # mm
+    home_s: float = 15.0              # G28
+    hotend_heat: float = 3.0          # °C/s
+    hotend_cool: float = 1.5
+    bed_heat: float = 0.5
+    bed_cool: float = 0.05            # enfriado pasivo de la cama
+    ambient: float = 25.0             # °C al arrancar
+    filament_diameter: float = 1.75   # mm
+    filament_density: float = 1.24    # g/cm³ (PLA)
+
+
+DEFAULT_PROFILE = MachineProfile()
+
+# Columnas de la tabla de tokens
+_LETTERS = b"GMXYZEFIJSPR"
+_COL = {chr(c): i for i, c in enumerate(_LETTERS)}
+_WINDOW = 12  # máximo de caracteres de un número
+_POW10 = 10.0 ** np.arange(_WINDOW + 1)
+
+_IS_LETTER = np.zeros(256, dtype=bool)
+_IS_LETTER[list(_LETTERS)] = True
+_NUM_START = np.zeros(256, dtype=bool)
+_NUM_START[list(b"0123456789.-")] = True
+_TOKEN_PREV = np.zeros(256, dtype=bool)
+_TOKEN_PREV[list(b" \t\r\n0123456789.")] = True
+
+_MOVE_CODES = (0, 1, 2, 3, 380)
+
+
+def initial_state(profile: MachineProfile = DEFAULT_PROFILE, bed: Optional[float] = None,
+                  hotend: Optional[float] = None) -> Dict:
+    """
+    Estado de la máquina al empezar un G-code (posición, modos, temperaturas).
+    Con bed/hotend dados, esa es la temperatura actual y la pedida (el
+    calentador la mantiene hasta que el G-code pida otra).
+    """
+    hotend = profile.ambient if hotend is None else float(hotend)
+    bed = profile.ambient if bed is None else float(bed)
+    return {"x": 0.0, "y": 0.0, "z": 0.0, "e": 0.0, "abs_xyz": True, "rel_e": False,
+            "feed": 50.0, "accel": profile.accel, "hotend": hotend, "bed": bed,
+            "hotend_set": hotend, "bed_set": bed}
+
+
+def _tokenize(buf: bytes):
+    """
+    Tabla (filas x letras, NaN = ausente) de las líneas con comando G/M del
+    bloque, en orden. Los comentarios (';' hasta fin de línea) se ignoran.
+    """
+    b = np.frombuffer(buf, dtype=np.uint8)
+    n = len(b)
+    empty = np.empty((0, len(_LETTERS)))
+    if not n:
+        return empty
+    prev = np.empty_like(b)
+    prev[0] = 10
+    prev[1:] = b[:-1]
+    nxt = np.empty_like(b)
+    nxt[-1] = 32
+    nxt[:-1] = b[1:]
+    cand = np.flatnonzero(np.take(_IS_LETTER, b) & np.take(_NUM_START, nxt) & np.take(_TOKEN_PREV, prev))
+    if not len(cand):
+        return empty
+
+    newlines = np.flatnonzero(b == 10)
+    line = np.searchsorted(newlines, cand)
+    semis = np.flatnonzero(b == 59)
+    if len(semis):
+        # primer ';' de cada línea: lo que sigue es comentario
+        first_semi = np.full(len(newlines) + 1, n, dtype=np.int64)
+        semi_line = np.searchsorted(newlines, semis)
+        uniq, first = np.unique(semi_line, return_index=True)
+        first_semi[uniq] = semis[first]
+        keep = cand < first_semi[line]
+        cand, line = cand[keep], line[keep]
+
+    # números: ventana de bytes después de la letra (una fila por posición, una
+    # columna por token), parseada fila a fila
+    padded = np.concatenate([b, np.zeros(_WINDOW + 2, dtype=np.uint8)])
+    win = padded[np.arange(_WINDOW + 1)[:, None] + 1 + cand[None, :]]
+    digits = win - np.uint8(48)
+    is_digit = digits < 10
+    is_dot = win == 46
+    neg = win[0] == 45
+    ok = is_digit | is_dot
+    ok[0] |= neg
+    ok[_WINDOW] = False
+    stop = np.argmin(ok, axis=0)          # fin del número
+    rows = np.arange(_WINDOW + 1)[:, None]
+    in_num = rows < stop
+    use = is_digit & in_num
+    dots = is_dot & in_num
+    dot_at = np.where(dots.any(axis=0), np.argmax(dots, axis=0), stop)
+    mant = np.zeros(len(cand))
+    for c in range(_WINDOW):
+        mant = np.where(use[c], mant * 10 + digits[c], mant)
+    frac = np.count_nonzero(use & (rows > dot_at), axis=0)
+    values = mant / _POW10[frac]
+    values[neg] = -values[neg]
+    letters = b[cand]
+
+    # filas: líneas cuyo primer token es G o M
+    is_cmd = (letters == 71) | (letters == 77)
+    first_in_line = np.ones(len(cand), dtype=bool)
+    first_in_line[1:] = line[1:] != line[:-1]
+    cmd_tok = np.flatnonzero(is_cmd & first_in_line)
+    line_row = np.full(len(newlines) + 1, -1, dtype=np.int64)
+    line_row[line[cmd_tok]] = np.arange(len(cmd_tok))
+    row = line_row[line]
+    table = np.full((len(cmd_tok), len(_LETTERS)), np.nan)
+    valid = row >= 0
+    col = np.zeros(256, dtype=np.int64)
+    col[list(_LETTERS)] = np.arange(len(_LETTERS))
+    table[row[valid], col[letters[valid]]] = values[valid]
+    return table
+
+
+def _ffill(values: np.ndarray, present: np.ndarray, init: float) -> np.ndarray:
+    """Último valor presente hasta cada fila (init antes del primero)."""
+    idx = np.where(present, np.arange(len(values)), -1)
+    np.maximum.accumulate(idx, out=idx)
+    return np.where(idx >= 0, values[np.maximum(idx, 0)], init)
+
+
+def _positions(is_set: np.ndarray, set_val: np.ndarray, add: np.ndarray, init: float) -> np.ndarray:
+    """Posición de un eje por fila: valores absolutos (is_set) más incrementos relativos."""
+    c = np.cumsum(add)
+    idx = np.where(is_set, np.arange(len(add)), -1)
+    np.maximum.accumulate(idx, out=idx)
+    j = np.maximum(idx, 0)
+    base = np.where(idx >= 0, set_val[j] - c[j], init)
+    return base + c
+
+
+def _segment_times(length: np.ndarray, v: np.ndarray, v0: np.ndarray, v1: np.ndarray,
+                   a: np.ndarray) -> np.ndarray:
+    """Tiempo de cada segmento con perfil trapezoidal (o triangular si no llega a crucero)."""
+    d_acc = (v * v - v0 * v0) / (2 * a)
+    d_dec = (v * v - v1 * v1) / (2 * a)
+    cruise = length - d_acc - d_dec
+    t_trap = (v - v0) / a + (v - v1) / a + np.maximum(cruise, 0) / v
+    peak = np.sqrt(np.maximum((2 * a * length + v0 * v0 + v1 * v1) / 2, 0))
+    peak = np.maximum(peak, np.maximum(v0, v1))
+    t_tri = (peak - v0) / a + (peak - v1) / a
+    return np.where(cruise >= 0, t_trap, t_tri)
+
+
+def _estimate_chunk(table: np.ndarray, state: Dict, profile: MachineProfile, acc: Dict) -> None:
+    rows = len(table)
+    if not rows:
+        return
+    col = lambda k: table[:, _COL[k]]
+    g, m = col("G"), col("M")
+    is_g = ~np.isnan(g)
+    is_m = ~np.isnan(m)
+    code = np.where(is_g, g, np.where(is_m, m, -1)).round().astype(np.int64)
+
+    def g_is(*codes):
+        return is_g & np.isin(code, codes)
+
+    def m_is(*codes):
+        return is_m & np.isin(code, codes)
+
+    move = g_is(*_MOVE_CODES)
+    g92 = g_is(92)
+    g28 = g_is(28)
+
+    # modos
+    mode_ev = np.where(g_is(90), 1.0, np.where(g_is(91), 0.0, np.nan))
+    abs_xyz = _ffill(mode_ev, ~np.isnan(mode_ev), float(state["abs_xyz"])) > 0.5
+    e_ev = np.where(m_is(83), 1.0, np.where(m_is(82), 0.0, np.nan))
+    rel_e = (_ffill(e_ev, ~np.isnan(e_ev), float(state["rel_e"])) > 0.5) | ~abs_xyz
+
+    # posiciones por eje
+    pos = {}
+    for axis, relative in (("x", ~abs_xyz), ("y", ~abs_xyz), ("z", ~abs_xyz), ("e", rel_e)):
+        val = col(axis.upper())
+        present = ~np.isnan(val)
+        home = g28 if axis != "e" else np.zeros(rows, dtype=bool)
+        is_set = (move & present & ~relative) | (g92 & present) | home
+        set_val = np.where(home, 0.0, np.nan_to_num(val))
+        add = np.where(move & present & relative, val, 0.0)
+        p = _positions(is_set, set_val, add, state[axis])
+        prev = np.empty_like(p)
+        prev[0] = state[axis]
+        prev[1:] = p[:-1]
+        pos[axis] = (prev, p)
+
+    f = col("F")
+    feed = _ffill(f / 60.0, is_g & ~np.isnan(f), state["feed"])
+    s_acc = np.where(m_is(204), col("S"), np.nan)
+    accel = _ffill(s_acc, ~np.isnan(s_acc), state["accel"])
+
+    # movimientos
+    mi = np.flatnonzero(move)
+    if len(mi):
+        (x0, x1), (y0, y1), (z0, z1), (e0, e1) = (
+            (pos[k][0][mi], pos[k][1][mi]) for k in ("x", "y", "z", "e"))
+        dx, dy, dz, de = x1 - x0, y1 - y0, z1 - z0, e1 - e0
+        length = np.sqrt(dx * dx + dy * dy + dz * dz)
+        arc = np.isin(code[mi], (2, 3))
+        if arc.any():
+            ii = np.nan_to_num(col("I")[mi])
+            jj = np.nan_to_num(col("J")[mi])
+            cx, cy = x0 + ii, y0 + jj
+            r = np.hypot(ii, jj)
+            a0 = np.arctan2(y0 - cy, x0 - cx)
+            a1 = np.arctan2(y1 - cy, x1 - cx)
+            sweep = np.where(code[mi] == 2, a0 - a1, a1 - a0) % (2 * math.pi)
+            sweep = np.where(sweep < 1e-9, 2 * math.pi, sweep)
+            length = np.where(arc, np.hypot(r * sweep, dz), length)
+        # movimientos sólo de extrusor (retracciones); los nulos (p.ej. "G1 F3000") no cuentan
+        length = np.where(length > 1e-9, length, np.abs(de))
+        real = length > 1e-9
+        dx, dy, dz, de, length = dx[real], dy[real], dz[real], de[real], length[real]
+        mi = mi[real]
+        v = np.clip(feed[mi], 1e-3, profile.max_speed)
+        a = np.maximum(accel[mi], 1.0)
+
+        # velocidad de unión entre segmentos consecutivos (junction deviation)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            ux, uy, uz = dx / length, dy / length, dz / length
+        ux, uy, uz = np.nan_to_num(ux), np.nan_to_num(uy), np.nan_to_num(uz)
+        cos_theta = -(ux[:-1] * ux[1:] + uy[:-1] * uy[1:] + uz[:-1] * uz[1:])
+        sin_half = np.sqrt(np.clip(0.5 * (1 - cos_theta), 0, 1))
+        with np.errstate(divide="ignore"):
+            vj = np.sqrt(a[1:] * profile.junction_deviation * sin_half / np.maximum(1 - sin_half, 1e-9))
+        vj = np.minimum(vj, np.minimum(v[:-1], v[1:]))
+        entry = np.concatenate(([0.0], vj))
+        exit_ = np.concatenate((vj, [0.0]))
+        exit_ = np.minimum(exit_, np.sqrt(entry * entry + 2 * a * length))
+        entry = np.minimum(entry, np.sqrt(exit_ * exit_ + 2 * a * length))
+        joint = np.minimum(exit_[:-1], entry[1:])
+        entry[1:] = joint
+        exit_[:-1] = joint
+        t = _segment_times(length, v, entry, exit_, a)
+        acc["move_s"] += float(t.sum())
+        acc["moves"] += len(mi)
+        acc["extrude_mm"] += float(de[de > 0].sum())
+
+    # pausas y esperas
+    s, p = col("S"), col("P")
+    g4 = g_is(4)
+    acc["dwell_s"] += float(np.nansum(np.where(g4 & ~np.isnan(s), s, 0.0)) +
+                            np.nansum(np.where(g4 & np.isnan(s) & ~np.isnan(p), p / 1000.0, 0.0)))
+    acc["home_s"] += float(g28.sum()) * profile.home_s
+
+    # temperaturas: son pocos comandos, así que se simulan en orden. El estado
+    # guarda la temperatura alcanzada y la pedida; las esperas M109/M190 cuestan
+    # lo que falta para llegar (S: sólo calentar, R: en ambos sentidos) y durante
+    # un G4 la temperatura se acerca a la pedida (p.ej. la cama apagada se enfría)
+    r = col("R")
+    target = np.where(~np.isnan(s), s, r)
+    heaters = {104: ("hotend", False), 109: ("hotend", True), 140: ("bed", False), 190: ("bed", True)}
+    rates = {"hotend": (profile.hotend_heat, profile.hotend_cool), "bed": (profile.bed_heat, profile.bed_cool)}
+    events = np.flatnonzero((m_is(*heaters) & ~np.isnan(target)) | g4)
+    for i in events.tolist():
+        if code[i] == 4:
+            dwell = s[i] if not np.isnan(s[i]) else (p[i] / 1000.0 if not np.isnan(p[i]) else 0.0)
+            for name, (heat, cool) in rates.items():
+                goal = max(state[f"{name}_set"], profile.ambient)
+                cur = state[name]
+                state[name] = min(goal, cur + heat * dwell) if goal > cur else max(goal, cur - cool * dwell)
+            continue
+        name, wait = heaters[int(code[i])]
+        goal = float(target[i])
+        state[f"{name}_set"] = goal
+        acc[f"max_{name}"] = max(acc[f"max_{name}"], goal)
+        if not wait:
+            continue
+        heat, cool = rates[name]
+        delta = goal - state[name]
+        acc["heat_s"] += max(delta, 0) / heat + (max(-delta, 0) / cool if not np.isnan(r[i]) else 0.0)
+        if acc[f"first_{name}_wait"] is None:
+            acc[f"first_{name}_wait"] = goal
+        state[name] = goal
+
+    for k in ("x", "y", "z", "e"):
+        state[k] = float(pos[k][1][-1])
+    state["abs_xyz"] = bool(abs_xyz[-1])
+    state["rel_e"] = bool(_ffill(e_ev, ~np.isnan(e_ev), float(state["rel_e"]))[-1] > 0.5)
+    state["feed"] = float(feed[-1])
+    state["accel"] = float(accel[-1])
+
+
+def estimate_gcode(text: str, profile: MachineProfile = DEFAULT_PROFILE,
+                   state: Optional[Dict] = None) -> Dict:
+    """
+    Estima un G-code. Devuelve:
+      - time_s: total; move_s / dwell_s / heat_s / home_s: cómo se reparte
+      - moves, extrude_mm, filament_g
+      - max_bed / max_hotend: temperatura objetivo más alta que aparece
+      - final_bed / final_hotend: temperatura al terminar
+      - first_bed_wait / first_hotend_wait: objetivo de la primera espera (o None)
+      - start_bed / start_hotend: temperaturas de las que se partió
+    `state` (ver initial_state) es el estado al empezar; se actualiza in situ.
+    """
+    state = initial_state(profile) if state is None else state
+    acc = {"move_s": 0.0, "dwell_s": 0.0, "heat_s": 0.0, "home_s": 0.0, "moves": 0,
+           "extrude_mm": 0.0, "max_bed": state["bed"], "max_hotend": state["hotend"],
+           "first_bed_wait": None, "first_hotend_wait": None, "start_bed": state["bed"],
+           "start_hotend": state["hotend"]}
+    for chunk in chunk_text(text, CHUNK_SIZE):
+        _estimate_chunk(_tokenize(chunk.encode("utf-8")), state, profile, acc)
+    area = math.pi * (profile.filament_diameter / 2) ** 2
+    acc["filament_g"] = acc["extrude_mm"] * area * profile.filament_density / 1000.0
+    acc["time_s"] = acc["move_s"] + acc["dwell_s"] + acc["heat_s"] + acc["home_s"]
+    acc["final_bed"] = state["bed"]
+    acc["final_hotend"] = state["hotend"]
+    return acc
+
+
+def estimate_plate_cached(meta: Dict, cache: Optional[LRUCache],
+                          profile: MachineProfile = DEFAULT_PROFILE) -> Dict:
+    """
+    estimate_gcode del core de un plate (meta de read_3mf/read_plate), una vez
+    por core y perfil. La clave es core_id: un core reducido (minify) se estima
+    aparte del original.
+    """
+    if cache is None:
+        return estimate_gcode(meta["core"], profile)
+    key = md5_bytes(f"estimate:{core_id(meta)}:{tuple(profile)}".encode("utf-8"))
+    return cache.get_or_compute(key, lambda: estimate_gcode(meta["core"], profile), lambda _: 1024)
+
+
+def change_estimate(change_block: str, bed: float, hotend: float,
+                    profile: MachineProfile = DEFAULT_PROFILE) -> Dict:
+    """Estimación del bloque entre impresiones (espera + cambio) partiendo de las temperaturas dadas."""
+    return estimate_gcode(change_block, profile, initial_state(profile, bed=bed, hotend=hotend))
+
+
+def _after_print(est: Dict, change_block: str, profile: MachineProfile, changes: Dict) -> Dict:
+    """Estimación del cambio después de una impresión, una vez por temperatura final distinta."""
+    key = (est["final_bed"], est["final_hotend"])
+    if key not in changes:
+        changes[key] = change_estimate(change_block, est["final_bed"], est["final_hotend"], profile)
+    return changes[key]
+
+
+def _print_time(est: Dict, after: Optional[Dict], profile: MachineProfile) -> float:
+    # cada plate se estima desde temperatura ambiente; después de un cambio
+    # la primera espera arranca de lo que dejó el cambio
+    t = est["time_s"]
+    if after is not None:
+        for name, rate in (("bed", profile.bed_heat), ("hotend", profile.hotend_heat)):
+            goal = est[f"first_{name}_wait"]
+            if goal is not None:
+                t += (max(goal - after[f"final_{name}"], 0) - max(goal - est[f"start_{name}"], 0)) / rate
+    return t
+
+
+def transition_costs(estimates: Sequence[Dict], change_block: str,
+                     profile: MachineProfile = DEFAULT_PROFILE):
+    """
+    Costos para comparar órdenes de impresión: first[b] es lo que tarda b como
+    primera impresión y trans[a][b] lo que se suma al poner b después de a
+    (cambio de placa tras a + impresión de b desde la temperatura del cambio).
+    La duración de una cola es first[o0] + sum(trans[o_i][o_i+1]).
+    """
+    changes: Dict[tuple, Dict] = {}
+    first = [_print_time(est, None, profile) for est in estimates]
+    trans = []
+    for a in estimates:
+        change = _after_print(a, change_block, profile, changes)
+        trans.append([change["time_s"] + _print_time(b, change, profile) for b in estimates])
+    return first, trans
+
+
+def queue_timeline(items: Sequence[Dict], plan: SequencePlan, change_block: str,
+                   estimates: Sequence[Dict], profile: MachineProfile = DEFAULT_PROFILE) -> Dict:
+    """
+    Línea de tiempo de la cola: un paso por impresión ({"#", "model", "start_s",
+    "end_s", "change_s"}), la duración de cada run del plan y los totales. El
+    cambio de placa depende de la temperatura final de la impresión anterior
+    (p.ej. cuánto tarda M190 R en enfriar), así que se estima una vez por
+    temperatura distinta.
+    """
+    changes: Dict[tuple, Dict] = {}
+    steps: List[Dict] = []
+    runs: List[float] = []
+    t = 0.0
+    total = plan.total_prints
+    n = 0
+    print_s = change_s = 0.0
+    last_change: Optional[Dict] = None
+    for run in plan.runs:
+        run_start = t
+        for _ in range(run.count):
+            for model in run.models:
+                n += 1
+                start = t
+                duration = _print_time(estimates[model], last_change, profile)
+                t += duration
+                print_s += duration
+                last_change = _after_print(estimates[model], change_block, profile, changes) if n < total else None
+                between = last_change["time_s"] if last_change is not None else 0.0
+                steps.append({"#": n, "model": model, "start_s": start, "end_s": t, "change_s": between})
+                t += between
+                change_s += between
+        runs.append(t - run_start)
+    filament_g = sum(estimates[m]["filament_g"] * c for m, c in enumerate(plan.repeats(len(items))))
+    return {"steps": steps, "runs": runs, "total_s": t, "print_s": print_s,
+            "change_s": change_s, "filament_g": filament_g}
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(round(seconds))
+    h, rem = divmod(seconds, 3600)
+    m, s = divmod(rem, 60)
+    if h:
+        return f"{h} h {m:02d} min"
+    if m:
+        return f"{m} min {s:02d} s"
+    return f"{s} s"
@@ -1,5 +1,7 @@
 import io, re, zipfile, hashlib
+from bisect import bisect_left
 from datetime import datetime
+from functools import lru_cache
 from typing import List, Tuple, Optional, Dict
 
 SECTION_RE = re.compile(
@@ -50,6 +52,53 @@ G28 Y;
 ;========Finish to change plates =================
 """
 
+# Bloque de cambio fijo (sin ciclos) que usa la app entre repeticiones
+CHANGE_BLOCK_FIXED = """;======== Starting custom sequence =================          ; Bloque inicial personalizado
+
+;======== Starting to change plates =================         ; Inicio de la secuencia de cambio de placas
+                              ;G91; 
+  
+
+                            ; G380 S2 Z266 F1200 
+
+
+G90                         ; Vuelve a modo absoluto
+
+G28 Y                       ; Home solo del eje Y
+G91                         ; Modo relativo
+G380 S2 Z30 F1200           ; Movimiento/probing Z especial (según firmware)
+G90                         ; Vuelve a modo absoluto
+M211 Y0 Z0                  ; (Opcional) desactiva límites suaves en Y/Z
+G91                         ; Modo relativo
+G90                         ; Vuelve a modo absoluto
+
+; ----- Secuencia de expulsión en Y -----
+G1 Y250 F2000
+G1 Y266 F500
+G1 Z260 F500                ; Ajusta Z a 260 mm durante el ciclo
+G1 Y150 F500
+G1 Y35 F1000
+G1 Y0 F2500
+G91
+G380 S3 Z0 F1200          ; Baja Z 15 mm (proceso de expulsión)
+G90
+
+G1 Y266 F2000
+G1 Y53  F2000
+G1 Y100 F2000
+G1 Y266 F2000
+G1 Y250 F8000
+G1 Y266 F8000
+G1 Y0   F1000
+G1 Y150 F1000
+G1 Z100 F1000
+G28 Y           
+
+;======== Finish to change plates =================           ; Fin de la secuencia de cambio de placas
+
+
+"""
+
 def md5_bytes(b: bytes) -> str:
     h = hashlib.md5(); h.update(b); return h.hexdigest()
 
@@ -75,9 +124,9 @@ def find_cycles(lines: List[str]) -> Tuple[Optional[int], Optional[int], List[Tu
         j = i + 1
         if j < n and (lines[j].strip().startswith(";") or lines[j].strip() == ""):
             j += 1
-        if j >= n or not ZUP_RE.match(lines[j]):
+        m_up = ZUP_RE.match(lines[j]) if j < n else None
+        if not m_up:
             break
-        m_up = ZUP_RE.match(lines[j])
         down = float(m_down.group("down"))
         up   = float(m_up.group("up"))
         cycles.append((down, up))
@@ -105,34 +154,42 @@ def rebuild_cycles(desired_cycles:int, down_mm:float, up_mm:float,
         out.append(f"G380 S2 Z{up_mm}{f_up}{(' ' + comment_up) if comment_up and not comment_up.startswith(';') else comment_up}".rstrip() + "\n")
     return "".join(out)
 
-def normalize_existing_change_sections(text:str, cycles:int, down_mm:float, up_mm:float, report:list):
+def normalize_existing_change_sections(text:str, cycles:int, down_mm:float, up_mm:float, report:list,
+                                       index:"Optional[GcodeIndex]"=None):
+    """
+    Reescribe los ciclos G380 de cada sección 'change plates' de `text`.
+    Usa el índice de marcadores (se construye si no se pasa uno del mismo
+    texto): las secciones y las líneas G380 salen del índice, así que el costo
+    es lineal aunque haya muchas secciones.
+    """
+    if index is None:
+        index = GcodeIndex(text)
+    sections = index.sections()
+    if not sections:
+        report.append("No se encontraron secciones 'change plates'.")
+        return text, None, False
+
     first_section_text = None
-    def _replace(m):
-        nonlocal first_section_text
-        head, body, tail = m.group(1), m.group(2), m.group(3)
-        lines = body.splitlines(keepends=False)
-        s, e, found = find_cycles(lines)
+    out = []
+    pos = 0
+    for start, body_start, body_end, end in sections:
+        out.append(text[pos:start])
+        head, tail = text[start:body_start], text[body_end:end]
+        found = index.cycle_span(body_start, body_end)
         if found:
-            example_down = lines[s]
-            example_up   = lines[s+1] if s+1 < len(lines) else None
+            s, e, example_down, example_up = found
             new_cycle_lines = rebuild_cycles(cycles, down_mm, up_mm, example_down, example_up)
-            new_body = "\n".join(lines[:s]) + ("\n" if s>0 else "") + new_cycle_lines + ("\n" if e < len(lines) else "") + "\n".join(lines[e:])
-            res = head + new_body + tail
-            if first_section_text is None:
-                first_section_text = res
+            res = head + text[body_start:s] + new_cycle_lines + text[e:body_end] + tail
             report.append(f"[change plates] ciclos normalizados → {cycles} (down={down_mm}, up={up_mm})")
-            return res
         else:
-            if first_section_text is None:
-                first_section_text = head + body + tail
+            res = text[start:end]
             report.append("[change plates] sección sin ciclos; no cambios.")
-            return head + body + tail
-
-    new_text, n = SECTION_RE.subn(_replace, text)
-    if n == 0:
-        report.append("No se encontraron secciones 'change plates'.")
-        return text, None, False
-    return new_text, first_section_text, True
+        if first_section_text is None:
+            first_section_text = res
+        out.append(res)
+        pos = end
+    out.append(text[pos:])
+    return "".join(out), first_section_text, True
 
 def build_change_block_from_template(cycles:int, down_mm:float, up_mm:float, template:str) -> str:
     cycle_lines = rebuild_cycles(cycles, down_mm, up_mm, None, None)
@@ -142,13 +199,262 @@ def build_change_block_from_template(cycles:int, down_mm:float, up_mm:float, tem
     inject_at = min(2, len(parts))
     return "".join(parts[:inject_at]) + cycle_lines + "\n" + "".join(parts[inject_at:])
 
-def split_core_and_shutdown(text:str):
-    m_end = list(END_OF_PRINT_RE.finditer(text))
-    if m_end:
-        idx = m_end[-1].start()
-        return text[:idx], text[idx:]
-    m = list(SHUTDOWN_RE.finditer(text))
-    if not m:
-        return text, ""
-    idx = m[-1].start()
+# --- Partición core / apagado: búsqueda hacia atrás --------------------------------
+# Equivalente a tomar el último match de END_OF_PRINT_RE (o, si no hay, de
+# SHUTDOWN_RE), pero recorriendo el buffer desde el final en bloques: el costo es
+# O(largo de la cola) y no O(archivo). Funciona sobre str, bytes o mmap.
+
+_SCAN_CHUNK = 1 << 20
+
+_EOP_LINE = {
+    str: re.compile(r"^[^\S\n]*;.*END_OF_PRINT", re.IGNORECASE | re.MULTILINE),
+    bytes: re.compile(rb"^[^\S\n]*;.*END_OF_PRINT", re.IGNORECASE | re.MULTILINE),
+}
+_SHUTDOWN_LINE = {
+    str: re.compile(r"^[^\S\n]*(?:M104\s+S0\b|M140\s+S0\b|M106\s+S0\b|M107\b|M84\b|M18\b)",
+                    re.IGNORECASE | re.MULTILINE),
+    bytes: re.compile(rb"^[^\S\n]*(?:M104\s+S0\b|M140\s+S0\b|M106\s+S0\b|M107\b|M84\b|M18\b)",
+                      re.IGNORECASE | re.MULTILINE),
+}
+_SHUTDOWN_RE_BYTES = re.compile(SHUTDOWN_RE.pattern.encode("ascii"), re.IGNORECASE | re.MULTILINE)
+
+
+def _kind(buf) -> type:
+    return str if isinstance(buf, str) else bytes
+
+def _prev_line(buf, line_start:int, nl) -> int:
+    """Inicio de la línea anterior a la que empieza en line_start (> 0)."""
+    return buf.rfind(nl, 0, line_start - 1) + 1
+
+def _extend_over(buf, line_start:int, keep) -> int:
+    """Retrocede line_start mientras la línea anterior cumpla keep(ini, fin)."""
+    nl = "\n" if isinstance(buf, str) else b"\n"
+    while line_start > 0:
+        prev = _prev_line(buf, line_start, nl)
+        if not keep(prev, line_start - 1):
+            break
+        line_start = prev
+    return line_start
+
+def find_shutdown_offset(buf) -> int:
+    """
+    Offset donde empieza el bloque de apagado (len(buf) si no hay): el mismo
+    punto de corte que usaba split_core_and_shutdown con los regex sobre todo
+    el texto, pero buscando desde el final y sin copiar el contenido.
+    """
+    kind = _kind(buf)
+    nl = "\n" if kind is str else b"\n"
+    eop_re, shut_re = _EOP_LINE[kind], _SHUTDOWN_LINE[kind]
+    last_shutdown = -1
+    end = len(buf)
+    while end > 0:
+        start = max(0, end - _SCAN_CHUNK)
+        if start > 0:
+            start = buf.rfind(nl, 0, start) + 1
+        last = None
+        for last in eop_re.finditer(buf, start, end):
+            pass
+        if last is not None:
+            return _cut_from_markers(buf, last.start(), -1)
+        if last_shutdown < 0:
+            for m in shut_re.finditer(buf, start, end):
+                last_shutdown = m.start()
+        end = start
+    return _cut_from_markers(buf, -1, last_shutdown)
+
+def _cut_from_markers(buf, last_eop:int, last_shutdown:int) -> int:
+    """
+    Punto de corte a partir del inicio de la última línea END_OF_PRINT y de la
+    última línea de apagado (-1 si no hay).
+    """
+    kind = _kind(buf)
+    blank = lambda a, b: not buf[a:b].strip()
+    if last_eop >= 0:
+        # `^\s*` del regex original también se come las líneas en blanco previas
+        return _extend_over(buf, last_eop, blank)
+    if last_shutdown < 0:
+        return len(buf)
+    # Sin END_OF_PRINT: los matches de SHUTDOWN_RE pueden encadenar varias
+    # líneas (`\s*.*$`), así que se re-evalúa el regex original desde el
+    # comienzo del tramo de líneas de apagado/en blanco que termina en la última.
+    shut_re = _SHUTDOWN_LINE[kind]
+    run_start = _extend_over(buf, last_shutdown,
+                             lambda a, b: blank(a, b) or shut_re.match(buf, a, b + 1) is not None)
+    full_re = SHUTDOWN_RE if kind is str else _SHUTDOWN_RE_BYTES
+    last = None
+    for last in full_re.finditer(buf, run_start):
+        pass
+    return last.start()
+
+def build_wait_block(wait_mode:str, wait_minutes:float=0.0, target_bed:float=0.0) -> str:
+    """
+    Bloque de espera que va antes de cada cambio de placa:
+      - "time": apaga la cama y espera wait_minutes (G4 S<segundos>).
+      - "temp": apaga la cama y espera a que baje a target_bed (M190 R<temp>).
+    Devuelve "" si no corresponde esperar.
+    """
+    if wait_mode == "time" and wait_minutes > 0:
+        seconds = int(wait_minutes * 60)
+        return (
+            "; PrintLooper: esperar por tiempo antes del cambio de placa\n"
+            "M140 S0\n"
+            f"G4 S{seconds}\n"
+        )
+    if wait_mode == "temp":
+        return (
+            "; PrintLooper: enfriar cama a temperatura objetivo antes del cambio de placa\n"
+            "M140 S0\n"
+            f"M190 R{int(target_bed)}\n"
+        )
+    return ""
+
+def split_core_and_shutdown(text:str, index:"Optional[GcodeIndex]"=None):
+    idx = index.shutdown_offset() if index is not None else find_shutdown_offset(text)
     return text[:idx], text[idx:]
+
+# --- Índice de marcadores ------------------------------------------------------------
+# Una pasada por tipo de marcador (búsquedas de literales en C sobre el texto en
+# minúsculas) arma la lista de offsets de: inicio/fin de 'change plates', líneas
+# G380, líneas END_OF_PRINT y comandos de apagado. Normalizar, partir y reescribir
+# ciclos consultan el índice en vez de volver a recorrer el texto con regex.
+
+@lru_cache(maxsize=None)
+def _index_patterns(kind:type, ignorecase:bool) -> Dict[str, "re.Pattern"]:
+    flags = re.IGNORECASE if ignorecase else 0
+    src = {
+        "change": r";=+\s*(?:(?P<start>starting)|finish)\s+to\s+change\s+plates",
+        "probe": r"g380\b",
+        "eop": r"end_of_print",
+        "shutdown": r"m1(?:0[467]|40)\b|m84\b|m18\b",
+    }
+    if kind is bytes:
+        return {k: re.compile(v.encode("ascii"), flags) for k, v in src.items()}
+    return {k: re.compile(v, flags) for k, v in src.items()}
+
+class GcodeIndex:
+    """
+    Índice de líneas marcadoras de un G-code (str o bytes), con sus offsets:
+      - change_starts / change_ends: posición del ';' de cada marcador
+        'Starting/Finish to change plates' (lo mismo que matchea SECTION_RE)
+      - probes: inicio de cada línea G380
+      - end_of_print: inicio de cada línea de comentario con END_OF_PRINT
+      - shutdowns: inicio de cada línea de apagado (M104/M140/M106 S0, M107, M84, M18)
+    Los offsets valen sólo para el texto con que se construyó.
+    """
+
+    def __init__(self, buf):
+        self.buf = buf
+        kind = _kind(buf)
+        nl = "\n" if kind is str else b"\n"
+        # En minúsculas se pueden usar búsquedas de literales (mucho más rápidas
+        # que IGNORECASE); con str no-ASCII lower() puede mover offsets.
+        ascii_safe = kind is bytes or buf.isascii()
+        hay = buf.lower() if ascii_safe else buf
+        pats = _index_patterns(kind, not ascii_safe)
+
+        def line_start(p):
+            return buf.rfind(nl, 0, p) + 1
+
+        def at_line_start(p):
+            ls = line_start(p)
+            return ls if not buf[ls:p].strip() else -1
+
+        self.change_starts: List[int] = []
+        self.change_ends: List[int] = []
+        for m in pats["change"].finditer(hay):
+            (self.change_starts if m.group("start") else self.change_ends).append(m.start())
+
+        self.probes: List[int] = [ls for ls in map(at_line_start, (m.start() for m in pats["probe"].finditer(hay)))
+                                  if ls >= 0]
+
+        eop_line, shut_line = _EOP_LINE[kind], _SHUTDOWN_LINE[kind]
+        self.end_of_print: List[int] = []
+        for m in pats["eop"].finditer(hay):
+            ls = line_start(m.start())
+            if (not self.end_of_print or self.end_of_print[-1] != ls) and eop_line.match(buf, ls):
+                self.end_of_print.append(ls)
+
+        self.shutdowns: List[int] = []
+        for m in pats["shutdown"].finditer(hay):
+            ls = at_line_start(m.start())
+            if ls >= 0 and shut_line.match(buf, ls):
+                self.shutdowns.append(ls)
+
+    def _line_end(self, start:int, limit:int) -> int:
+        nl = "\n" if isinstance(self.buf, str) else b"\n"
+        end = self.buf.find(nl, start, limit)
+        return limit if end < 0 else end
+
+    def shutdown_offset(self) -> int:
+        """Lo mismo que find_shutdown_offset(buf), sin volver a recorrer el texto."""
+        return _cut_from_markers(self.buf,
+                                 self.end_of_print[-1] if self.end_of_print else -1,
+                                 self.shutdowns[-1] if self.shutdowns else -1)
+
+    def sections(self) -> List[Tuple[int, int, int, int]]:
+        """
+        Secciones 'change plates' como (inicio, inicio_cuerpo, fin_cuerpo, fin),
+        emparejadas igual que SECTION_RE: cada inicio con el primer fin posterior
+        a su línea, y la búsqueda sigue después de ese fin.
+        """
+        buf = self.buf
+        nl = "\n" if isinstance(buf, str) else b"\n"
+        out = []
+        pos = 0
+        ends = self.change_ends
+        for start in self.change_starts:
+            if start < pos:
+                continue
+            body_start = buf.find(nl, start) + 1
+            if body_start == 0:
+                break
+            k = bisect_left(ends, body_start)
+            while k < len(ends) and buf.find(nl, ends[k]) < 0:
+                k += 1
+            if k == len(ends):
+                break
+            body_end = ends[k]
+            pos = buf.find(nl, body_end) + 1
+            out.append((start, body_start, body_end, pos))
+        return out
+
+    def cycle_span(self, body_start:int, body_end:int):
+        """
+        Igual que find_cycles sobre las líneas del cuerpo [body_start, body_end),
+        pero mirando sólo las líneas G380 del índice. Devuelve (inicio, fin,
+        línea_down_ejemplo, línea_siguiente) en offsets del texto, o None.
+        """
+        buf = self.buf
+        probes = self.probes
+        k = bisect_left(probes, body_start)
+        probe_set = set()
+        while k < len(probes) and probes[k] < body_end:
+            probe_set.add(probes[k])
+            k += 1
+        if not probe_set:
+            return None
+
+        def line(a):
+            return buf[a:self._line_end(a, body_end)]
+
+        def next_line(a):
+            return self._line_end(a, body_end) + 1
+
+        first = next((p for p in sorted(probe_set) if ZDOWN_RE.match(line(p))), None)
+        if first is None:
+            return None
+        i = first
+        n_cycles = 0
+        while i < body_end and i in probe_set and ZDOWN_RE.match(line(i)):
+            j = next_line(i)
+            if j < body_end and (line(j).strip().startswith(";") or line(j).strip() == ""):
+                j = next_line(j)
+            if j >= body_end or j not in probe_set or not ZUP_RE.match(line(j)):
+                break
+            n_cycles += 1
+            i = next_line(j)
+        if not n_cycles:
+            return None
+        after = next_line(first)
+        example_up = line(after) if after < body_end else None
+        return first, min(i, body_end), line(first), example_up
@@ -0,0 +1,202 @@
+# core/jobs.py
+"""
+Builds en segundo plano para la app: un BuildExecutor (uno por servidor,
+compartido por todas las sesiones) corre cada build en un hilo y devuelve un
+BuildJob que la sesión guarda en session_state y consulta en cada rerun.
+
+    job = executor.submit(lambda job: build_to_file(
+        lambda fp: build_final_3mf(files, plate, job.track(iter_sequence(...)), out=fp)))
+    ...
+    job.progress, job.status, job.result / job.cancel()
+
+Con `key` (la clave de caché del build), submit() no arranca un segundo build
+igual mientras el primero sigue: devuelve el mismo BuildJob, así la otra
+sesión ve su progreso. job.leave() suelta la sesión y cancela el build sólo si
+no queda ninguna otra mirándolo.
+
+job.track() cuenta los segmentos y bytes que pasan al compresor y corta el
+build con BuildCancelled si se pidió cancelar. Los hilos alcanzan: zlib suelta
+el GIL mientras comprime, así que varios builds avanzan a la vez.
+"""
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, TypeVar
+
+from .sequence import SequencePlan
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+CANCELLED = "cancelled"
+FAILED = "error"
+
+Seg = TypeVar("Seg", str, bytes)
+
+
+class BuildCancelled(Exception):
+    """El build se canceló desde la interfaz."""
+
+
+class BuildJob:
+    """Estado de un build: progreso, resultado o error, y pedido de cancelación."""
+
+    def __init__(self, job_id: int, total_bytes: int = 0):
+        self.id = job_id
+        self.status = PENDING
+        self.segments = 0          # segmentos escritos
+        self.bytes_done = 0        # bytes de G-code que pasaron al compresor
+        self.total_bytes = int(total_bytes)
+        self.result: Any = None
+        self.metrics: Any = None   # core.metrics.Metrics, si el build la usa
+        self.error: Optional[str] = None
+        self.submitted = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.sessions = 1          # sesiones que siguen este build (ver BuildExecutor.submit)
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"BuildJob({self.id}, {self.status})"
+
+    @property
+    def done(self) -> bool:
+        return self.status in (DONE, CANCELLED, FAILED)
+
+    @property
+    def progress(self) -> float:
+        """Fracción 0..1 (0 si no se conoce el total)."""
+        if self.status == DONE:
+            return 1.0
+        if not self.total_bytes:
+            return 0.0
+        return min(1.0, self.bytes_done / self.total_bytes)
+
+    @property
+    def elapsed(self) -> float:
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def shared(self) -> bool:
+        return self.sessions > 1
+
+    def cancel(self) -> None:
+        self._cancel.set()
+
+    def join(self) -> None:
+        """Suma una sesión que sigue este build."""
+        with self._lock:
+            self.sessions += 1
+
+    def leave(self) -> bool:
+        """
+        La sesión deja de seguir el build. Si era la última lo cancela y
+        devuelve True; si otras lo siguen, el build continúa y devuelve False.
+        """
+        with self._lock:
+            self.sessions = max(0, self.sessions - 1)
+            last = not self.sessions
+        if last:
+            self.cancel()
+        return last
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel.is_set()
+
+    def check(self) -> None:
+        """Lanza BuildCancelled si se pidió cancelar."""
+        if self._cancel.is_set():
+            raise BuildCancelled("Build cancelado.")
+
+    def track(self, segments: Iterable[Seg]) -> Iterator[Seg]:
+        """Pasa los segmentos tal cual, contando progreso y chequeando cancelación."""
+        sizes: Dict[str, int] = {}
+        for seg in segments:
+            self.check()
+            if isinstance(seg, str):
+                n = sizes.get(seg)
+                if n is None:
+                    n = sizes[seg] = len(seg) if seg.isascii() else len(seg.encode("utf-8"))
+            else:
+                n = len(seg)
+            yield seg
+            self.segments += 1
+            self.bytes_done += n
+
+    def _run(self, fn: Callable[["BuildJob"], Any]) -> None:
+        if self.cancel_requested:
+            self.status = CANCELLED
+            self.finished = time.time()
+            return
+        self.started = time.time()
+        self.status = RUNNING
+        try:
+            self.result = fn(self)
+        except BuildCancelled:
+            self.status = CANCELLED
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            self.status = FAILED
+        else:
+            self.status = DONE
+        finally:
+            self.finished = time.time()
+
+
+class BuildExecutor:
+    """Pool de hilos para builds; submit() no bloquea la sesión que lo llama."""
+
+    def __init__(self, max_workers: int = 2):
+        self._pool = ThreadPoolExecutor(max_workers=max(1, int(max_workers)),
+                                        thread_name_prefix="printlooper-build")
+        self._ids = itertools.count(1)
+        self._running: Dict[str, BuildJob] = {}   # clave -> build en curso
+        self._lock = threading.Lock()
+
+    def submit(self, fn: Callable[[BuildJob], Any], total_bytes: int = 0,
+               key: Optional[str] = None) -> BuildJob:
+        """
+        Encola fn(job). Con `key`, si ya hay un build en curso con la misma
+        clave (pedido por otra sesión) no se encola otro: se devuelve ese job.
+        """
+        with self._lock:
+            job = self._running.get(key) if key is not None else None
+            if job is not None and not job.done and not job.cancel_requested:
+                job.join()
+                return job
+            job = BuildJob(next(self._ids), total_bytes)
+            if key is not None:
+                self._running[key] = job
+        self._pool.submit(self._run, job, fn, key)
+        return job
+
+    def _run(self, job: BuildJob, fn: Callable[[BuildJob], Any], key: Optional[str]) -> None:
+        try:
+            job._run(fn)
+        finally:
+            if key is not None:
+                with self._lock:
+                    if self._running.get(key) is job:
+                        del self._running[key]
+
+    def shutdown(self, cancel: bool = True) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=cancel)
+
+
+def sequence_bytes(items: Iterable[Dict], plan: SequencePlan, change_block: str) -> int:
+    """
+    Tamaño aproximado (en caracteres) del G-code que arma iter_sequence con
+    `plan`: sirve como total para BuildJob.progress sin recorrer la cola.
+    """
+    items = list(items)
+    counts = plan.repeats(len(items))
+    prints = sum(counts)
+    total = sum(len(it["core"]) * c for it, c in zip(items, counts))
+    total += max(0, prints - 1) * (len(change_block) + 2)
+    total += len(next((it["shutdown"] for it in items if it.get("shutdown")), ""))
+    return total
@@ -0,0 +1,164 @@
+# core/metrics.py
+"""
+Instrumentación liviana por etapa (read_3mf, split_core_and_shutdown,
+compose_sequence, zip_write...). Cada etapa queda como un dict:
+
+    {"stage": "zip_write", "wall_s": 1.8, "cpu_s": 1.7, "peak_bytes": None,
+     "bytes_in": 70_000_000, "bytes_out": 9_500_000}
+
+    metrics = Metrics(trace_memory=True)
+    with metrics.stage("read_3mf", bytes_in=len(data)) as s:
+        ...
+        s["bytes_out"] = len(raw)
+
+El CPU es el del hilo que corre la etapa (time.thread_time), así que builds en
+paralelo no se mezclan. La memoria pico (tracemalloc) es opcional: cuesta
+bastante y mide todo el proceso, no sólo la etapa. Por eso sólo se registra si
+la etapa corrió sola: si otra etapa con trace_memory (otro build) se solapa,
+las dos quedan sin pico ("-"). tracemalloc se prende con la primera etapa que
+lo pide y se apaga cuando termina la última.
+"""
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+_trace_lock = threading.Lock()
+_traced: Dict[int, bool] = {}   # id(etapa) -> se solapó con otra, de cualquier hilo
+_trace_owner = False            # tracemalloc lo prendió Metrics (y lo apaga la última etapa)
+
+
+def _trace_begin(record: Dict) -> None:
+    global _trace_owner
+    with _trace_lock:
+        if not _traced:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                _trace_owner = True
+            tracemalloc.reset_peak()
+        for key in _traced:
+            _traced[key] = True
+        _traced[id(record)] = bool(_traced)
+
+
+def _trace_end(record: Dict) -> Optional[int]:
+    """Pico de memoria de la etapa (None si se solapó con otra)."""
+    global _trace_owner
+    with _trace_lock:
+        shared = _traced.pop(id(record))
+        peak = None if shared else tracemalloc.get_traced_memory()[1]
+        if not _traced and _trace_owner:
+            tracemalloc.stop()
+            _trace_owner = False
+    return peak
+
+
+def new_stage(name: str, bytes_in: int = 0) -> Dict:
+    return {"stage": name, "wall_s": 0.0, "cpu_s": 0.0, "peak_bytes": None,
+            "bytes_in": int(bytes_in), "bytes_out": 0}
+
+
+def format_bytes(n: Optional[int]) -> str:
+    if n is None:
+        return "-"
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(n) < 1024 or unit == "GB":
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} GB"
+
+
+def compression_ratio(stage: Dict) -> Optional[float]:
+    """bytes_in / bytes_out (None si no hay salida)."""
+    return stage["bytes_in"] / stage["bytes_out"] if stage["bytes_out"] else None
+
+
+class Metrics:
+    """Lista de etapas medidas, en el orden en que terminaron."""
+
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        self.stages: List[Dict] = []
+
+    def __repr__(self) -> str:
+        return f"Metrics({[s['stage'] for s in self.stages]})"
+
+    @contextmanager
+    def stage(self, name: str, bytes_in: int = 0) -> Iterator[Dict]:
+        record = new_stage(name, bytes_in)
+        if self.trace_memory:
+            _trace_begin(record)
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield record
+        finally:
+            record["wall_s"] += time.perf_counter() - wall
+            record["cpu_s"] += time.thread_time() - cpu
+            if self.trace_memory:
+                record["peak_bytes"] = _trace_end(record)
+            self.stages.append(record)
+
+    def add(self, record: Dict) -> None:
+        self.stages.append(record)
+
+    def extend(self, stages: Iterable[Dict], prefix: str = "") -> None:
+        """Agrega etapas medidas en otro lado (p.ej. las de read_3mf guardadas en el meta)."""
+        for s in stages:
+            self.stages.append({**s, "stage": prefix + s["stage"]})
+
+    @property
+    def total_wall(self) -> float:
+        return sum(s["wall_s"] for s in self.stages)
+
+    def rows(self) -> List[Dict]:
+        """Filas para una tabla (st.dataframe)."""
+        rows = []
+        for s in self.stages:
+            ratio = compression_ratio(s)
+            rows.append({
+                "Etapa": s["stage"],
+                "Tiempo (s)": round(s["wall_s"], 3),
+                "CPU (s)": round(s["cpu_s"], 3),
+                "Memoria pico": format_bytes(s["peak_bytes"]),
+                "Entrada": format_bytes(s["bytes_in"]),
+                "Salida": format_bytes(s["bytes_out"]),
+                "Ratio": f"{ratio:.2f}x" if ratio else "-",
+            })
+        return rows
+
+    def report_lines(self) -> List[str]:
+        """Líneas para Metadata/queue_report.txt (sólo builds no reproducibles: tienen tiempos)."""
+        lines = []
+        for s in self.stages:
+            line = (f"- Etapa {s['stage']}: {s['wall_s']:.3f} s (CPU {s['cpu_s']:.3f} s), "
+                    f"entrada {format_bytes(s['bytes_in'])}, salida {format_bytes(s['bytes_out'])}")
+            ratio = compression_ratio(s)
+            if ratio:
+                line += f", ratio {ratio:.2f}x"
+            if s["peak_bytes"] is not None:
+                line += f", memoria pico {format_bytes(s['peak_bytes'])}"
+            lines.append(line)
+        return lines
+
+
+def timed_iter(items: Iterable[T], record: Dict, sizeof=None) -> Iterator[T]:
+    """
+    Pasa los elementos de un iterable perezoso sumando en `record` el tiempo que
+    tarda en producirlos (no el del consumidor) y, con sizeof, sus bytes.
+    """
+    it = iter(items)
+    while True:
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            item = next(it)
+        except StopIteration:
+            return
+        finally:
+            record["wall_s"] += time.perf_counter() - wall
+            record["cpu_s"] += time.thread_time() - cpu
+        if sizeof is not None:
+            record["bytes_out"] += sizeof(item)
+        yield item
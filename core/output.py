@@ -0,0 +1,114 @@
+# core/output.py
+"""
+Salidas en disco para colas grandes: build_final_3mf(..., out=fp) escribe el
+.3mf directo a un archivo, así que ni el ZIP completo ni una copia para la
+descarga quedan en memoria.
+
+    output = build_to_file(lambda fp: build_final_3mf(files, plate, segments, out=fp))
+    st.download_button(..., data=output.open)    # se lee del disco al descargar
+
+El archivo se borra con output.cleanup() o solo, cuando ya nadie referencia el
+OutputFile (p.ej. al terminar la sesión que lo guardaba en session_state, o al
+salir del proceso).
+"""
+import mmap
+import os
+import tempfile
+import weakref
+from typing import Any, BinaryIO, Callable, Iterator, Optional
+
+# Hasta este tamaño un SpooledTemporaryFile se queda en memoria; después pasa a disco
+SPOOL_MAX_BYTES = 64 << 20
+
+READ_CHUNK = 1 << 20
+
+
+def spooled_output(max_size: int = SPOOL_MAX_BYTES, dir: Optional[str] = None) -> BinaryIO:
+    """Archivo temporal en memoria que se vuelca a disco al pasar max_size."""
+    return tempfile.SpooledTemporaryFile(max_size=max_size, mode="w+b", dir=dir)
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class OutputFile:
+    """
+    Archivo temporal con nombre (en `dir` o en el temp del sistema) que se borra
+    solo cuando el objeto se libera. No se puede picklear: el archivo pertenece
+    a este proceso.
+    """
+
+    def __init__(self, dir: Optional[str] = None, suffix: str = ".3mf"):
+        if dir:
+            os.makedirs(dir, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(prefix="printlooper_", suffix=suffix, dir=dir)
+        self._fp: Optional[BinaryIO] = os.fdopen(fd, "w+b")
+        self._finalizer = weakref.finalize(self, _remove, self.path)
+
+    def __repr__(self) -> str:
+        return f"OutputFile({self.path!r})"
+
+    def __reduce__(self):
+        raise TypeError("OutputFile no se puede serializar (es un archivo temporal local).")
+
+    @property
+    def writer(self) -> BinaryIO:
+        """Archivo abierto para escribir (hasta finish())."""
+        if self._fp is None:
+            raise ValueError("El archivo de salida ya está cerrado.")
+        return self._fp
+
+    def finish(self) -> None:
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+    @property
+    def size(self) -> int:
+        return os.path.getsize(self.path)
+
+    @property
+    def alive(self) -> bool:
+        return self._finalizer.alive
+
+    def open(self) -> BinaryIO:
+        """Abre el archivo terminado para lectura."""
+        return open(self.path, "rb")
+
+    def iter_chunks(self, size: int = READ_CHUNK) -> Iterator[bytes]:
+        """Lee el archivo por bloques (para servirlo o subirlo sin cargarlo entero)."""
+        with self.open() as fp:
+            while True:
+                block = fp.read(size)
+                if not block:
+                    return
+                yield block
+
+    def mmap(self) -> mmap.mmap:
+        """Vista de sólo lectura del archivo terminado (el SO pagina bajo demanda)."""
+        with self.open() as fp:
+            return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def cleanup(self) -> None:
+        self.finish()
+        self._finalizer()
+
+
+def build_to_file(build: Callable[[BinaryIO], Any], dir: Optional[str] = None,
+                  suffix: str = ".3mf") -> OutputFile:
+    """
+    Crea un OutputFile, llama build(fp) para llenarlo y lo cierra. Si build
+    falla, el archivo se borra antes de propagar el error.
+    """
+    output = OutputFile(dir, suffix)
+    try:
+        build(output.writer)
+        output.finish()
+    except BaseException:
+        output.cleanup()
+        raise
+    return output
@@ -0,0 +1,254 @@
+# core/pipeline.py
+"""
+Pipeline de transformaciones de G-code en streaming (la reducción de
+minify_gcode).
+
+El texto circula como bloques de líneas completas (str de ~1 MB que terminan en
+"\n", salvo el último). Cada etapa es una función bloques -> bloques, en general
+un generador, así que encadenar etapas no crea copias del G-code completo:
+
+    pipe = Pipeline(strip_comments(keep_header=True), minify_moves())
+    text = pipe.run_text(core)          # o "".join(pipe(bloques))
+
+Pipeline acepta bloques cortados en cualquier lugar (un marcador o un "\r\n"
+partido entre dos bloques): antes de la primera etapa los vuelve a juntar en
+líneas completas, así que el resultado no depende de dónde caen los cortes.
+Las etapas trabajan sobre cada bloque con regex (en C), no línea por línea en
+Python.
+"""
+import re
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+CHUNK_SIZE = 1 << 20
+
+Stage = Callable[[Iterable[str]], Iterator[str]]
+
+# Comentarios que no se pueden quitar: marcadores de secciones que usan el
+# firmware, el slicer y este mismo paquete (SECTION_RE / END_OF_PRINT_RE).
+KEEP_COMMENT_RE = (
+    r"Starting\s+to\s+change\s+plates|Finish\s+to\s+change\s+plates|END_OF_PRINT"
+    r"|_BLOCK_(?:START|END)"
+)
+
+# Los patrones empiezan con un literal (';' / '\n') para que el motor de regex
+# salte directo a los candidatos en vez de probar en cada carácter.
+_COMMENT_RE = re.compile(rf";(?![^\n]*(?:{KEEP_COMMENT_RE}))[^\n\r]*", re.IGNORECASE)
+_BLANK_LINE_RE = re.compile(r"\n[ \t\r]*(?=\n)")
+
+
+def chunk_text(text: str, size: int = CHUNK_SIZE) -> Iterator[str]:
+    """Parte un texto en bloques de líneas completas de ~size caracteres."""
+    pos, n = 0, len(text)
+    while pos < n:
+        end = text.find("\n", min(pos + size, n) - 1)
+        end = n if end < 0 else end + 1
+        yield text[pos:end]
+        pos = end
+
+
+def whole_lines(chunks: Iterable[str]) -> Iterator[str]:
+    """Vuelve a cortar bloques arbitrarios en bloques de líneas completas."""
+    carry: List[str] = []  # pedazos de la línea que todavía no terminó
+    for chunk in chunks:
+        cut = chunk.rfind("\n") + 1
+        if not cut:
+            carry.append(chunk)
+            continue
+        carry.append(chunk[:cut])
+        yield "".join(carry)
+        carry = [chunk[cut:]] if cut < len(chunk) else []
+    if carry:
+        yield "".join(carry)
+
+
+class Pipeline:
+    """Cadena de etapas; se aplica a un iterable de bloques en una sola pasada."""
+
+    def __init__(self, *stages: Stage):
+        self.stages: List[Stage] = list(stages)
+
+    def then(self, stage: Stage) -> "Pipeline":
+        return Pipeline(*self.stages, stage)
+
+    def __call__(self, chunks: Iterable[str]) -> Iterator[str]:
+        chunks = whole_lines(chunks)
+        for stage in self.stages:
+            chunks = stage(chunks)
+        return iter(chunks)
+
+    def run_text(self, text: str) -> str:
+        """Aplica la cadena a un texto en memoria (p.ej. un core antes de repetirlo)."""
+        return "".join(self(chunk_text(text)))
+
+
+# --- etapas -----------------------------------------------------------------------
+
+def _strip_comments_text(text: str) -> str:
+    out = []
+    pos = 0
+    for m in _COMMENT_RE.finditer(text):
+        start, end = m.start(), m.end()
+        ls = text.rfind("\n", 0, start) + 1
+        code_end = ls + len(text[ls:start].rstrip(" \t"))
+        if code_end == ls:
+            # comentario de línea completa: se va la línea entera
+            out.append(text[pos:ls])
+            pos = end + 2 if text.startswith("\r\n", end) else end + 1 if text.startswith("\n", end) else end
+        else:
+            out.append(text[pos:code_end])
+            pos = end
+    out.append(text[pos:])
+    return "".join(out)
+
+
+def strip_comments(drop_blank_lines: bool = True, keep_header: bool = False) -> Stage:
+    """
+    Quita comentarios (líneas completas y al final de línea), salvo los que
+    contienen marcadores (KEEP_COMMENT_RE). Con drop_blank_lines también quita
+    las líneas vacías. Con keep_header el bloque HEADER_BLOCK_START ..
+    HEADER_BLOCK_END (tiempo estimado, capas: lo lee la impresora) pasa entero.
+    """
+    def clean(text: str) -> str:
+        text = _strip_comments_text(text)
+        if drop_blank_lines:
+            # el "\n" inicial deja que el patrón vea también la primera línea
+            text = _BLANK_LINE_RE.sub("", "\n" + text)[1:]
+        return text
+
+    def stage(chunks: Iterable[str]) -> Iterator[str]:
+        in_header = None if keep_header else False  # None: todavía no se vio el header
+        for chunk in chunks:
+            head = ""
+            if in_header is not False:
+                start = chunk.find("HEADER_BLOCK_START") if in_header is None else 0
+                if start >= 0:
+                    end = chunk.find("HEADER_BLOCK_END", start)
+                    stop = len(chunk) if end < 0 else chunk.find("\n", end) + 1 or len(chunk)
+                    start = chunk.rfind("\n", 0, start) + 1
+                    head = clean(chunk[:start]) + chunk[start:stop]
+                    chunk = chunk[stop:]
+                    in_header = end < 0
+            chunk = head + clean(chunk)
+            if chunk:
+                yield chunk
+    return stage
+
+
+def minify_moves(report: Optional[Dict] = None) -> Stage:
+    """
+    Quita palabras modales redundantes sin cambiar lo que hace la impresora:
+      - F igual al avance vigente;
+      - X/Y/Z de un G0/G1 iguales a la posición actual (en G90; en G91 no se tocan);
+      - ceros que sobran en los números (10.500 -> 10.5, 0.5 -> .5; no redondea).
+    Un G0/G1 que queda sin palabras se quita. La posición se sigue con G90/G91,
+    G92, G28 y arcos G2/G3 (que no se reescriben). Ante cualquier comando que
+    pueda mover el cabezal por su cuenta (G380, G29, macros M de Bambu como
+    M620 o los saltos de objeto M624/M625...) la posición y el avance pasan a
+    desconocidos, así que la primera palabra siguiente nunca se quita. E nunca
+    se quita. Con `report` suma ahí las palabras y líneas quitadas.
+    """
+    def stage(chunks: Iterable[str]) -> Iterator[str]:
+        state = {"abs": True, "pos": dict.fromkeys("XYZ"), "feed": {"G0": None, "G1": None}}
+        for chunk in chunks:
+            yield _minify_text(chunk, state, report)
+    return stage
+
+
+# Comandos que no mueven el cabezal ni tocan el avance
+_SAFE_CODES = frozenset((
+    "G4", "G21", "M73", "M82", "M83", "M104", "M105", "M106", "M107", "M109", "M140", "M190",
+    "M204", "M205", "M400", "M981", "M991", "M1002", "M220", "M221",
+))
+_OTHER_MOVE = {"G0": "G1", "G1": "G0"}
+_MOVE_PREFIXES = frozenset(("G0 ", "G1 "))
+
+
+def _minify_text(text: str, state: Dict, report: Optional[Dict]) -> str:
+    pos = state["pos"]
+    feed = state["feed"]
+    absolute = state["abs"]
+    words_dropped = lines_dropped = 0
+    out = []
+    append = out.append
+    for line in text.split("\n"):
+        if line[:3] not in _MOVE_PREFIXES:
+            # líneas que no son movimientos: sólo actualizan el estado
+            code = line.split(";", 1)[0].split()
+            if code:
+                c = code[0].upper()
+                if c == "G90":
+                    absolute = True
+                elif c == "G91":
+                    absolute = False
+                elif c in ("G92", "G28", "G2", "G3"):
+                    # redefinen la posición o terminan donde diga el arco: los ejes
+                    # nombrados (o todos, si no nombra ninguno) pasan a desconocidos
+                    named = [w[0].upper() for w in code[1:]]
+                    for a in [a for a in named if a in pos] or (pos if c in ("G92", "G28") else ()):
+                        pos[a] = None
+                    if "F" in named or c == "G28":
+                        # G28 mueve el cabezal a su manera: tampoco se sabe el avance
+                        feed["G0"] = feed["G1"] = None
+                elif c not in _SAFE_CODES:
+                    pos.update(X=None, Y=None, Z=None)
+                    feed["G0"] = feed["G1"] = None
+            append(line)
+            continue
+        cr = ""
+        if line[-1:] == "\r":  # CRLF: el "\r" no es parte de la última palabra
+            line, cr = line[:-1], "\r"
+        if ";" in line:
+            code, _, comment = line.partition(";")
+        else:
+            code, comment = line, None
+        words = code.split()
+        c = words[0]
+        kept = [c]
+        for w in words[1:]:
+            a, v = w[0], w[1:]
+            if a not in "XYZFE":
+                if a in "xyzfe":
+                    # en minúscula: no se sigue, mejor olvidar el estado
+                    pos.update(X=None, Y=None, Z=None)
+                    feed["G0"] = feed["G1"] = None
+                kept.append(w)
+                continue
+            # forma canónica (mismo valor, sin ceros de más): "10.500" -> "10.5",
+            # "0.50" -> ".5", "3.0" -> "3"; así se compara como texto, sin float()
+            if v[-1:] == "0" and "." in v:
+                v = v.rstrip("0").rstrip(".") or "0"
+            if v[:2] == "0." or v[:3] == "-0.":
+                v = v.replace("0.", ".", 1)
+            if v == "-" or v == "-0":
+                v = "0"
+            if a == "F":
+                if v == feed[c]:
+                    words_dropped += 1
+                    continue
+                feed[c], feed[_OTHER_MOVE[c]] = v, None
+            elif a != "E":
+                if not absolute:
+                    pos[a] = None
+                elif v == pos[a]:
+                    words_dropped += 1
+                    continue
+                else:
+                    pos[a] = v
+            kept.append(a + v)
+        if len(kept) == 1 and comment is None:
+            lines_dropped += 1
+            continue
+        append((" ".join(kept) if comment is None else " ".join(kept) + " ;" + comment) + cr)
+    state["abs"] = absolute
+    if report is not None:
+        report["words"] = report.get("words", 0) + words_dropped
+        report["lines"] = report.get("lines", 0) + lines_dropped
+    return "\n".join(out)
+
+
+def minify_gcode(text: str, report: Optional[Dict] = None) -> str:
+    """
+    Etapa de reducción para un core antes de repetirlo: comentarios (salvo
+    marcadores y el header), líneas vacías y palabras modales redundantes.
+    """
+    return Pipeline(strip_comments(keep_header=True), minify_moves(report)).run_text(text)
@@ -1,100 +1,521 @@
 # core/queue_builder.py
 import io
+import os
 import re
-import zipfile
+import json
+import mmap
 import hashlib
+import time
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from datetime import datetime
-from typing import Dict, List, Tuple
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple, Union
 
 # Reutilizamos la misma lógica de partición que en gcode_loop
 # (si cambiaste la firma, mantené estas importaciones)
-from .gcode_loop import split_core_and_shutdown
+from .gcode_loop import find_shutdown_offset, md5_bytes
+from .archive import DeflatedSegment, Lazy3MF, ZipWriter, deflate_segment
+from .cache import LRUCache
+from .metrics import Metrics, format_bytes, new_stage, timed_iter
+from .pipeline import minify_gcode
+from .sequence import SequencePlan
 
 PLATE_NUM_RE = re.compile(r"/plate_(\d+)\.gcode$", re.IGNORECASE)
 
+# Fecha fija para las entradas nuevas del ZIP en modo reproducible (mínimo DOS)
+REPRODUCIBLE_DATE_TIME = (1980, 1, 1, 0, 0, 0)
 
-def read_3mf(info_bytes: bytes) -> Dict:
+
+def read_3mf(info_bytes: bytes, digest: Optional[str] = None,
+             metrics: Optional[Metrics] = None, plate: Union[int, str, None] = None) -> Dict:
     """
     Lee un .3mf en memoria y devuelve:
-      - files: dict nombre->bytes (todo el ZIP)
-      - plate_name: nombre del G-code principal (Metadata/plate_*.gcode)
+      - digest: MD5 hex del .3mf (identifica el contenido; se puede pasar si ya
+        se calculó)
+      - files: Lazy3MF nombre->bytes (todo el ZIP; sólo se lee el índice y cada
+        miembro se descomprime al accederlo)
+      - plates: índice de plates del .3mf (ver plate_index); sale del directorio
+        del ZIP, sin inflar ningún G-code. Lo comparten los dicts de read_plate
+        del mismo .3mf: cada plate parseado deja ahí su corte
+      - plate_name: nombre del G-code parseado (Metadata/plate_*.gcode)
       - core: bloque repetible (G-code sin el apagado final)
       - shutdown: bloque final de apagado
-    Selecciona como plate por defecto Metadata/plate_1.gcode si existe,
-    de lo contrario el primer .gcode encontrado.
+      - gcode_size / shutdown_offset: tamaño en bytes del G-code del plate y
+        offset (en bytes) donde empieza el apagado
+      - stages: tiempos de las etapas read_3mf y split_core_and_shutdown (ver
+        core.metrics); también se agregan a `metrics` si se pasa
+    `plate` elige el plate (número o nombre del miembro). Por defecto,
+    Metadata/plate_1.gcode si existe, de lo contrario el primer .gcode
+    encontrado. Los demás plates se parsean recién cuando se piden (read_plate).
+    """
+    local = Metrics(metrics.trace_memory if metrics is not None else False)
+    with local.stage("read_3mf", bytes_in=len(info_bytes)) as stage:
+        files = Lazy3MF(info_bytes)
+        plate_name = _resolve_plate(files, plate)
+        raw = files[plate_name] if plate_name else b""
+        digest = digest or md5_bytes(info_bytes)
+        stage["bytes_out"] = len(raw)
+    with local.stage("split_core_and_shutdown", bytes_in=len(raw)) as stage:
+        meta = _plate_meta(files, plate_name, raw, find_shutdown_offset(raw), digest)
+        stage["bytes_out"] = len(raw)
+    meta["stages"] = local.stages
+    if metrics is not None:
+        metrics.extend(local.stages)
+    return meta
+
+
+def read_plate(meta: Dict, plate: Union[int, str, None], metrics: Optional[Metrics] = None) -> Dict:
+    """
+    Parsea otro plate del mismo .3mf (meta de read_3mf) sin volver a leer el
+    ZIP: sólo se infla el G-code de ese plate. Devuelve un dict como el de
+    read_3mf, para ese plate (None: el plate por defecto).
     """
-    with zipfile.ZipFile(io.BytesIO(info_bytes), "r", allowZip64=True) as z:
-        files: Dict[str, bytes] = {i.filename: z.read(i.filename) for i in z.infolist()}
+    files = meta["files"]
+    plate_name = _resolve_plate(files, plate)
+    if plate_name == meta["plate_name"]:
+        return meta
+    local = Metrics(metrics.trace_memory if metrics is not None else False)
+    with local.stage("read_3mf", bytes_in=files.getinfo(plate_name).compress_size) as stage:
+        raw = files[plate_name]
+        stage["bytes_out"] = len(raw)
+    entry = _index_entry(meta["plates"], plate_name)
+    with local.stage("split_core_and_shutdown", bytes_in=len(raw)) as stage:
+        # un plate ya parseado (p.ej. antes de que la caché lo descartara) no se vuelve a recorrer
+        cut = entry.get("shutdown_offset")
+        if cut is None:
+            cut = find_shutdown_offset(raw)
+        plate_meta = _plate_meta(files, plate_name, raw, cut, meta["digest"], meta["plates"])
+        stage["bytes_out"] = len(raw)
+    plate_meta["stages"] = local.stages
+    if metrics is not None:
+        metrics.extend(local.stages)
+    return plate_meta
+
+
+def plate_index(files: Lazy3MF) -> List[Dict]:
+    """
+    Plates del .3mf, ordenados por número, a partir del directorio del ZIP:
+    [{"plate": 2, "name": "Metadata/plate_2.gcode", "preview": "Metadata/plate_2.png" | None,
+      "size": bytes del G-code, "compress_size": bytes comprimidos,
+      "core_offset": 0, "shutdown_offset": None}, ...]
+    Un .gcode que no sigue el nombre plate_N queda con "plate": None, al final.
+    El core va de core_offset a shutdown_offset y el apagado de ahí al final
+    (offsets en bytes del G-code inflado); shutdown_offset es None hasta que
+    el plate se parsea (read_3mf / read_plate lo completan).
+    """
+    names = set(files)
+    plates = []
+    for name in files:
+        if not name.lower().endswith(".gcode"):
+            continue
+        m = PLATE_NUM_RE.search(name)
+        num = int(m.group(1)) if m else None
+        preview = None
+        if num is not None:
+            preview = next((p for p in (f"Metadata/plate_{num}.png", f"Metadata/plate_{num}_small.png")
+                            if p in names), None)
+        info = files.getinfo(name)
+        plates.append({"plate": num, "name": name, "preview": preview,
+                       "size": info.file_size, "compress_size": info.compress_size,
+                       "core_offset": 0, "shutdown_offset": None})
+    plates.sort(key=lambda p: (p["plate"] is None, p["plate"] or 0, p["name"]))
+    return plates
+
 
+def _pick_plate(files: Mapping[str, bytes]) -> Optional[str]:
     gcodes = [n for n in files if n.lower().endswith(".gcode")]
-    plate_name = None
     # Preferir plate_1.gcode si existe
     for n in gcodes:
         if "/plate_1.gcode" in n.lower():
-            plate_name = n
-            break
-    if plate_name is None and gcodes:
-        plate_name = gcodes[0]
+            return n
+    return gcodes[0] if gcodes else None
 
-    gcode_text = files[plate_name].decode("utf-8", errors="ignore") if plate_name else ""
-    core, shutdown = split_core_and_shutdown(gcode_text)
 
+def _resolve_plate(files: Mapping[str, bytes], plate: Union[int, str, None]) -> Optional[str]:
+    if plate is None:
+        return _pick_plate(files)
+    if isinstance(plate, str):
+        if plate not in files:
+            raise ValueError(f"El .3mf no tiene el G-code {plate}.")
+        return plate
+    for name in files:
+        m = PLATE_NUM_RE.search(name)
+        if m and int(m.group(1)) == int(plate):
+            return name
+    raise ValueError(f"El .3mf no tiene el plate {plate}.")
+
+
+def _index_entry(plates: List[Dict], plate_name: Optional[str]) -> Dict:
+    """Entrada de plate_index para ese G-code ({} si no está, p.ej. sin plates)."""
+    return next((p for p in plates if p["name"] == plate_name), {})
+
+
+def _plate_meta(files: Lazy3MF, plate_name: Optional[str], raw, cut: int, digest: str,
+                plates: Optional[List[Dict]] = None) -> Dict:
+    # Se corta sobre los bytes (buscando desde el final) y se decodifica cada
+    # parte sin copias intermedias; el corte cae siempre en un inicio de línea.
+    # Las vistas se liberan al salir de los with, aunque falle el decode: raw
+    # puede ser un mmap que el que llama cierra enseguida (ver read_3mf_many).
+    with memoryview(raw) as view:
+        with view[:cut] as part:
+            core = str(part, "utf-8", "ignore")
+        with view[cut:] as part:
+            shutdown = str(part, "utf-8", "ignore")
+        size = len(view)
+    plates = plate_index(files) if plates is None else plates
+    _index_entry(plates, plate_name)["shutdown_offset"] = cut
     return {
+        "digest": digest,
         "files": files,
+        "plates": plates,
         "plate_name": plate_name,
         "core": core,
         "shutdown": shutdown,
+        "gcode_size": size,
+        "shutdown_offset": cut,
     }
 
 
+def _ingest_worker(src_path: str, gcode_path: str) -> Dict:
+    """
+    Parte pesada de read_3mf para read_3mf_many, en un proceso aparte: infla el
+    G-code del plate, busca el corte y calcula el digest. El G-code inflado se
+    deja en gcode_path (el padre lo mapea); al padre sólo vuelven offsets.
+    """
+    metrics = Metrics()
+    with metrics.stage("read_3mf", bytes_in=os.path.getsize(src_path)) as stage:
+        files = Lazy3MF(src_path)
+        plate_name = _pick_plate(files)
+        raw = files[plate_name] if plate_name else b""
+        with open(gcode_path, "wb") as f:
+            f.write(raw)
+        with open(src_path, "rb") as f:
+            digest = hashlib.file_digest(f, "md5").hexdigest()
+        stage["bytes_out"] = len(raw)
+    with metrics.stage("split_core_and_shutdown", bytes_in=len(raw)) as stage:
+        cut = find_shutdown_offset(raw)
+        stage["bytes_out"] = len(raw)
+    return {"plate_name": plate_name, "shutdown_offset": cut, "digest": digest,
+            "stages": metrics.stages}
+
+
+def read_3mf_many(sources: List[Union[bytes, str, os.PathLike]],
+                  max_workers: Optional[int] = None) -> List[Dict]:
+    """
+    Parsea varios .3mf en paralelo (un proceso por núcleo) y devuelve, en el
+    mismo orden, un dict por archivo: {"meta": <lo de read_3mf> | None,
+    "error": None | "mensaje"}. Un archivo roto no frena al resto.
+    Los datos viajan por archivos temporales (los bytes subidos se escriben una
+    vez y los workers abren la ruta; el G-code inflado vuelve igual), así que
+    no se serializan blobs grandes entre procesos.
+    """
+    results: List[Dict] = [{"meta": None, "error": None} for _ in sources]
+    if not sources:
+        return results
+    workers = min(len(sources), max_workers or os.cpu_count() or 1)
+    with tempfile.TemporaryDirectory(prefix="printlooper-") as tmp:
+        jobs = []
+        for i, src in enumerate(sources):
+            if isinstance(src, (bytes, bytearray, memoryview)):
+                path = os.path.join(tmp, f"{i}.3mf")
+                with open(path, "wb") as f:
+                    f.write(src)
+            else:
+                path = os.fspath(src)
+            jobs.append((path, os.path.join(tmp, f"{i}.gcode")))
+
+        # spawn: el proceso padre (p.ej. Streamlit) tiene hilos, y fork con hilos no es seguro
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = [pool.submit(_ingest_worker, path, gpath) for path, gpath in jobs]
+            for i, (src, fut, (_, gpath)) in enumerate(zip(sources, futures, jobs)):
+                try:
+                    info = fut.result()
+                    files = Lazy3MF(src)
+                    with open(gpath, "rb") as f:
+                        size = os.fstat(f.fileno()).st_size
+                        raw = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+                        try:
+                            # decodificar el core/apagado cuenta como parte del corte
+                            read_stage, split_stage = info["stages"]
+                            wall, cpu = time.perf_counter(), time.thread_time()
+                            meta = _plate_meta(files, info["plate_name"], raw,
+                                               info["shutdown_offset"], info["digest"])
+                            split_stage["wall_s"] += time.perf_counter() - wall
+                            split_stage["cpu_s"] += time.thread_time() - cpu
+                            meta["stages"] = [read_stage, split_stage]
+                            results[i]["meta"] = meta
+                        finally:
+                            if size:
+                                raw.close()
+                except Exception as e:
+                    results[i]["error"] = f"{type(e).__name__}: {e}"
+    return results
+
+
+def parsed_size(meta: Dict) -> int:
+    """Memoria aproximada que ocupa un resultado de read_3mf (ZIP + core + apagado)."""
+    return meta["files"].size + len(meta["core"]) + len(meta["shutdown"])
+
+
+def core_id(meta: Dict) -> str:
+    """
+    Identidad del G-code en meta["core"] para claves de caché: digest del .3mf
+    + plate, o meta["core_digest"] si el core se reemplazó (p.ej. por el de
+    minify_plate). El largo va como resguardo barato contra un core cambiado
+    sin actualizar core_digest.
+    """
+    base = meta.get("core_digest") or f"{meta['digest']}:{meta['plate_name']}"
+    return f"{base}:{len(meta['core'])}"
+
+
+def read_3mf_cached(info_bytes: bytes, cache: Optional[LRUCache]) -> Dict:
+    """
+    read_3mf con caché por contenido (MD5 de los bytes subidos): un mismo .3mf
+    se parsea una sola vez aunque Streamlit re-ejecute el script en cada
+    interacción. El resultado es compartido: no modificarlo.
+    """
+    if cache is None:
+        return read_3mf(info_bytes)
+    digest = md5_bytes(info_bytes)
+    return cache.get_or_compute(digest, lambda: read_3mf(info_bytes, digest), parsed_size)
+
+
+def read_plate_cached(meta: Dict, plate: Union[int, str], cache: Optional[LRUCache]) -> Dict:
+    """
+    read_plate con caché (clave: digest del .3mf + nombre del plate). Cada plate
+    se parsea la primera vez que se elige; en la caché sólo queda lo propio del
+    plate (core, apagado, offsets), no el ZIP.
+    """
+    if cache is None:
+        return read_plate(meta, plate)
+    plate_name = _resolve_plate(meta["files"], plate)
+    if plate_name == meta["plate_name"]:
+        return meta
+    key = md5_bytes(f"{meta['digest']}:{plate_name}".encode("utf-8"))
+    # se guarda sin el ZIP ni el índice (ya están en la entrada del .3mf) y se vuelven a enganchar
+    parsed = cache.get_or_compute(
+        key, lambda: {k: v for k, v in read_plate(meta, plate_name).items() if k not in ("files", "plates")},
+        lambda m: len(m["core"]) + len(m["shutdown"]))
+    _index_entry(meta["plates"], plate_name)["shutdown_offset"] = parsed["shutdown_offset"]
+    return {**parsed, "files": meta["files"], "plates": meta["plates"]}
+
+
+def utf8_size(text: str) -> int:
+    """Bytes de `text` en UTF-8 (lo que ocupa en el .3mf), no caracteres."""
+    return len(text) if text.isascii() else len(text.encode("utf-8"))
+
+
+def minify_plate(meta: Dict, metrics: Optional[Metrics] = None) -> Dict:
+    """
+    Core de un plate pasado por minify_gcode, una vez antes de repetirlo.
+    Devuelve {"core", "core_digest", "bytes_in", "bytes_out", "words", "lines",
+    "stage"}; quien reemplace meta["core"] por este core tiene que copiar
+    también core_digest (ver core_id). La etapa "minify" también va a
+    `metrics` si se pasa.
+    """
+    report: Dict = {}
+    bytes_in = utf8_size(meta["core"])
+    with Metrics().stage("minify", bytes_in) as stage:
+        core = minify_gcode(meta["core"], report)
+        stage["bytes_out"] = utf8_size(core)
+    if metrics is not None:
+        metrics.add(stage)
+    return {"core": core, "core_digest": f"minify:{core_id(meta)}",
+            "bytes_in": bytes_in, "bytes_out": stage["bytes_out"],
+            "words": report.get("words", 0), "lines": report.get("lines", 0), "stage": stage}
+
+
+def minify_plate_cached(meta: Dict, cache: Optional[LRUCache]) -> Dict:
+    """minify_plate con caché (clave: core_id del plate)."""
+    if cache is None:
+        return minify_plate(meta)
+    key = md5_bytes(f"minify:{core_id(meta)}".encode("utf-8"))
+    return cache.get_or_compute(key, lambda: minify_plate(meta), lambda m: len(m["core"]))
+
+
+def minify_report_line(minified: Sequence[Dict], repeats: Sequence[int]) -> str:
+    """
+    Línea del reporte con lo que ahorró la reducción en toda la cola (un
+    resultado de minify_plate por item, con sus repeticiones).
+    """
+    before = sum(m["bytes_in"] * r for m, r in zip(minified, repeats))
+    after = sum(m["bytes_out"] * r for m, r in zip(minified, repeats))
+    pct = 100.0 * (before - after) / before if before else 0.0
+    unique = list({id(m): m for m in minified}.values())  # un plate repetido en la lista cuenta una vez
+    return (f"- G-code reducido: {format_bytes(before)} -> {format_bytes(after)} ({pct:.1f} % menos; "
+            f"se quitaron {sum(m['words'] for m in unique)} palabras y {sum(m['lines'] for m in unique)} "
+            f"líneas redundantes de los plates)")
+
+
+def read_3mf_many_cached(sources: List[bytes], cache: Optional[LRUCache],
+                         max_workers: Optional[int] = None) -> List[Dict]:
+    """
+    read_3mf_many pasando por la caché: sólo los .3mf que no están en caché se
+    parsean (en paralelo). Devuelve lo mismo que read_3mf_many.
+    """
+    if cache is None:
+        return read_3mf_many(sources, max_workers)
+    digests = [md5_bytes(b) for b in sources]
+    results: List[Dict] = [{"meta": cache.get(d), "error": None} for d in digests]
+    missing = [i for i, r in enumerate(results) if r["meta"] is None]
+    if len(missing) == 1:
+        # un solo archivo: no vale la pena levantar procesos
+        i = missing[0]
+        try:
+            results[i]["meta"] = read_3mf_cached(sources[i], cache)
+        except Exception as e:
+            results[i]["error"] = f"{type(e).__name__}: {e}"
+    elif missing:
+        parsed = read_3mf_many([sources[i] for i in missing], max_workers)
+        for i, res in zip(missing, parsed):
+            results[i] = res
+            if res["meta"] is not None:
+                cache.put(digests[i], res["meta"], parsed_size(res["meta"]))
+    return results
+
+
+def queue_cache_key(
+    items: List[Dict],             # [{digest, plate_name, repeats}, ...]
+    change_block: str,
+    mode: str,
+    base: Dict,                    # {digest, plate_name} del 3MF esqueleto
+    **options
+) -> str:
+    """
+    Clave de caché de una cola ya construida: hash de los .3mf de entrada (su
+    digest, no el texto) más todos los parámetros que cambian la salida.
+    Sólo tiene sentido con build_final_3mf(..., reproducible=True).
+    """
+    spec = {
+        "items": [[it["digest"], it["plate_name"], int(it["repeats"])] for it in items],
+        "change_block": change_block,
+        "mode": mode,
+        "base": [base["digest"], base["plate_name"]],
+        "options": options,
+    }
+    return md5_bytes(json.dumps(spec, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+
+
+def iter_sequence(
+    items: List[Dict],             # [{name, core, shutdown, repeats}, ...]
+    change_block: str,
+    mode: str,                     # "serial" | "interleaved" | "optimized"
+    plan: Optional[SequencePlan] = None
+) -> Iterator[str]:
+    """
+    Versión en streaming de compose_sequence: emite los segmentos del G-code
+    compuesto (core, bloque de cambio, apagado) uno por uno, sin concatenarlos.
+    Los segmentos repetidos son el mismo objeto str, así que el consumidor
+    puede codificarlos una sola vez.
+    El orden sale de `plan` (por defecto SequencePlan.for_mode con las
+    repeticiones de cada item), el mismo que muestra la vista previa. En modo
+    'optimized' sin plan, el orden se calcula acá (estimando cada core).
+    """
+    if plan is None and mode == "optimized":
+        from .scheduler import optimize_sequence
+        plan = optimize_sequence(items, change_block)["plan"]
+    if plan is None:
+        plan = SequencePlan.for_mode([int(it["repeats"]) for it in items], mode)
+    separator = "\n" + change_block + "\n"
+    first = True
+    for model in plan:
+        if not first:
+            yield separator
+        yield items[model]["core"]
+        first = False
+
+    yield next((it["shutdown"] for it in items if it.get("shutdown")), "")
+
+
 def compose_sequence(
     items: List[Dict],             # [{name, core, shutdown, repeats}, ...]
     change_block: str,
-    mode: str                      # "serial" | "interleaved"
+    mode: str,                     # "serial" | "interleaved" | "optimized"
+    plan: Optional[SequencePlan] = None
 ) -> str:
     """
     Compone un único G-code:
       - Inserta change_block entre segmentos.
       - En 'serial': imprime todas las repeticiones de cada item antes del siguiente.
       - En 'interleaved': alterna por rondas hasta agotar repeticiones.
+      - En 'optimized': el orden de menor duración estimada (core.scheduler).
       - Usa el primer 'shutdown' no-vacío al final.
+    Para colas grandes conviene pasar iter_sequence() directo a build_final_3mf.
+    """
+    return "".join(iter_sequence(items, change_block, mode, plan))
+
+
+def _write_gcode_entry(zout: ZipWriter, name: str, segments: Iterable[Union[str, bytes]],
+                       with_md5: bool, date_time=None, stage: Optional[Dict] = None) -> str:
+    """
+    Escribe los segmentos en la entrada `name` del ZIP a medida que llegan y
+    devuelve el MD5 hex del contenido escrito ("" si with_md5 es False).
+    Cada segmento str distinto (core, bloque de cambio, apagado) se codifica y
+    se comprime una sola vez; las repeticiones sólo empalman el deflate ya hecho,
+    así que el costo crece con los segmentos únicos y no con las impresiones.
+    Los segmentos bytes (datos de una sola vez) se comprimen en streaming
+    y no se guardan. Con `stage` (ver core.metrics) suma ahí los bytes de G-code
+    y los comprimidos.
     """
-    parts: List[str] = []
-    if mode == "serial":
-        for it in items:
-            for _ in range(int(it["repeats"])):
-                if parts:
-                    parts.append("\n" + change_block + "\n")
-                parts.append(it["core"])
-    else:
-        # interleaved
-        remaining = True
-        round_idx = 0
-        while remaining:
-            remaining = False
-            for it in items:
-                if round_idx < int(it["repeats"]):
-                    if parts:
-                        parts.append("\n" + change_block + "\n")
-                    parts.append(it["core"])
-                    remaining = True
-            round_idx += 1
-
-    first_shutdown = next((it["shutdown"] for it in items if it.get("shutdown")), "")
-    parts.append(first_shutdown)
-    return "".join(parts)
+    digest = hashlib.md5() if with_md5 else None
+    compressed: Dict[str, Tuple[bytes, DeflatedSegment]] = {}
+    with zout.open_entry(name, date_time) as dst:
+        for seg in segments:
+            if not isinstance(seg, str):
+                if digest is not None:
+                    digest.update(seg)
+                dst.write(seg)
+                continue
+            cached = compressed.get(seg)
+            if cached is None:
+                data = seg.encode("utf-8")
+                cached = compressed[seg] = (data, deflate_segment(data))
+            if digest is not None:
+                # MD5 no se puede combinar como el CRC: se hashea el texto ya codificado
+                digest.update(cached[0])
+            dst.write_segment(cached[1])
+    if stage is not None:
+        stage["bytes_in"] += dst.file_size
+        stage["bytes_out"] += dst.compress_size
+    return digest.hexdigest() if digest is not None else ""
 
 
 def build_final_3mf(
-    skeleton_files: Dict[str, bytes],
+    skeleton_files: Mapping[str, bytes],
     plate_name: str,
-    composite_gcode: str
-) -> bytes:
+    composite_gcode: Union[str, Iterable[Union[str, bytes]]],
+    reproducible: bool = False,
+    out: Optional[BinaryIO] = None,
+    metrics: Optional[Metrics] = None,
+    report_lines: Sequence[str] = ()
+) -> Union[bytes, int]:
     """
-    Toma un diccionario de archivos (ZIP original), reemplaza el G-code del plate
-    y su .md5 si existe, y escribe un .3mf nuevo en memoria.
+    Toma los archivos del ZIP original (Lazy3MF de read_3mf o un dict), reemplaza
+    el G-code del plate y su .md5 si existe, y escribe un .3mf nuevo en memoria.
+    `composite_gcode` puede ser el texto completo o un iterable de segmentos
+    (p.ej. iter_sequence(...), o bloques bytes): en ese caso se escriben
+    directo a la entrada del ZIP, sin armar nunca el G-code completo en memoria.
+    Con un Lazy3MF, las entradas que no cambian (modelos, texturas, previews,
+    config) se copian comprimidas tal cual, sin inflarlas ni re-comprimirlas.
+    Con reproducible=True la salida depende sólo de las entradas: fecha fija en
+    las entradas nuevas, orden de entradas del original y reporte sin hora, así
+    que dos pedidos iguales dan los mismos bytes (ver queue_cache_key).
+    Sin `out` devuelve los bytes del .3mf. Con `out` (un archivo binario con
+    seek, p.ej. core.output.OutputFile o un SpooledTemporaryFile) escribe ahí
+    sin guardar nada en memoria y devuelve la cantidad de bytes escritos.
+    Con `metrics` se miden las etapas compose_sequence (generar los segmentos)
+    y zip_write (comprimir y escribir), y todas las etapas de `metrics` (p.ej.
+    las de read_3mf de cada entrada) van al reporte, salvo con
+    reproducible=True: tienen tiempos, así que ahí quedan sólo en `metrics`
+    (panel de diagnóstico) para que la salida siga siendo idéntica.
+    `report_lines` se agregan al reporte después del modo (p.ej. la explicación
+    del orden de optimize_sequence).
     """
-    files = dict(skeleton_files)  # copia
+    files = skeleton_files
+    raw_copy = isinstance(files, Lazy3MF)
 
     # Verificar plate base
     if plate_name not in files:
@@ -103,23 +524,46 @@ def build_final_3mf(
             raise ValueError("No se encontró .gcode base en el esqueleto 3MF.")
         plate_name = candidates[0]
 
-    # Reemplazar G-code
-    files[plate_name] = composite_gcode.encode("utf-8")
-
-    # Actualizar MD5 si está presente
+    segments = (composite_gcode,) if isinstance(composite_gcode, str) else composite_gcode
     md5_name = plate_name + ".md5"
-    if md5_name in files:
-        digest = hashlib.md5(files[plate_name]).hexdigest() + "\n"
-        files[md5_name] = digest.encode("ascii")
-
-    # Escribir ZIP final (¡usar writestr!, no 'wr')
-    out = io.BytesIO()
-    with zipfile.ZipFile(out, mode="w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zout:
-        for name, data in files.items():
-            zout.writestr(name, data)
-        ts = datetime.utcnow().isoformat() + "Z"
-        report = [f"# Queue report ({ts})", "- Modo: cola compuesta"]
-        zout.writestr("Metadata/queue_report.txt", ("\n".join(report) + "\n").encode("utf-8"))
-
-    out.seek(0)
-    return out.getvalue()
+    date_time = REPRODUCIBLE_DATE_TIME if reproducible else None
+
+    compose_stage = new_stage("compose_sequence")
+    if metrics is not None:
+        # el tiempo de generar los segmentos se separa del de escribir el ZIP
+        segments = timed_iter(segments, compose_stage)
+
+    target = io.BytesIO() if out is None else out
+    start = target.tell()
+    with ZipWriter(target) as zout:
+        zip_context = metrics.stage("zip_write") if metrics is not None else nullcontext(new_stage("zip_write"))
+        with zip_context as zip_stage:
+            for name in files:
+                if name == md5_name or name == "Metadata/queue_report.txt":
+                    # el .md5 se escribe después del G-code, cuando el digest ya está completo
+                    continue
+                if name == plate_name:
+                    digest = _write_gcode_entry(zout, name, segments, md5_name in files, date_time, zip_stage)
+                    # Actualizar MD5 si está presente
+                    if md5_name in files:
+                        zout.writestr(md5_name, (digest + "\n").encode("ascii"), date_time)
+                    continue
+                if raw_copy:
+                    zout.write_raw(*files.raw(name))
+                else:
+                    zout.writestr(name, files[name], date_time)
+        ts = "reproducible" if reproducible else datetime.utcnow().isoformat() + "Z"
+        report = [f"# Queue report ({ts})", "- Modo: cola compuesta", *report_lines]
+        if metrics is not None:
+            zip_stage["wall_s"] -= compose_stage["wall_s"]
+            zip_stage["cpu_s"] -= compose_stage["cpu_s"]
+            # lo que salió de compose es el G-code de la entrada, en bytes UTF-8
+            compose_stage["bytes_out"] = zip_stage["bytes_in"]
+            metrics.stages.insert(len(metrics.stages) - 1, compose_stage)
+            if not reproducible:
+                report += metrics.report_lines()
+        zout.writestr("Metadata/queue_report.txt", ("\n".join(report) + "\n").encode("utf-8"), date_time)
+
+    if out is None:
+        return target.getvalue()
+    return target.tell() - start
@@ -0,0 +1,159 @@
+# core/scheduler.py
+"""
+Modo de orden "optimized": busca el orden de impresión que minimiza la
+duración total estimada de la cola.
+
+El orden importa por las esperas de temperatura del cambio de placa: cada
+cambio enfría la cama desde la temperatura de la impresión anterior (hasta
+M190 R<temp>, o lo que alcance en la espera G4), la siguiente calienta desde
+ahí, y la última impresión no tiene cambio después. Con los estimados de cada plate (core.estimator) el costo de
+poner b después de a es fijo (transition_costs), así que la búsqueda trabaja
+sobre una matriz chica (modelos x modelos) y no vuelve a estimar G-code.
+
+La búsqueda es heurística y acotada:
+  1. candidatos iniciales: serie, intercalado y un goloso desde cada modelo
+     (siempre la siguiente impresión más barata);
+  2. búsqueda local sobre el mejor: intercambiar dos impresiones de modelos
+     distintos si baja el total, hasta `max_iter` intentos o PATIENCE
+     intentos seguidos sin mejora.
+La búsqueda se acota por intentos, no por tiempo, y los intercambios salen de
+un generador con semilla fija: el mismo pedido da siempre el mismo orden (y la
+vista previa coincide con el .3mf), con cualquier carga de la máquina.
+optimize_sequence_cached lo memoriza por core de cada item, repeticiones y
+bloque de cambio, para no repetir la búsqueda en cada rerun de la app.
+
+    schedule = optimize_sequence(items, change_block, estimates)
+    schedule["plan"]            # SequencePlan para iter_sequence / la vista previa
+    schedule["report_lines"]    # explicación para Metadata/queue_report.txt
+"""
+import random
+from typing import Dict, List, Optional, Sequence
+
+from .cache import LRUCache
+from .estimator import DEFAULT_PROFILE, MachineProfile, estimate_gcode, format_duration, transition_costs
+from .gcode_loop import md5_bytes
+from .queue_builder import core_id
+from .sequence import SequencePlan
+
+MAX_ITER = 20000
+PATIENCE = 2000
+
+
+def order_cost(order: Sequence[int], first: Sequence[float], trans: Sequence[Sequence[float]]) -> float:
+    if not order:
+        return 0.0
+    return first[order[0]] + sum(trans[a][b] for a, b in zip(order, order[1:]))
+
+
+def _greedy(start: int, repeats: List[int], trans: Sequence[Sequence[float]]) -> List[int]:
+    left = list(repeats)
+    left[start] -= 1
+    order = [start]
+    for _ in range(sum(left)):
+        cur = order[-1]
+        # a igual costo, seguir con el mismo modelo (runs más largos, preview más corta)
+        nxt = min((m for m, r in enumerate(left) if r > 0), key=lambda m: (trans[cur][m], m != cur, m))
+        left[nxt] -= 1
+        order.append(nxt)
+    return order
+
+
+def _swap_delta(order: List[int], i: int, j: int, first, trans) -> float:
+    """Cambio de costo al intercambiar las posiciones i < j (sin modificar order)."""
+    edges = {e for e in (i - 1, i, j - 1, j) if 0 <= e < len(order) - 1}
+
+    def cost(o) -> float:
+        c = sum(trans[o[e]][o[e + 1]] for e in edges)
+        return c + (first[o[0]] if i == 0 else 0.0)
+
+    before = cost(order)
+    order[i], order[j] = order[j], order[i]
+    after = cost(order)
+    order[i], order[j] = order[j], order[i]
+    return after - before
+
+
+def _local_search(order: List[int], first, trans, max_iter: int):
+    n = len(order)
+    rng = random.Random(0)
+    tried = improved = last_improvement = 0
+    if n < 2:
+        return order, tried, improved
+    while tried < max_iter and tried - last_improvement < PATIENCE:
+        tried += 1
+        i, j = sorted(rng.sample(range(n), 2))
+        if order[i] == order[j]:
+            continue
+        if _swap_delta(order, i, j, first, trans) < -1e-9:
+            order[i], order[j] = order[j], order[i]
+            improved += 1
+            last_improvement = tried
+    return order, tried, improved
+
+
+def optimize_sequence(items: Sequence[Dict], change_block: str, estimates: Optional[Sequence[Dict]] = None,
+                      profile: MachineProfile = DEFAULT_PROFILE, max_iter: int = MAX_ITER) -> Dict:
+    """
+    Orden optimizado de una cola. `estimates` son los de estimate_gcode (o
+    estimate_plate_cached) de cada item; sin ellos se estiman acá. Devuelve
+    {"plan", "total_s", "serial_s", "interleaved_s", "report_lines"}.
+    """
+    names = [it.get("name", f"#{k + 1}") for k, it in enumerate(items)]
+    repeats = [max(0, int(it["repeats"])) for it in items]
+    if estimates is None:
+        estimates = [estimate_gcode(it["core"], profile) if r else None for it, r in zip(items, repeats)]
+    active = [k for k, r in enumerate(repeats) if r > 0]
+    if not active:
+        raise ValueError("La cola no tiene impresiones.")
+    # la búsqueda trabaja con los modelos activos; después se vuelve a los índices de items
+    first, trans = transition_costs([estimates[k] for k in active], change_block, profile)
+    reps = [repeats[k] for k in active]
+
+    serial = list(SequencePlan.for_mode(reps, "serial"))
+    interleaved = list(SequencePlan.for_mode(reps, "interleaved"))
+    candidates = {"serie": serial, "intercalado": interleaved}
+    for m in range(len(active)):
+        candidates[f"goloso desde {names[active[m]]}"] = _greedy(m, reps, trans)
+    start_name, best = min(candidates.items(), key=lambda kv: order_cost(kv[1], first, trans))
+    start_cost = order_cost(best, first, trans)
+    order, tried, improved = _local_search(list(best), first, trans, max_iter)
+    total = order_cost(order, first, trans)
+    serial_s = order_cost(serial, first, trans)
+    interleaved_s = order_cost(interleaved, first, trans)
+    plan = SequencePlan.from_order(active[m] for m in order)
+
+    def run_label(run) -> str:
+        label = " → ".join(names[m] for m in run.models)
+        if run.count == 1:
+            return label
+        return f"{label} ×{run.count}" if len(run.models) == 1 else f"({label}) ×{run.count}"
+
+    pattern = " → ".join(run_label(run) for run in plan.runs)
+    last = names[active[order[-1]]]
+    saved = min(serial_s, interleaved_s) - total
+    lines = [
+        f"- Orden optimizado: {pattern}",
+        f"- Duración estimada: {format_duration(total)} (serie {format_duration(serial_s)}, "
+        f"intercalado {format_duration(interleaved_s)}; ahorro {format_duration(max(saved, 0.0))})",
+        f"- Última impresión: {last} (su cambio de placa y espera no hacen falta)",
+        f"- Búsqueda: mejor inicio '{start_name}' ({format_duration(start_cost)}), "
+        f"{improved} intercambios de {tried} probados",
+    ]
+    return {"plan": plan, "total_s": total, "serial_s": serial_s, "interleaved_s": interleaved_s,
+            "report_lines": lines}
+
+
+def optimize_sequence_cached(items: Sequence[Dict], change_block: str, estimates: Sequence[Dict],
+                             cache: Optional[LRUCache], profile: MachineProfile = DEFAULT_PROFILE) -> Dict:
+    """
+    optimize_sequence memorizado por (core_id, repeticiones y nombre de cada
+    item, bloque de cambio, perfil): la app lo llama en cada rerun y la búsqueda no
+    se repite mientras la cola no cambie. El resultado es compartido: no
+    modificarlo.
+    """
+    if cache is None:
+        return optimize_sequence(items, change_block, estimates, profile)
+    queue = [(core_id(it), int(it["repeats"]), it.get("name")) for it in items]
+    key = md5_bytes(f"schedule:{queue}:{md5_bytes(change_block.encode('utf-8'))}:{tuple(profile)}".encode("utf-8"))
+    return cache.get_or_compute(key, lambda: optimize_sequence(items, change_block, estimates, profile),
+                                lambda r: 1024 + 64 * sum(len(run.models) for run in r["plan"].runs))
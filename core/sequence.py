@@ -0,0 +1,137 @@
+# core/sequence.py
+"""
+Plan de secuencia compacto (run-length) que comparten la vista previa de la
+app y el compositor de G-code.
+
+Un plan es una lista de runs; cada run repite `count` veces un patrón de
+modelos (índices en la lista de items):
+  - serie:      [Run((0,), 5), Run((1,), 3)]           -> A A A A A B B B
+  - intercalado: [Run((0, 1), 3), Run((0,), 2)]         -> A B A B A B A A
+Entre dos impresiones consecutivas siempre va la espera (si hay) y el cambio
+de placa, así que no hace falta guardarlos por paso. El tamaño del plan
+depende de la cantidad de runs distintos, no del total de impresiones.
+"""
+from typing import Iterable, Iterator, List, NamedTuple, Sequence, Tuple
+
+MAX_PATTERN = 8
+
+
+class Run(NamedTuple):
+    models: Tuple[int, ...]  # patrón de una vuelta (índices de items)
+    count: int               # cuántas vueltas seguidas
+
+    @property
+    def prints(self) -> int:
+        return len(self.models) * self.count
+
+
+class Step(NamedTuple):
+    index: int       # número de impresión (desde 1)
+    model: int       # índice del item
+    repetition: int  # repetición de ese item (desde 1)
+
+
+class SequencePlan:
+    def __init__(self, runs: Iterable[Run]):
+        self.runs: List[Run] = [r for r in runs if r.count > 0 and r.models]
+
+    def __repr__(self) -> str:
+        return f"SequencePlan({self.runs!r})"
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, SequencePlan) and self.runs == other.runs
+
+    @classmethod
+    def for_mode(cls, repeats: Sequence[int], mode: str) -> "SequencePlan":
+        """
+        Plan de los órdenes fijos: 'serial' o 'interleaved' (por rondas). El
+        orden 'optimized' depende de los estimados de cada plate: ver
+        core.scheduler.optimize_sequence.
+        """
+        repeats = [max(0, int(r)) for r in repeats]
+        if mode == "optimized":
+            raise ValueError("El modo 'optimized' necesita los estimados de cada plate (usar optimize_sequence).")
+        if mode == "serial":
+            return cls(Run((i,), r) for i, r in enumerate(repeats))
+        # interleaved: las rondas con el mismo conjunto de modelos activos forman un run
+        runs = []
+        done = 0
+        for level in sorted(set(r for r in repeats if r > 0)):
+            active = tuple(i for i, r in enumerate(repeats) if r >= level)
+            runs.append(Run(active, level - done))
+            done = level
+        return cls(runs)
+
+    @classmethod
+    def from_order(cls, order: Iterable[int], max_pattern: int = MAX_PATTERN) -> "SequencePlan":
+        """
+        Comprime un orden explícito (un índice por impresión) en runs. En cada
+        posición se elige el patrón de hasta `max_pattern` impresiones que más
+        impresiones cubre repitiéndose seguido (A A A -> (A,)×3, A B A B ->
+        (A, B)×2); lo que no se repite se junta en un run de una vuelta.
+        Órdenes con estructura (serie, intercalado, los del scheduler) quedan
+        en pocos runs; el peor caso, un orden sin repeticiones, es un run con
+        una entrada por impresión.
+        """
+        order = list(order)
+        n = len(order)
+        runs: List[Run] = []
+        loose: List[int] = []  # impresiones sueltas, van juntas en un run de una vuelta
+
+        def flush():
+            if loose:
+                runs.append(Run(tuple(loose), 1))
+                loose.clear()
+
+        i = 0
+        while i < n:
+            best_len, best_count = 1, 1
+            for length in range(1, min(max_pattern, (n - i) // 2) + 1):
+                pattern = order[i:i + length]
+                count = 1
+                while order[i + count * length:i + (count + 1) * length] == pattern:
+                    count += 1
+                if count > 1 and count * length > best_len * best_count:
+                    best_len, best_count = length, count
+            if best_count == 1:
+                loose.append(order[i])
+                i += 1
+                continue
+            flush()
+            pattern = tuple(order[i:i + best_len])
+            if runs and runs[-1].models == pattern:
+                runs[-1] = Run(pattern, runs[-1].count + best_count)
+            else:
+                runs.append(Run(pattern, best_count))
+            i += best_len * best_count
+        flush()
+        return cls(runs)
+
+    @property
+    def total_prints(self) -> int:
+        return sum(r.prints for r in self.runs)
+
+    @property
+    def total_swaps(self) -> int:
+        return max(0, self.total_prints - 1)
+
+    def repeats(self, n_models: int) -> List[int]:
+        """Cuántas veces se imprime cada item."""
+        out = [0] * n_models
+        for run in self.runs:
+            for m in run.models:
+                out[m] += run.count
+        return out
+
+    def __iter__(self) -> Iterator[int]:
+        """Expansión completa: un índice de item por impresión."""
+        for run in self.runs:
+            for _ in range(run.count):
+                yield from run.models
+
+    def steps(self) -> Iterator[Step]:
+        """Expansión completa con número de impresión y de repetición por item."""
+        seen = {}
+        for i, model in enumerate(self, start=1):
+            seen[model] = seen.get(model, 0) + 1
+            yield Step(i, model, seen[model])
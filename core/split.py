@@ -0,0 +1,143 @@
+# core/split.py
+"""
+División de colas grandes en partes: cada parte es un .3mf completo (con su
+propio apagado al final) y todas se entregan juntas en un .zip.
+
+    parts = split_plan(plan, items, change_block, max_prints=20, max_hours=12, estimates=estimates)
+    outputs = build_parts(files, plate_name, items, change_block, parts, reproducible=True)
+    bundle = build_to_file(lambda fp: write_bundle(part_names("queue.3mf", len(outputs)), outputs, fp),
+                           suffix=".zip")
+
+Los límites se aplican por impresión entera (una impresión nunca se corta): la
+parte actual se cierra cuando la siguiente impresión la haría pasar de
+max_prints, max_bytes (G-code sin comprimir) o max_hours (duración estimada,
+ver core.estimator). Una impresión que sola ya supera un límite va en su
+propia parte.
+
+Las partes se arman en paralelo con hilos: la compresión (zlib) suelta el GIL,
+así que usan varios núcleos sin copiar los .3mf a otros procesos.
+"""
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Callable, Dict, Iterable, List, Mapping, Optional, Sequence
+
+from .archive import ZipWriter
+from .estimator import DEFAULT_PROFILE, MachineProfile, transition_costs
+from .metrics import Metrics
+from .output import OutputFile, build_to_file
+from .queue_builder import build_final_3mf, iter_sequence
+from .sequence import SequencePlan
+
+BUNDLE_MIME = "application/zip"
+
+
+def split_plan(plan: SequencePlan, items: Sequence[Dict], change_block: str,
+               max_prints: Optional[int] = None, max_bytes: Optional[int] = None,
+               max_hours: Optional[float] = None, estimates: Optional[Sequence[Dict]] = None,
+               profile: MachineProfile = DEFAULT_PROFILE) -> List[SequencePlan]:
+    """
+    Parte el plan en planes consecutivos que respetan los límites dados (None
+    o 0 = sin límite). max_hours necesita los estimados de cada item.
+    """
+    if max_hours and estimates is None:
+        raise ValueError("Para dividir por horas hacen falta los estimados de cada plate.")
+    shutdown = len(next((it["shutdown"] for it in items if it.get("shutdown")), ""))
+    separator = len(change_block) + 2
+    if max_hours:
+        first, trans = transition_costs(estimates, change_block, profile)
+    parts: List[List[int]] = []
+    order: List[int] = []
+    size = seconds = 0.0
+    for model in plan:
+        core = len(items[model]["core"])
+        if order:
+            add_bytes = separator + core
+            add_s = trans[order[-1]][model] if max_hours else 0.0
+            over = ((max_prints and len(order) + 1 > max_prints) or
+                    (max_bytes and size + add_bytes + shutdown > max_bytes) or
+                    (max_hours and (seconds + add_s) / 3600.0 > max_hours))
+            if not over:
+                order.append(model)
+                size += add_bytes
+                seconds += add_s
+                continue
+            parts.append(order)
+        order = [model]
+        size = core
+        seconds = first[model] if max_hours else 0.0
+    if order:
+        parts.append(order)
+    return [SequencePlan.from_order(p) for p in parts]
+
+
+def part_names(file_name: str, count: int) -> List[str]:
+    """queue.3mf, 3 -> [queue_parte01de03.3mf, queue_parte02de03.3mf, ...]."""
+    stem, ext = os.path.splitext(file_name)
+    width = max(2, len(str(count)))
+    return [f"{stem}_parte{k:0{width}d}de{count:0{width}d}{ext or '.3mf'}" for k in range(1, count + 1)]
+
+
+def part_report_lines(parts: Sequence[SequencePlan], index: int) -> List[str]:
+    start = sum(p.total_prints for p in parts[:index]) + 1
+    end = start + parts[index].total_prints - 1
+    return [f"- Parte {index + 1} de {len(parts)}: impresiones {start}–{end} de la cola"]
+
+
+def build_parts(skeleton_files: Mapping[str, bytes], plate_name: str, items: Sequence[Dict],
+                change_block: str, parts: Sequence[SequencePlan], reproducible: bool = False,
+                dir: Optional[str] = None, max_workers: Optional[int] = None,
+                report_lines: Sequence[str] = (), metrics: Optional[Metrics] = None,
+                wrap: Optional[Callable[[Iterable[str]], Iterable[str]]] = None) -> List[OutputFile]:
+    """
+    Arma un .3mf por parte (en paralelo, `max_workers` hilos) y devuelve sus
+    OutputFile en orden. `wrap` envuelve los segmentos de cada parte (p.ej.
+    BuildJob.track para progreso y cancelación). Con `metrics`, las etapas de
+    cada parte se agregan con el prefijo "parte N: ". Si una parte falla, se
+    borran todas y se propaga el error.
+    """
+    def build(index: int):
+        segments = iter_sequence(list(items), change_block, "serial", parts[index])
+        if wrap is not None:
+            segments = wrap(segments)
+        part_metrics = Metrics(metrics.trace_memory) if metrics is not None else None
+        output = build_to_file(
+            lambda fp: build_final_3mf(skeleton_files, plate_name, segments, reproducible=reproducible,
+                                       out=fp, metrics=part_metrics,
+                                       report_lines=[*report_lines, *part_report_lines(parts, index)]),
+            dir=dir)
+        return output, part_metrics
+
+    workers = max_workers or min(len(parts), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="printlooper-part") as pool:
+        futures = [pool.submit(build, k) for k in range(len(parts))]
+    outputs, errors = [], []
+    for k, fut in enumerate(futures):
+        try:
+            output, part_metrics = fut.result()
+        except BaseException as e:
+            errors.append(e)
+            continue
+        outputs.append(output)
+        if metrics is not None:
+            metrics.extend(part_metrics.stages, prefix=f"parte {k + 1}: ")
+    if errors:
+        for output in outputs:
+            output.cleanup()
+        raise errors[0]
+    return outputs
+
+
+def write_bundle(names: Sequence[str], outputs: Sequence[OutputFile], out: BinaryIO,
+                 date_time=None) -> int:
+    """
+    Escribe las partes en un .zip (sin recomprimir: los .3mf ya vienen
+    comprimidos). Devuelve los bytes escritos.
+    """
+    start = out.tell()
+    with ZipWriter(out, level=zlib.Z_NO_COMPRESSION) as zout:
+        for name, output in zip(names, outputs):
+            with zout.open_entry(name, date_time) as dst:
+                for chunk in output.iter_chunks():
+                    dst.write(chunk)
+    return out.tell() - start
@@ -0,0 +1,41 @@
+"""G-code y .3mf sintéticos para los tests."""
+import hashlib
+import io
+import random
+import zipfile
+
+CHANGE_SECTION = (";========Starting to change plates =================\n"
+                  "G91;\nG380 S3 Z-5 F1200 ; down\nG380 S2 Z5 F1200\nG90;\n"
+                  ";========Finish to change plates =================\n")
+
+
+def make_gcode(n_lines: int = 2000, sections: int = 1, seed: int = 0, bed: int = 65) -> str:
+    """G-code sintético con encabezado, secciones de cambio de placa y apagado al final."""
+    rng = random.Random(seed)
+    out = ["; HEADER_BLOCK_START\n; total layer number: 10\n; HEADER_BLOCK_END\n",
+           f"M140 S{bed}\nM190 S{bed}\nG90\nM83\n"]
+    every = n_lines // (sections + 1) + 1
+    for i in range(n_lines):
+        out.append(f"G1 X{rng.uniform(0, 200):.3f} Y{rng.uniform(0, 200):.3f} "
+                   f"E{rng.uniform(0, 1):.5f} F{rng.choice([1200, 3000, 6000])}\n")
+        if i and i % every == 0:
+            out.append(CHANGE_SECTION)
+    out.append("; filament end gcode\n\n; END_OF_PRINT\nM104 S0\nM140 S0\nM107\nM84\n"
+               "; CONFIG_BLOCK_START\n; foo = 1\n; CONFIG_BLOCK_END\n")
+    return "".join(out)
+
+
+def make_3mf(gcode: str, plates: int = 1, md5: bool = True) -> bytes:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("[Content_Types].xml", "<Types/>")
+        z.writestr("3D/3dmodel.model", random.Random(1).randbytes(20_000))
+        for p in range(1, plates + 1):
+            g = gcode if p == 1 else gcode.replace("M140 S65", f"M140 S{60 + p}")
+            z.writestr(f"Metadata/plate_{p}.gcode", g)
+            if md5:
+                z.writestr(f"Metadata/plate_{p}.gcode.md5", hashlib.md5(g.encode()).hexdigest() + "\n")
+            z.writestr(f"Metadata/plate_{p}.png", bytes([p]) * 64)
+        z.writestr("Metadata/project_settings.config", "{}")
+    return buf.getvalue()
+
@@ -0,0 +1,160 @@
+import io
+import os
+import random
+import shutil
+import subprocess
+import tracemalloc
+import zipfile
+import zlib
+
+import pytest
+
+from core.archive import (ZIP64_COUNT_LIMIT, ZIP64_LIMIT, Lazy3MF, ZipWriter, crc32_combine,
+                          crc32_shift, deflate_segment)
+
+NAMES = ["Metadata/plate_1.gcode", "Metadata/placa_ñandú.gcode", "3D/模型.model", "ÜBER/ß.txt"]
+
+
+@pytest.mark.parametrize("len_a, len_b", [(0, 0), (0, 7), (7, 0), (1, 1), (1000, 3), (3, 70_000)])
+def test_crc32_combine(len_a, len_b):
+    rng = random.Random(len_a * 31 + len_b)
+    a, b = rng.randbytes(len_a), rng.randbytes(len_b)
+    assert crc32_combine(zlib.crc32(a), zlib.crc32(b), crc32_shift(len(b))) == zlib.crc32(a + b)
+
+
+def test_crc32_combine_chain():
+    parts = [os.urandom(n) for n in (5, 0, 4096, 1, 65_537)]
+    crc = 0
+    for p in parts:
+        crc = crc32_combine(crc, zlib.crc32(p), crc32_shift(len(p)))
+    assert crc == zlib.crc32(b"".join(parts))
+
+
+def _spliced_zip(fp):
+    """Zip con segmentos empalmados entre texto suelto; devuelve el contenido esperado."""
+    text, noise = b"G1 X10 Y10 E.5\n" * 5000 + "; ñ\n".encode(), os.urandom(3000)
+    seg, other = deflate_segment(text), deflate_segment(noise)
+    expected = {}
+    with ZipWriter(fp) as z:
+        z.writestr("[Content_Types].xml", "<Types/>")
+        with z.open_entry(NAMES[0]) as e:
+            e.write(b"; inicio\n")
+            e.write_segment(seg)
+            e.write_segment(seg)        # dos seguidos, sin texto entre medio
+            e.write(b"M400\n")
+            e.write_segment(other)
+            e.write_segment(seg)
+        expected[NAMES[0]] = b"; inicio\n" + text * 2 + b"M400\n" + noise + text
+        for name in NAMES[1:]:
+            data = name.encode() * 100
+            z.writestr(name, data)
+            expected[name] = data
+    return expected
+
+
+def test_spliced_segments_round_trip(tmp_path):
+    path = tmp_path / "cola.3mf"
+    with open(path, "wb") as f:
+        expected = _spliced_zip(f)
+    with zipfile.ZipFile(path) as z:
+        assert z.testzip() is None
+        assert z.namelist() == ["[Content_Types].xml"] + NAMES
+        for name, data in expected.items():
+            assert z.read(name) == data
+            assert z.getinfo(name).CRC == zlib.crc32(data)
+    if shutil.which("unzip"):
+        res = subprocess.run(["unzip", "-t", str(path)], capture_output=True)
+        assert res.returncode == 0, res.stdout + res.stderr
+
+
+def test_write_raw_copies_non_ascii_names():
+    src = io.BytesIO()
+    with zipfile.ZipFile(src, "w", zipfile.ZIP_DEFLATED) as z:
+        for name in NAMES:
+            z.writestr(name, name * 50)
+    files = Lazy3MF(src.getvalue())
+    out = io.BytesIO()
+    with ZipWriter(out) as z:
+        for name in files:
+            z.write_raw(*files.raw(name))
+    with zipfile.ZipFile(out) as z:
+        assert z.testzip() is None
+        assert {n: z.read(n) for n in z.namelist()} == {n: (n * 50).encode() for n in NAMES}
+
+
+def test_many_entries_use_zip64_end_record():
+    out = io.BytesIO()
+    count = ZIP64_COUNT_LIMIT + 10
+    with ZipWriter(out, level=0) as z:
+        for i in range(count):
+            z.writestr(f"{i}.txt", b"")
+    assert b"PK\x06\x06" in out.getvalue()[-200:]
+    with zipfile.ZipFile(out) as z:
+        assert len(z.infolist()) == count
+        assert z.read(f"{count - 1}.txt") == b""
+
+
+def test_entry_over_4gib_round_trip(tmp_path):
+    # 65 × 64 MiB de ceros: la entrada pasa los 4 GiB pero el archivo ocupa unos pocos MB
+    zeros = deflate_segment(bytes(64 << 20))
+    path = tmp_path / "grande.3mf"
+    with open(path, "wb") as f, ZipWriter(f) as z:
+        z.writestr(NAMES[1], "antes")
+        with z.open_entry(NAMES[0]) as e:
+            e.write(b"G1 X1\n")
+            for _ in range(65):
+                e.write_segment(zeros)
+            e.write(b"M84\n")
+        z.writestr(NAMES[2], "después")
+    size = 6 + 65 * (64 << 20) + 4
+    assert size > ZIP64_LIMIT and os.path.getsize(path) < 10 << 20
+    with zipfile.ZipFile(path) as z:
+        info = z.getinfo(NAMES[0])
+        assert info.file_size == size
+        assert z.read(NAMES[1]) == b"antes" and z.read(NAMES[2]) == "después".encode()
+        with z.open(info) as f:  # zipfile valida el CRC al llegar al final
+            assert f.read(6) == b"G1 X1\n"
+            total, tail = 6, b""
+            while True:
+                block = f.read(64 << 20)
+                if not block:
+                    break
+                total += len(block)
+                tail = (tail + block)[-4:]
+        assert (total, tail) == (size, b"M84\n")
+
+
+@pytest.mark.parametrize("wrap", [bytes, bytearray, memoryview])
+def test_lazy3mf_reads_members_without_copying_the_archive(wrap, monkeypatch):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as z:
+        z.writestr("3D/3dmodel.model", os.urandom(8 << 20))
+        for i in range(20):
+            z.writestr(f"Metadata/plate_{i}.json", f'{{"plate": {i}}}')
+    files = Lazy3MF(wrap(buf.getvalue()))
+    opened = []
+    real_zipfile = zipfile.ZipFile
+    monkeypatch.setattr(zipfile, "ZipFile", lambda *a, **k: opened.append(a) or real_zipfile(*a, **k))
+    tracemalloc.start()
+    try:
+        for i in range(20):
+            name = f"Metadata/plate_{i}.json"
+            assert files[name] == f'{{"plate": {i}}}'.encode()
+            assert files.raw(name)[1] == files[name]
+            with files.open(name) as f:
+                assert f.read() == files[name]
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert opened == []          # el directorio central se leyó una sola vez, al construir
+    assert peak < 256 << 10      # ninguna copia del .3mf de 8 MB
+
+
+def test_lazy3mf_detects_corrupt_member():
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as z:
+        z.writestr("a.txt", b"hola mundo")
+    data = bytearray(buf.getvalue())
+    data[data.index(b"hola")] ^= 0xFF
+    with pytest.raises(zipfile.BadZipFile):
+        Lazy3MF(bytes(data))["a.txt"]
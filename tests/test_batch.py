@@ -0,0 +1,27 @@
+import zipfile
+
+import pytest
+
+from core.batch import run_job
+
+from helpers import make_3mf, make_gcode
+
+
+def test_plates_of_the_same_file_get_qualified_names(tmp_path):
+    (tmp_path / "proyecto.3mf").write_bytes(make_3mf(make_gcode(500), plates=2))
+    job = {"files": [{"path": "proyecto.3mf", "plate": 1, "repeats": 2},
+                     {"path": "proyecto.3mf", "plate": 2, "repeats": 1}],
+           "mode": "serial", "base_dir": str(tmp_path)}
+    res = run_job(job)
+    assert res["output"] == str(tmp_path / "queue_proyecto.3mf")
+    report = zipfile.ZipFile(res["output"]).read("Metadata/queue_report.txt").decode()
+    assert "proyecto.3mf · plate 1: read_3mf" in report
+    assert "proyecto.3mf · plate 2: read_3mf" in report
+
+
+def test_missing_plate_names_the_entry(tmp_path):
+    (tmp_path / "proyecto.3mf").write_bytes(make_3mf(make_gcode(100), plates=2))
+    job = {"files": [{"path": "proyecto.3mf", "plate": 1}, {"path": "proyecto.3mf", "plate": 5}],
+           "base_dir": str(tmp_path)}
+    with pytest.raises(ValueError, match="proyecto.3mf@5: El .3mf no tiene el plate 5"):
+        run_job(job)
@@ -0,0 +1,130 @@
+import os
+import threading
+import time
+
+from core.cache import LRUCache
+
+
+def _pickles(path):
+    return sorted(p.name for p in path.iterdir() if p.suffix == ".pkl")
+
+
+def test_memory_budget_evicts_least_recently_used():
+    cache = LRUCache(300)
+    for key in ("a", "b", "c"):
+        cache.put(key, key, 100)
+    cache.get("a")
+    cache.put("d", "d", 100)
+    assert cache.get("b") is None
+    assert [cache.get(k) for k in ("a", "c", "d")] == ["a", "c", "d"]
+    assert cache.used_bytes == 300
+
+
+def test_disk_budget_evicts_least_recently_used(tmp_path):
+    blob = os.urandom(1000)
+    cache = LRUCache(10_000, disk_dir=str(tmp_path), max_disk_bytes=3_500)
+    for key in ("a", "b", "c"):
+        cache.put(key, blob, len(blob))
+    cache.clear()
+    assert cache.get("a") == blob  # hit en disco: "a" pasa a ser la más reciente
+    cache.put("d", blob, len(blob))
+    assert _pickles(tmp_path) == ["a.pkl", "c.pkl", "d.pkl"]
+    assert cache.disk_bytes == sum(os.path.getsize(tmp_path / n) for n in _pickles(tmp_path))
+    assert cache.disk_bytes <= 3_500
+
+
+def test_disk_budget_applies_to_previous_runs(tmp_path):
+    blob = os.urandom(1000)
+    old = LRUCache(10_000, disk_dir=str(tmp_path), max_disk_bytes=10_000)
+    for k, key in enumerate(("a", "b", "c", "d")):
+        old.put(key, blob, len(blob))
+        os.utime(tmp_path / f"{key}.pkl", (1_000 + k, 1_000 + k))
+    cache = LRUCache(10_000, disk_dir=str(tmp_path), max_disk_bytes=2_500)
+    assert _pickles(tmp_path) == ["c.pkl", "d.pkl"]
+    assert cache.get("d") == blob
+
+
+def test_value_larger_than_disk_budget_is_not_written(tmp_path):
+    cache = LRUCache(10_000, disk_dir=str(tmp_path), max_disk_bytes=500)
+    cache.put("big", os.urandom(1000), 1000)
+    assert _pickles(tmp_path) == [] and cache.disk_bytes == 0
+    assert not [p for p in tmp_path.iterdir()]  # tampoco queda el temporal
+
+
+def test_get_or_compute_is_single_flight():
+    cache = LRUCache(10_000)
+    calls = []
+    release = threading.Event()
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return "valor"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute("k", compute, len)))
+               for _ in range(8)]
+    for t in threads:
+        t.start()
+    time.sleep(0.1)
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert len(calls) == 1
+    assert results == ["valor"] * 8
+
+
+def test_get_or_compute_waiters_retry_after_failure():
+    cache = LRUCache(10_000)
+    started = threading.Event()
+    release = threading.Event()
+
+    def failing():
+        started.set()
+        release.wait(5)
+        raise RuntimeError("cancelado")
+
+    errors = []
+
+    def owner():
+        try:
+            cache.get_or_compute("k", failing, len)
+        except RuntimeError as e:
+            errors.append(e)
+
+    t = threading.Thread(target=owner)
+    t.start()
+    started.wait(5)
+    result = []
+    waiter = threading.Thread(target=lambda: result.append(cache.get_or_compute("k", lambda: "ok", len)))
+    waiter.start()
+    time.sleep(0.05)
+    release.set()
+    t.join(5)
+    waiter.join(5)
+    assert len(errors) == 1
+    assert result == ["ok"]
+    assert cache.get("k") == "ok"
+
+
+def test_value_too_big_for_memory_still_shared_with_waiters():
+    cache = LRUCache(10)
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return "x" * 100
+
+    out = []
+    threads = [threading.Thread(target=lambda: out.append(cache.get_or_compute("k", compute, len)))
+               for _ in range(4)]
+    for t in threads:
+        t.start()
+    time.sleep(0.1)
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert len(calls) == 1 and out == ["x" * 100] * 4
+    assert len(cache) == 0
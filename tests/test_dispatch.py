@@ -0,0 +1,221 @@
+import ftplib
+import hashlib
+import os
+import threading
+
+import pytest
+
+import core.dispatch as dispatch_mod
+from core.dispatch import Printer, dispatch, manifest_name
+
+
+class FakeServer:
+    """Archivos en memoria de una impresora; drop_at corta el próximo STOR a los N bytes."""
+
+    def __init__(self):
+        self.files = {}
+        self.drop_at = None
+        self.stores = []
+
+
+class _Reader:
+    def __init__(self, data):
+        self.data = data
+
+    def recv(self, n):
+        block, self.data = self.data[:n], self.data[n:]
+        return block
+
+    def close(self):
+        pass
+
+
+class _Writer:
+    def __init__(self, server, name, offset):
+        self.server, self.name, self.pos = server, name, offset
+
+    def sendall(self, block):
+        data = self.server.files[self.name]
+        if self.server.drop_at is not None and self.pos + len(block) > self.server.drop_at:
+            block = block[:self.server.drop_at - self.pos]
+            self.server.drop_at = None
+            data[self.pos:self.pos + len(block)] = block
+            raise ConnectionResetError("conexión cortada")
+        data[self.pos:self.pos + len(block)] = block
+        self.pos += len(block)
+
+    def close(self):
+        pass
+
+
+class FakeFTP:
+    def __init__(self, server):
+        self.server = server
+
+    def size(self, name):
+        if name not in self.server.files:
+            raise ftplib.error_perm("550 no existe")
+        return len(self.server.files[name])
+
+    def transfercmd(self, cmd, rest=None):
+        verb, name = cmd.split(" ", 1)
+        if verb == "RETR":
+            if name not in self.server.files:
+                raise ftplib.error_perm("550 no existe")
+            return _Reader(bytes(self.server.files[name]))
+        self.server.stores.append((name, rest or 0))
+        if rest:
+            del self.server.files[name][rest:]
+        else:
+            self.server.files[name] = bytearray()
+        return _Writer(self.server, name, rest or 0)
+
+    def voidresp(self):
+        return "226 ok"
+
+    def voidcmd(self, cmd):
+        return "200 ok"
+
+    def delete(self, name):
+        if self.server.files.pop(name, None) is None:
+            raise ftplib.error_perm("550 no existe")
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def farm(monkeypatch):
+    servers = {name: FakeServer() for name in ("A1-01", "A1-02")}
+    monkeypatch.setattr(dispatch_mod, "connect", lambda printer: FakeFTP(servers[printer.name]))
+    monkeypatch.setattr(dispatch_mod, "RETRY_DELAY_S", 0.0)
+    monkeypatch.setattr(dispatch_mod, "BLOCK_SIZE", 1000)
+    printers = [Printer(name, "127.0.0.1") for name in servers]
+    return servers, printers
+
+
+def _manifest(data, name):
+    return f"{hashlib.sha256(data).hexdigest()}  {name}\n".encode()
+
+
+def test_fresh_upload_writes_file_and_manifest(farm):
+    servers, printers = farm
+    data = os.urandom(10_500)
+    results = dispatch([("cola.3mf", data)], printers)
+    for res, server in zip(results, servers.values()):
+        assert res["ok"]
+        (f,) = res["files"]
+        assert (f["sent"], f["resumed_from"], f["skipped"], f["replaced"]) == (len(data), 0, False, False)
+        assert bytes(server.files["cola.3mf"]) == data
+        assert bytes(server.files[manifest_name("cola.3mf")]) == _manifest(data, "cola.3mf")
+
+
+def test_interrupted_transfer_resumes(farm):
+    servers, printers = farm
+    data = os.urandom(10_500)
+    servers["A1-01"].drop_at = 4_000
+    progress = {}
+    results = dispatch([("cola.3mf", data)], printers[:1],
+                       progress=lambda p, n: progress.__setitem__(p, progress.get(p, 0) + n))
+    (f,) = results[0]["files"]
+    assert f["error"] is None and f["attempts"] == 2
+    assert f["resumed_from"] == 4_000
+    assert f["sent"] == len(data)
+    assert progress == {"A1-01": len(data)}
+    assert bytes(servers["A1-01"].files["cola.3mf"]) == data
+    assert servers["A1-01"].stores[-1] == ("cola.3mf", 4_000)
+
+
+def test_partial_file_with_matching_manifest_resumes(farm):
+    servers, printers = farm
+    data = os.urandom(10_500)
+    server = servers["A1-01"]
+    server.files["cola.3mf"] = bytearray(data[:6_000])
+    server.files[manifest_name("cola.3mf")] = bytearray(_manifest(data, "cola.3mf"))
+    (f,) = dispatch([("cola.3mf", data)], printers[:1])[0]["files"]
+    assert (f["resumed_from"], f["sent"], f["replaced"]) == (6_000, 4_500, False)
+    assert bytes(server.files["cola.3mf"]) == data
+
+
+def test_complete_file_is_skipped(farm):
+    servers, printers = farm
+    data = os.urandom(10_500)
+    dispatch([("cola.3mf", data)], printers)
+    results = dispatch([("cola.3mf", data)], printers)
+    assert all(f["skipped"] and f["sent"] == 0 for r in results for f in r["files"])
+
+
+@pytest.mark.parametrize("stale_size, stale_manifest", [
+    (4_000, None),        # archivo viejo más corto, sin manifiesto: no se le agrega nada
+    (10_500, None),       # mismo tamaño, sin manifiesto: no cuenta como "ya estaba"
+    (10_500, "other"),    # mismo tamaño, manifiesto de otra cola
+    (6_000, "other"),     # más corto con manifiesto de otra cola
+    (12_000, "same"),     # más largo que el nuevo: se reemplaza aunque el manifiesto coincida
+])
+def test_stale_remote_file_is_replaced(farm, stale_size, stale_manifest):
+    servers, printers = farm
+    data = os.urandom(10_500)
+    old = os.urandom(stale_size)
+    server = servers["A1-01"]
+    server.files["cola.3mf"] = bytearray(old)
+    if stale_manifest is not None:
+        server.files[manifest_name("cola.3mf")] = bytearray(
+            _manifest(data if stale_manifest == "same" else old, "cola.3mf"))
+    (f,) = dispatch([("cola.3mf", data)], printers[:1])[0]["files"]
+    assert f["error"] is None
+    assert (f["replaced"], f["skipped"], f["resumed_from"], f["sent"]) == (True, False, 0, len(data))
+    assert bytes(server.files["cola.3mf"]) == data
+    assert bytes(server.files[manifest_name("cola.3mf")]) == _manifest(data, "cola.3mf")
+
+
+def test_distribute_round_robin(farm):
+    servers, printers = farm
+    parts = [(f"p{k}.3mf", os.urandom(100 + k)) for k in range(3)]
+    results = dispatch(parts, printers, distribute=True)
+    assert [[f["name"] for f in r["files"]] for r in results] == [["p0.3mf", "p2.3mf"], ["p1.3mf"]]
+    assert sorted(n for n in servers["A1-02"].files) == ["p1.3mf", manifest_name("p1.3mf")]
+
+
+def test_auth_error_is_not_retried(farm, monkeypatch):
+    servers, printers = farm
+
+    def refuse(printer):
+        raise ftplib.error_perm("530 Login incorrect.")
+
+    monkeypatch.setattr(dispatch_mod, "connect", refuse)
+    (res,) = dispatch([("cola.3mf", b"x")], printers[:1])
+    assert not res["ok"] and res["files"][0]["attempts"] == 1
+
+
+def test_local_ftp_server(tmp_path):
+    # pyftpdlib está en requirements-dev.txt: si falta, el test falla en vez de saltearse
+    from pyftpdlib.authorizers import DummyAuthorizer
+    from pyftpdlib.handlers import FTPHandler
+    from pyftpdlib.ioloop import IOLoop
+    from pyftpdlib.servers import ThreadedFTPServer
+
+    authorizer = DummyAuthorizer()
+    authorizer.add_user("u", "p", str(tmp_path), perm="elradfmwMT")
+    handler = type("Handler", (FTPHandler,), {"authorizer": authorizer})
+    server = ThreadedFTPServer(("127.0.0.1", 0), handler, ioloop=IOLoop())
+    threading.Thread(target=server.serve_forever, kwargs={"handle_exit": False}, daemon=True).start()
+    try:
+        printer = Printer("banco", "127.0.0.1", "p", "u", server.address[1], "none")
+        data = os.urandom(700_000)
+        (tmp_path / "cola.3mf").write_bytes(os.urandom(300_000))        # cola vieja, mismo nombre
+        (f,) = dispatch([("cola.3mf", data)], [printer])[0]["files"]
+        assert f["replaced"] and f["sent"] == len(data)
+        assert (tmp_path / "cola.3mf").read_bytes() == data
+
+        (tmp_path / "cola.3mf").write_bytes(data[:250_000])              # envío cortado
+        (f,) = dispatch([("cola.3mf", data)], [printer])[0]["files"]
+        assert f["resumed_from"] == 250_000 and f["sent"] == len(data) - 250_000
+        assert (tmp_path / "cola.3mf").read_bytes() == data
+
+        (f,) = dispatch([("cola.3mf", data)], [printer])[0]["files"]
+        assert f["skipped"]
+    finally:
+        server.close_all()
@@ -0,0 +1,226 @@
+import math
+import random
+
+import pytest
+
+from core.cache import LRUCache
+from core.estimator import (DEFAULT_PROFILE, estimate_gcode, estimate_plate_cached, initial_state,
+                            queue_timeline)
+from core.pipeline import chunk_text
+from core.queue_builder import minify_plate, read_3mf
+from core.sequence import SequencePlan
+
+from helpers import make_3mf, make_gcode
+
+
+def test_estimate_cache_follows_the_core():
+    meta = read_3mf(make_3mf(make_gcode(2000)))
+    cache = LRUCache(1 << 20)
+    original = estimate_plate_cached(meta, cache)
+    # mismo .3mf y plate, otro core: no puede salir el estimado del original
+    half = {**meta, "core": meta["core"][:len(meta["core"]) // 2]}
+    assert estimate_plate_cached(half, cache)["moves"] < original["moves"]
+    minified = minify_plate(meta)
+    reduced = {**meta, "core": minified["core"], "core_digest": minified["core_digest"]}
+    assert estimate_plate_cached(reduced, cache) is not original
+    assert estimate_plate_cached(meta, cache) is original
+
+
+def scalar_estimate(text, profile=DEFAULT_PROFILE, chunk_size=None):
+    """
+    Referencia línea por línea del estimador (mismo modelo, sin NumPy): el
+    planificador se arma por bloque, igual que en estimate_gcode.
+    """
+    state = initial_state(profile)
+    acc = {"move_s": 0.0, "dwell_s": 0.0, "heat_s": 0.0, "home_s": 0.0, "moves": 0, "extrude_mm": 0.0,
+           "max_bed": state["bed"], "max_hotend": state["hotend"],
+           "first_bed_wait": None, "first_hotend_wait": None}
+    rates = {"hotend": (profile.hotend_heat, profile.hotend_cool), "bed": (profile.bed_heat, profile.bed_cool)}
+    heaters = {104: ("hotend", False), 109: ("hotend", True), 140: ("bed", False), 190: ("bed", True)}
+    for chunk in chunk_text(text, chunk_size) if chunk_size else [text]:
+        segs = []  # (dx, dy, dz, de, largo, v, a)
+        for line in chunk.split("\n"):
+            words = {}
+            for w in line.split(";", 1)[0].split():
+                if w[0] in "GMXYZEFIJSPR":
+                    words.setdefault(w[0], float(w[1:]))
+            if "G" in words:
+                kind, c = "G", int(words["G"])
+            elif "M" in words:
+                kind, c = "M", int(words["M"])
+            else:
+                continue
+            if kind == "G" and "F" in words:
+                state["feed"] = words["F"] / 60.0
+            if kind == "G" and c in (90, 91):
+                state["abs_xyz"] = c == 90
+            elif kind == "M" and c in (82, 83):
+                state["rel_e"] = c == 83
+            elif kind == "M" and c == 204 and "S" in words:
+                state["accel"] = words["S"]
+            elif kind == "G" and c == 92:
+                for k in "xyze":
+                    state[k] = words.get(k.upper(), state[k])
+            elif kind == "G" and c == 28:
+                state.update(x=0.0, y=0.0, z=0.0)
+                acc["home_s"] += profile.home_s
+            elif kind == "G" and c in (0, 1, 2, 3, 380):
+                start = {k: state[k] for k in "xyze"}
+                for k in "xyze":
+                    if k.upper() in words:
+                        relative = not state["abs_xyz"] or (k == "e" and state["rel_e"])
+                        state[k] = state[k] + words[k.upper()] if relative else words[k.upper()]
+                dx, dy, dz, de = (state[k] - start[k] for k in "xyze")
+                length = math.sqrt(dx * dx + dy * dy + dz * dz)
+                if c in (2, 3):
+                    i, j = words.get("I", 0.0), words.get("J", 0.0)
+                    cx, cy = start["x"] + i, start["y"] + j
+                    a0 = math.atan2(start["y"] - cy, start["x"] - cx)
+                    a1 = math.atan2(state["y"] - cy, state["x"] - cx)
+                    sweep = ((a0 - a1) if c == 2 else (a1 - a0)) % (2 * math.pi)
+                    length = math.hypot(math.hypot(i, j) * (sweep if sweep >= 1e-9 else 2 * math.pi), dz)
+                if length <= 1e-9:
+                    length = abs(de)
+                if length > 1e-9:
+                    v = min(max(state["feed"], 1e-3), profile.max_speed)
+                    segs.append((dx, dy, dz, de, length, v, max(state["accel"], 1.0)))
+            elif kind == "G" and c == 4:
+                dwell = words["S"] if "S" in words else words.get("P", 0.0) / 1000.0
+                acc["dwell_s"] += dwell
+                for name, (heat, cool) in rates.items():
+                    goal, cur = max(state[f"{name}_set"], profile.ambient), state[name]
+                    state[name] = min(goal, cur + heat * dwell) if goal > cur else max(goal, cur - cool * dwell)
+            elif kind == "M" and c in heaters and ("S" in words or "R" in words):
+                name, wait = heaters[c]
+                goal = words.get("S", words.get("R"))
+                state[f"{name}_set"] = goal
+                acc[f"max_{name}"] = max(acc[f"max_{name}"], goal)
+                if wait:
+                    heat, cool = rates[name]
+                    delta = goal - state[name]
+                    acc["heat_s"] += max(delta, 0) / heat + (max(-delta, 0) / cool if "R" in words else 0.0)
+                    if acc[f"first_{name}_wait"] is None:
+                        acc[f"first_{name}_wait"] = goal
+                    state[name] = goal
+        # planificador del bloque: uniones por junction deviation, una pasada y vuelta
+        n = len(segs)
+        units = [(dx / L, dy / L, dz / L) for dx, dy, dz, _, L, _, _ in segs]
+        vj = []
+        for k in range(n - 1):
+            u, w = units[k], units[k + 1]
+            cos_theta = -(u[0] * w[0] + u[1] * w[1] + u[2] * w[2])
+            sin_half = math.sqrt(min(max(0.5 * (1 - cos_theta), 0), 1))
+            jv = math.sqrt(segs[k + 1][6] * profile.junction_deviation * sin_half / max(1 - sin_half, 1e-9))
+            vj.append(min(jv, segs[k][5], segs[k + 1][5]))
+        entry, exit_ = [0.0] + vj, vj + [0.0]
+        for k, (*_, L, v, a) in enumerate(segs):
+            exit_[k] = min(exit_[k], math.sqrt(entry[k] ** 2 + 2 * a * L))
+            entry[k] = min(entry[k], math.sqrt(exit_[k] ** 2 + 2 * a * L))
+        for k in range(n - 1):
+            exit_[k] = entry[k + 1] = min(exit_[k], entry[k + 1])
+        for (_, _, _, de, L, v, a), v0, v1 in zip(segs, entry, exit_):
+            cruise = L - (v * v - v0 * v0) / (2 * a) - (v * v - v1 * v1) / (2 * a)
+            if cruise >= 0:
+                acc["move_s"] += (v - v0) / a + (v - v1) / a + cruise / v
+            else:
+                peak = max(math.sqrt(max((2 * a * L + v0 * v0 + v1 * v1) / 2, 0)), v0, v1)
+                acc["move_s"] += (peak - v0) / a + (peak - v1) / a
+            acc["moves"] += 1
+            acc["extrude_mm"] += max(de, 0.0)
+    acc["final_bed"], acc["final_hotend"] = state["bed"], state["hotend"]
+    return acc
+
+
+def synthetic_gcode(seed, n=600):
+    rng = random.Random(seed)
+    out = ["M140 S60\nM104 S220\nM190 S60\nM109 S220\nG28\nG90\nM82\nG92 E0\n"]
+    coord = lambda: f"{rng.uniform(0, 200):.3f}"
+    for _ in range(n):
+        r = rng.random()
+        if r < 0.55:
+            words = [f"{a}{coord()}" for a in "XY" if rng.random() < 0.9]
+            if rng.random() < 0.2:
+                words.append(f"Z{rng.uniform(0.2, 5):.2f}")
+            if rng.random() < 0.6:
+                words.append(f"E{rng.uniform(-1, 5):.4f}")
+            if rng.random() < 0.3:
+                words.append(f"F{rng.choice([600, 1800, 3000, 12000, 60000])}")
+            out.append(f"{rng.choice(['G0', 'G1', 'G1'])} {' '.join(words)}" +
+                       (" ; mov" if rng.random() < 0.1 else "") + "\n")
+        elif r < 0.62:
+            out.append(f"G{rng.choice([2, 3])} X{coord()} Y{coord()} I{rng.uniform(-20, 20):.3f} "
+                       f"J{rng.uniform(-20, 20):.3f} E1.2\n")
+        elif r < 0.7:
+            out.append(rng.choice(["G90\n", "G91\n", "M82\n", "M83\n"]))
+        elif r < 0.74:
+            out.append(rng.choice(["G92 E0\n", "G92 X10 Y10\n", "G28\n", "G1 F4200\n", "G0 F9000\n"]))
+        elif r < 0.78:
+            out.append(rng.choice(["M204 S2000\n", "M204 S8000\n", "G4 S2\n", "G4 P500\n"]))
+        elif r < 0.8:
+            out.append(rng.choice(["M190 S40\n", "M190 R35\n", "M109 S200\n", "M140 S0\n", "M104 S0\n"]))
+        elif r < 0.83:
+            out.append("G380 S3 Z-5 F1200\n")
+        else:
+            out.append(rng.choice(["; comentario G1 X5 Y5\n", "\n", "M400\n", "M106 S255\n"]))
+    return "".join(out)
+
+
+def assert_matches_reference(text, reference):
+    est = estimate_gcode(text)
+    for key, expected in reference.items():
+        if expected is None or isinstance(expected, int):
+            assert est[key] == expected, key
+        else:
+            assert est[key] == pytest.approx(expected, rel=1e-9, abs=1e-9), key
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_estimate_matches_scalar_reference(seed):
+    text = synthetic_gcode(seed)
+    assert_matches_reference(text, scalar_estimate(text))
+
+
+@pytest.mark.parametrize("text", [
+    "G90\nM82\nG92 E0\nG1 X10 Y0 E1 F3000\nG1 X10 Y10 E2\nG1 X0 Y10 E3 F1200\n",   # E absoluto
+    "G91\nG1 X10 E1 F3000\nG1 Y10 E1\nG1 X-10 E1\nG90\nG1 X0 Y0\n",               # G91: E relativo también
+    "M83\nG1 X10 E.5 F1800\nG1 X20 E.5\nG1 E-.8\nG1 E.8\nM82\nG1 X30 E2\n",         # M83 y retracciones
+    "G1 F6000\nG0 X100 Y100\nG1 X0 Y0 E5\nG1 F300\nG1 X10 Y0\nG0 X20 F12000\nG1 X30\n",  # F se arrastra
+    "", "; sólo comentarios\n;G1 X10 Y10 F3000\n\n", "\n\n",
+])
+def test_estimate_modes_match_scalar_reference(text):
+    assert_matches_reference(text, scalar_estimate(text))
+
+
+def test_estimate_empty_plate():
+    for text in ("", "; HEADER_BLOCK_START\n; nada\n; HEADER_BLOCK_END\n"):
+        est = estimate_gcode(text)
+        assert (est["time_s"], est["moves"], est["filament_g"]) == (0.0, 0, 0.0)
+        assert est["first_bed_wait"] is None and est["final_bed"] == DEFAULT_PROFILE.ambient
+
+
+def test_estimate_carries_state_across_chunks(monkeypatch):
+    # F, modos y posiciones pasan de un bloque al siguiente (el planificador arranca de 0 en cada uno)
+    text = synthetic_gcode(3, n=3000)
+    monkeypatch.setattr("core.estimator.CHUNK_SIZE", 4096)
+    reference = scalar_estimate(text, chunk_size=4096)
+    assert_matches_reference(text, reference)
+    assert reference["move_s"] != scalar_estimate(text)["move_s"]
+
+
+def test_queue_timeline_known_totals():
+    def est(time_s, filament_g, final_bed, first_bed_wait=None):
+        return {"time_s": time_s, "filament_g": filament_g, "final_bed": final_bed, "final_hotend": 30.0,
+                "first_bed_wait": first_bed_wait, "first_hotend_wait": None,
+                "start_bed": DEFAULT_PROFILE.ambient, "start_hotend": DEFAULT_PROFILE.ambient}
+
+    # A espera la cama a 60 °C (35 °C desde ambiente a 0.5 °C/s = 70 s dentro de sus 100 s);
+    # B la deja en 40 °C. El cambio (G4 S30) no calienta: sólo suma 30 s.
+    estimates = [est(100.0, 5.0, 60.0, first_bed_wait=60.0), est(200.0, 7.0, 40.0)]
+    plan = SequencePlan.for_mode([2, 1], "interleaved")   # A B A
+    timeline = queue_timeline([{}, {}], plan, "G4 S30\n", estimates)
+    # A tras B arranca con la cama en 40 °C: espera 40 s en vez de 70 → 70 s
+    assert [(s["model"], s["start_s"], s["end_s"], s["change_s"]) for s in timeline["steps"]] == [
+        (0, 0.0, 100.0, 30.0), (1, 130.0, 330.0, 30.0), (0, 360.0, 430.0, 0.0)]
+    assert timeline["runs"] == [360.0, 70.0]
+    assert (timeline["total_s"], timeline["print_s"], timeline["change_s"]) == (430.0, 370.0, 60.0)
+    assert timeline["filament_g"] == 17.0
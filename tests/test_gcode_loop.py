@@ -0,0 +1,121 @@
+import random
+
+import pytest
+
+from core.gcode_loop import (END_OF_PRINT_RE, SECTION_RE, SHUTDOWN_RE, GcodeIndex, find_cycles,
+                             normalize_existing_change_sections, rebuild_cycles,
+                             split_core_and_shutdown)
+
+LINES = [
+    "G1 X10 Y10 E.5 F3000", "G91;", "G90;", "G1 Z5 F1200", "; comentario", "", "   ",
+    "G380 S3 Z-5 F1200", "G380 S3 Z-5 F1200 ; baja", "G380 S2 Z5 F1200", "G380 S2 Z5 F1200 ; sube",
+    "g380 s3 z-7 f900", "G380 S2 Z30 F1200", "  G380 S3 Z-20 F1200",
+    ";========Starting to change plates =================",
+    ";======== Starting to change plates", ";= starting TO change PLATES",
+    ";========Finish to change plates =================", ";====== FINISH to change plates ==",
+    "M104 S0", "M140 S0", "M106 S0", "M107", "M84", "M18", "M104 S200", "M400",
+    "; END_OF_PRINT", "  ; end_of_print marker", "; filament end gcode", "; ñandú", "G1 X1 ; İ",
+]
+
+
+def random_gcode(seed, n=400):
+    rng = random.Random(seed)
+    # más ciclos G380 seguidos que al azar, para que haya secciones con ciclos
+    pool = LINES + ["G380 S3 Z-5 F1200\nG380 S2 Z5 F1200"] * 6
+    if seed % 3:  # sin END_OF_PRINT: el corte sale de los comandos de apagado (o no hay)
+        pool = [line for line in pool if "end_of_print" not in line.lower()]
+    if seed % 3 == 2:
+        pool = [line for line in pool if not SHUTDOWN_RE.search(line)]
+    text = "\n".join(rng.choice(pool) for _ in range(n))
+    return text + rng.choice(["", "\n", "\n\n"])
+
+
+def baseline_split(text):
+    """split_core_and_shutdown original (regex sobre todo el texto)."""
+    m_end = list(END_OF_PRINT_RE.finditer(text))
+    if m_end:
+        idx = m_end[-1].start()
+        return text[:idx], text[idx:]
+    m = list(SHUTDOWN_RE.finditer(text))
+    if not m:
+        return text, ""
+    idx = m[-1].start()
+    return text[:idx], text[idx:]
+
+
+def baseline_normalize(text, cycles, down_mm, up_mm, report):
+    """
+    normalize_existing_change_sections original (SECTION_RE.subn + find_cycles),
+    con el arreglo de saltos de línea: el cuerpo conserva los suyos en vez de
+    rearmarse con "\\n".join (que agregaba una línea en blanco después de los
+    ciclos o pegaba el marcador de fin a la última línea).
+    """
+    first = None
+
+    def replace(m):
+        nonlocal first
+        head, body, tail = m.groups()
+        lines = body.split("\n")
+        s, e, found = find_cycles(lines)
+        if found:
+            starts = [0]
+            for line in lines:
+                starts.append(starts[-1] + len(line) + 1)
+            new_cycles = rebuild_cycles(cycles, down_mm, up_mm, lines[s], lines[s + 1] if s + 1 < len(lines) else None)
+            res = head + body[:starts[s]] + new_cycles + body[min(starts[e], len(body)):] + tail
+            report.append(f"[change plates] ciclos normalizados → {cycles} (down={down_mm}, up={up_mm})")
+        else:
+            res = head + body + tail
+            report.append("[change plates] sección sin ciclos; no cambios.")
+        if first is None:
+            first = res
+        return res
+
+    new_text, n = SECTION_RE.subn(replace, text)
+    if n == 0:
+        report.append("No se encontraron secciones 'change plates'.")
+        return text, None, False
+    return new_text, first, True
+
+
+@pytest.mark.parametrize("seed", range(60))
+def test_split_matches_baseline(seed):
+    text = random_gcode(seed)
+    expected = baseline_split(text)
+    assert split_core_and_shutdown(text) == expected
+    assert split_core_and_shutdown(text, GcodeIndex(text)) == expected
+    if text.isascii():
+        raw = text.encode()
+        assert GcodeIndex(raw).shutdown_offset() == len(expected[0].encode())
+
+
+@pytest.mark.parametrize("seed", range(60))
+def test_normalize_matches_baseline(seed):
+    text = random_gcode(seed)
+    expected_report, report, indexed_report = [], [], []
+    expected = baseline_normalize(text, 3, 4.5, 6.0, expected_report)
+    assert normalize_existing_change_sections(text, 3, 4.5, 6.0, report) == expected
+    assert normalize_existing_change_sections(text, 3, 4.5, 6.0, indexed_report, GcodeIndex(text)) == expected
+    assert report == indexed_report == expected_report
+
+
+def test_normalize_keeps_line_endings():
+    text = ("G1 X1\n;========Starting to change plates =================\nG91;\n"
+            "G380 S3 Z-5 F1200\nG380 S2 Z5 F1200\nG380 S3 Z-5 F1200\nG380 S2 Z5 F1200\n"
+            ";========Finish to change plates =================\nG1 X2\n")
+    new_text, first, found = normalize_existing_change_sections(text, 1, 2.0, 3.0, [])
+    assert found
+    assert new_text == ("G1 X1\n;========Starting to change plates =================\nG91;\n"
+                        "G380 S3 Z-2.0 F1200\nG380 S2 Z3.0 F1200\n"
+                        ";========Finish to change plates =================\nG1 X2\n")
+    assert first == new_text[len("G1 X1\n"):-len("G1 X2\n")]
+
+
+def test_normalize_without_sections():
+    report = []
+    assert normalize_existing_change_sections("G1 X1\n", 2, 1.0, 1.0, report) == ("G1 X1\n", None, False)
+    assert report == ["No se encontraron secciones 'change plates'."]
+
+
+def test_split_without_markers():
+    assert split_core_and_shutdown("G1 X1\nG1 X2\n") == ("G1 X1\nG1 X2\n", "")
@@ -0,0 +1,69 @@
+import threading
+import time
+
+from core.jobs import CANCELLED, DONE, BuildExecutor
+
+
+def _wait(job, timeout=10.0):
+    end = time.time() + timeout
+    while not job.done and time.time() < end:
+        time.sleep(0.01)
+    assert job.done
+
+
+def test_same_key_shares_the_running_job():
+    executor = BuildExecutor(max_workers=2)
+    release = threading.Event()
+    calls = []
+
+    def build(job):
+        calls.append(job.id)
+        job.bytes_done += 10
+        release.wait(5)
+        return "salida"
+
+    try:
+        a = executor.submit(build, 100, key="cola")
+        b = executor.submit(build, 100, key="cola")
+        other = executor.submit(build, 100, key="otra")
+        assert b is a and a.shared and a.sessions == 2
+        assert other is not a
+        release.set()
+        _wait(a)
+        _wait(other)
+        assert a.status == DONE and a.result == "salida"
+        assert len(calls) == 2
+        # terminado, la misma clave arma un job nuevo (el resultado ya lo da la caché)
+        c = executor.submit(build, 100, key="cola")
+        assert c is not a
+        _wait(c)
+    finally:
+        executor.shutdown()
+
+
+def test_leave_cancels_only_when_no_session_is_left():
+    executor = BuildExecutor(max_workers=1)
+    started = threading.Event()
+
+    def build(job):
+        started.set()
+        while True:
+            job.check()
+            time.sleep(0.01)
+
+    try:
+        a = executor.submit(build, key="cola")
+        b = executor.submit(build, key="cola")
+        started.wait(5)
+        assert b.leave() is False and not a.cancel_requested
+        assert a.sessions == 1 and not a.shared
+        assert a.leave() is True
+        _wait(a)
+        assert a.status == CANCELLED
+        # un build cancelado no se comparte: la próxima sesión arranca uno nuevo
+        c = executor.submit(lambda job: "ok", key="cola")
+        assert c is not a
+        _wait(c)
+        assert c.result == "ok"
+    finally:
+        executor.shutdown()
@@ -0,0 +1,48 @@
+import threading
+import tracemalloc
+
+from core.metrics import Metrics
+
+
+def test_single_stage_records_peak_and_stops_tracing():
+    metrics = Metrics(trace_memory=True)
+    with metrics.stage("a"):
+        block = bytearray(1 << 20)
+        del block
+    assert metrics.stages[0]["peak_bytes"] >= 1 << 20
+    assert not tracemalloc.is_tracing()
+
+
+def test_overlapping_stages_share_tracing():
+    first_in, second_done = threading.Event(), threading.Event()
+    a, b = Metrics(trace_memory=True), Metrics(trace_memory=True)
+    tracing_after_b = []
+
+    def run_a():
+        with a.stage("a"):
+            first_in.set()
+            second_done.wait(5)
+
+    t = threading.Thread(target=run_a)
+    t.start()
+    first_in.wait(5)
+    with b.stage("b"):
+        pass
+    tracing_after_b.append(tracemalloc.is_tracing())  # "a" sigue midiendo: b no apaga tracemalloc
+    second_done.set()
+    t.join(5)
+    assert tracing_after_b == [True]
+    assert not tracemalloc.is_tracing()
+    # se solaparon: ninguna tiene un pico propio
+    assert a.stages[0]["peak_bytes"] is None and b.stages[0]["peak_bytes"] is None
+
+
+def test_tracing_started_elsewhere_is_left_running():
+    tracemalloc.start()
+    try:
+        metrics = Metrics(trace_memory=True)
+        with metrics.stage("a"):
+            pass
+        assert tracemalloc.is_tracing() and metrics.stages[0]["peak_bytes"] is not None
+    finally:
+        tracemalloc.stop()
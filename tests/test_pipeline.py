@@ -0,0 +1,198 @@
+import random
+
+import pytest
+
+from core.pipeline import Pipeline, minify_gcode, minify_moves, strip_comments
+from core.queue_builder import minify_plate
+
+HEADER = ("; HEADER_BLOCK_START\n; BambuStudio 1.9 — versión de prueba\n"
+          "; model printing time: 1h 2m; total estimated time: 1h 5m\n"
+          "; total layer number: 10\n; HEADER_BLOCK_END\n")
+
+TOOLPATH = HEADER + """\
+; tipo: pared exterior ñandú
+M83
+G90
+G0 X10.000 Y20.000 F12000
+G0 X10.000 Y20.000 Z0.300
+G1 X10.000 Y25.500 E0.12000 F3000 ; perímetro
+G1 X10.0 Y25.50 E0.1 F3000.0
+G1 X15 Y25.5 F3000
+G0 X15 Y25.5 F3000
+G1 X15 Y25.5 F3000
+G2 X20 Y30 I5 J0 E1.5 F1800
+G1 X20 Y30 E0.2 F1800
+G3 X15 Y25.5 I-5 J0 E1.5
+G1 X15 Y25.5 E0.1
+G91
+G1 Z0.4 F600
+G1 Z0.4 F600
+G1 X-0.000 Y0.50 F600
+G90
+G92 E0
+G1 X15 Y25.5 Z0.7 E0.5
+G380 S3 Z-5 F1200
+G1 X15 Y25.5 Z0.7 F1200
+M620 S0A
+G1 X15 Y25.5 Z0.7 F1200
+G1 x15 Y25.5 F1200
+G1 X15 Y25.5 F1200
+; ========Starting to change plates =================
+M400
+; ========Finish to change plates =================
+G1 X0.500 Y-0.50 F6000 ; comentario con acentos: ¿cómo?
+G1 X.5 Y-.5 F6000
+"""
+
+
+def simulate(text):
+    """
+    Lo que hace la impresora con un G-code, sin comentarios: un evento por
+    comando, con la posición absoluta (None: desconocida) y el avance vigentes
+    en cada movimiento. Dos G-code equivalentes dan la misma lista.
+    """
+    pos = dict.fromkeys("XYZ")
+    absolute = True
+    feed = None
+    unknown = 0
+    events = []
+    for line in text.split("\n"):
+        code = line.split(";", 1)[0].split()
+        if not code:
+            continue
+        c = code[0].upper()
+        words = []
+        for w in code[1:]:
+            try:
+                words.append((w[0].upper(), float(w[1:])))
+            except ValueError:
+                pass  # S0A, AQ==: parámetros que no son números
+        args = dict(words)
+        if c in ("G0", "G1", "G2", "G3"):
+            before = (tuple(pos.values()), feed)
+            feed = args.get("F", feed)
+            for a in "XYZ":
+                if a in args:
+                    pos[a] = args[a] if absolute else None
+            extra = tuple(sorted((k, v) for k, v in words if k not in "XYZF"))
+            deltas = () if absolute else tuple((k, v) for k, v in words if k in "XYZ")
+            if c in ("G0", "G1") and not extra and not deltas and before == (tuple(pos.values()), feed):
+                continue  # no mueve ni cambia nada
+            events.append((c, tuple(pos.values()), feed, extra, deltas))
+        elif c in ("G90", "G91"):
+            absolute = c == "G90"
+            events.append((c,))
+        elif c == "G92":
+            for a in [a for a in args if a in pos] or pos:
+                pos[a] = args.get(a, 0.0)
+            events.append((c, tuple(sorted(args.items()))))
+        else:
+            if c not in ("M83", "M400", "M106"):
+                # comando que mueve por su cuenta: desde acá la posición y el
+                # avance sólo valen si el G-code los vuelve a dar
+                unknown += 1
+                pos = dict.fromkeys("XYZ", ("?", unknown))
+                feed = ("?", unknown)
+            events.append((c, tuple(code[1:])))
+    return events
+
+
+def random_toolpath(seed, n=3000):
+    rng = random.Random(seed)
+    coords = [f"{v:.3f}" for v in (0, 0.5, 10, 10.25, 120)] + ["10.250", ".5", "-0.500", "0"]
+    feeds = ["600", "1200", "1200.0", "3000", "6000"]
+    out = [HEADER, "M83\n"]
+    for _ in range(n):
+        r = rng.random()
+        if r < 0.6:
+            c = rng.choice(["G0", "G1", "G1"])
+            words = [f"{a}{rng.choice(coords)}" for a in "XYZ" if rng.random() < 0.7]
+            if c == "G1" and rng.random() < 0.5:
+                words.append(f"E{rng.choice(['.1', '0.12', '0'])}")
+            if rng.random() < 0.6:
+                words.append(f"F{rng.choice(feeds)}")
+            out.append(" ".join([c] + words) + (" ; mov" if rng.random() < 0.1 else "") + "\n")
+        elif r < 0.7:
+            out.append(f"{rng.choice(['G2', 'G3'])} X{rng.choice(coords)} Y{rng.choice(coords)} "
+                       f"I{rng.choice(coords)} J0 E.5 F{rng.choice(feeds)}\n")
+        elif r < 0.78:
+            out.append(rng.choice(["G90\n", "G91\n"]))
+        elif r < 0.84:
+            out.append(rng.choice(["G92 E0\n", "G92 X0 Y0\n", "G28\n"]))
+        elif r < 0.9:
+            out.append(rng.choice(["G380 S3 Z-5 F1200\n", "M620 S0A\n", "M624 AQ==\n", "M625\n"]))
+        else:
+            out.append(rng.choice(["; comentario\n", "\n", "M400\n", "M106 P1 S255 ; ventilador\n"]))
+    return "".join(out)
+
+
+def test_minify_keeps_toolpath():
+    out = minify_gcode(TOOLPATH)
+    assert simulate(out) == simulate(TOOLPATH)
+    assert len(out) < len(TOOLPATH)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_minify_keeps_random_toolpath(seed):
+    text = random_toolpath(seed)
+    report = {}
+    out = minify_gcode(text, report)
+    assert simulate(out) == simulate(text)
+    assert report["words"] > 0
+
+
+def test_minify_keeps_header_markers_and_arcs():
+    out = minify_gcode(TOOLPATH)
+    assert out.startswith(HEADER)
+    assert "; ========Starting to change plates" in out and "; ========Finish to change plates" in out
+    assert "G2 X20 Y30 I5 J0 E1.5 F1800\nG1 X20 Y30 E.2 F1800\n" in out  # F en el arco: avance desconocido
+    assert "G3 X15 Y25.5 I-5 J0 E1.5\nG1 X15 Y25.5 E.1\n" in out
+    assert "G1 Z.4 F600\nG1 Z.4\n" in out      # en G91 las coordenadas repetidas no sobran
+    assert "ñandú" not in out and "perímetro" not in out
+
+
+def test_minify_plate_counts_utf8_bytes():
+    meta = {"core": TOOLPATH, "digest": "d", "plate_name": "Metadata/plate_1.gcode"}
+    res = minify_plate(meta)
+    assert res["bytes_in"] == len(TOOLPATH.encode("utf-8")) > len(TOOLPATH)
+    assert res["bytes_out"] == len(res["core"].encode("utf-8"))
+    assert (res["stage"]["bytes_in"], res["stage"]["bytes_out"]) == (res["bytes_in"], res["bytes_out"])
+
+
+PIPELINES = {
+    "minify": lambda: Pipeline(strip_comments(keep_header=True), minify_moves()),
+    "strip": lambda: Pipeline(strip_comments()),
+    "strip_keep_blank": lambda: Pipeline(strip_comments(drop_blank_lines=False, keep_header=True)),
+}
+
+
+def _cuts(text, rng, n=40):
+    """Cortes al azar más cortes a propósito dentro de marcadores y de cada "\\r\\n"."""
+    points = {rng.randrange(len(text)) for _ in range(n)}
+    for marker in ("HEADER_BLOCK_START", "HEADER_BLOCK_END", "Starting to change", "Finish to change"):
+        at = text.find(marker)
+        if at >= 0:
+            points.add(at + len(marker) // 2)
+    points.update(i + 1 for i in range(len(text) - 1) if text[i:i + 2] == "\r\n" and rng.random() < 0.3)
+    bounds = [0, *sorted(points), len(text)]
+    return [text[a:b] for a, b in zip(bounds, bounds[1:])]
+
+
+@pytest.mark.parametrize("name", sorted(PIPELINES))
+@pytest.mark.parametrize("crlf", [False, True])
+@pytest.mark.parametrize("seed", range(4))
+def test_chunk_boundaries_do_not_change_output(name, crlf, seed):
+    text = TOOLPATH + random_toolpath(seed, 500)
+    if crlf:
+        text = text.replace("\n", "\r\n")
+    rng = random.Random(seed)
+    pipe = PIPELINES[name]
+    expected = pipe().run_text(text)
+    assert "".join(pipe()([text])) == expected
+    assert "".join(pipe()(_cuts(text, rng))) == expected
+    assert "".join(pipe()(list(text[:2000]) + [text[2000:]])) == expected  # de a un carácter
+
+
+def test_minify_keeps_crlf_line_endings():
+    text = TOOLPATH + random_toolpath(0, 500)
+    assert minify_gcode(text.replace("\n", "\r\n")) == minify_gcode(text).replace("\n", "\r\n")
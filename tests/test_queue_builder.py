@@ -0,0 +1,70 @@
+import io
+import zipfile
+
+from core.metrics import Metrics
+from core.queue_builder import build_final_3mf, iter_sequence, read_3mf
+
+from helpers import make_3mf, make_gcode
+
+
+def _build(meta, items, **kwargs):
+    return build_final_3mf(meta["files"], meta["plate_name"], iter_sequence(items, "G4 S1", "serial"),
+                           reproducible=True, **kwargs)
+
+
+def test_reproducible_build_ignores_metrics():
+    meta = read_3mf(make_3mf(make_gcode(3000)))
+    items = [{"name": "a", "core": meta["core"], "shutdown": meta["shutdown"], "repeats": 3}]
+    first = _build(meta, items, metrics=Metrics(trace_memory=True))
+    second = _build(meta, items, metrics=Metrics())
+    assert first == second == _build(meta, items)
+    report = zipfile.ZipFile(io.BytesIO(first)).read("Metadata/queue_report.txt").decode()
+    assert "Etapa" not in report and " s (CPU" not in report
+
+
+def test_non_reproducible_report_has_stage_metrics():
+    meta = read_3mf(make_3mf(make_gcode(3000).replace("; filament end gcode", "; fin ñandú")))
+    items = [{"name": "a", "core": meta["core"], "shutdown": meta["shutdown"], "repeats": 2}]
+    metrics = Metrics()
+    data = build_final_3mf(meta["files"], meta["plate_name"], iter_sequence(items, "G4 S1", "serial"),
+                           metrics=metrics)
+    z = zipfile.ZipFile(io.BytesIO(data))
+    report = z.read("Metadata/queue_report.txt").decode()
+    assert "- Etapa compose_sequence:" in report and "- Etapa zip_write:" in report
+    compose = next(s for s in metrics.stages if s["stage"] == "compose_sequence")
+    assert compose["bytes_out"] == z.getinfo(meta["plate_name"]).file_size
+    assert compose["bytes_out"] > len("".join(iter_sequence(items, "G4 S1", "serial")))  # bytes, no caracteres
+
+
+def test_plate_index_keeps_offsets_and_read_plate_reuses_them(monkeypatch):
+    import core.queue_builder as qb
+
+    meta = read_3mf(make_3mf(make_gcode(2000), plates=3))
+    first, second, third = meta["plates"]
+    assert first["shutdown_offset"] == meta["shutdown_offset"] and first["core_offset"] == 0
+    assert second["shutdown_offset"] is None and third["shutdown_offset"] is None
+    scans = []
+    real_find = qb.find_shutdown_offset
+    monkeypatch.setattr(qb, "find_shutdown_offset", lambda raw: scans.append(1) or real_find(raw))
+    plate = qb.read_plate(meta, 2)
+    assert len(scans) == 1 and plate["plates"] is meta["plates"]
+    assert second["shutdown_offset"] == plate["shutdown_offset"]
+    raw = meta["files"][second["name"]]
+    assert plate["core"].encode() == raw[:second["shutdown_offset"]]
+    again = qb.read_plate(meta, 2)      # p.ej. la caché ya descartó el plate: no se recorre de nuevo
+    assert len(scans) == 1
+    assert (again["core"], again["shutdown"]) == (plate["core"], plate["shutdown"])
+
+
+def test_read_3mf_many_reports_the_real_error(monkeypatch):
+    # el G-code inflado llega como mmap: un error al armar el meta no puede
+    # terminar en "BufferError: cannot close exported pointers exist" al cerrarlo
+    import core.queue_builder as qb
+
+    def broken_index(files):
+        raise RuntimeError("índice roto")
+
+    monkeypatch.setattr(qb, "plate_index", broken_index)
+    [res] = qb.read_3mf_many([make_3mf(make_gcode(500))], max_workers=1)
+    assert res["meta"] is None
+    assert res["error"] == "RuntimeError: índice roto"
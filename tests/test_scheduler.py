@@ -0,0 +1,40 @@
+import pytest
+
+from core.cache import LRUCache
+from core.estimator import estimate_gcode
+from core.queue_builder import read_3mf
+from core.scheduler import optimize_sequence, optimize_sequence_cached
+
+from helpers import make_3mf, make_gcode
+
+CHANGE_BLOCK = "M190 R35\nG4 S60\n"
+
+
+@pytest.fixture
+def queue():
+    items = []
+    for k, (bed, repeats) in enumerate([(65, 300), (90, 200), (50, 100)]):
+        meta = read_3mf(make_3mf(make_gcode(500, seed=k, bed=bed)))
+        items.append({"name": f"m{k}", "core": meta["core"], "shutdown": meta["shutdown"],
+                      "repeats": repeats, "digest": meta["digest"], "plate_name": meta["plate_name"]})
+    return items, [estimate_gcode(it["core"]) for it in items]
+
+
+def test_optimize_is_deterministic_and_compact(queue):
+    items, estimates = queue
+    first = optimize_sequence(items, CHANGE_BLOCK, estimates)
+    second = optimize_sequence(items, CHANGE_BLOCK, estimates)
+    assert first["plan"] == second["plan"] and first["report_lines"] == second["report_lines"]
+    assert first["plan"].repeats(3) == [300, 200, 100]
+    assert len(first["plan"].runs) <= 10
+    assert first["total_s"] <= min(first["serial_s"], first["interleaved_s"]) + 1e-6
+
+
+def test_optimize_cached(queue):
+    items, estimates = queue
+    cache = LRUCache(1 << 20)
+    result = optimize_sequence_cached(items, CHANGE_BLOCK, estimates, cache)
+    assert optimize_sequence_cached(items, CHANGE_BLOCK, estimates, cache) is result
+    fewer = [{**it, "repeats": 1} for it in items]
+    assert optimize_sequence_cached(fewer, CHANGE_BLOCK, estimates, cache)["plan"].total_prints == 3
+    assert optimize_sequence_cached(items, "G4 S1\n", estimates, cache) is not result
@@ -0,0 +1,47 @@
+import random
+
+import pytest
+
+from core.sequence import Run, SequencePlan
+
+
+@pytest.mark.parametrize("mode, expected", [
+    ("serial", [Run((0,), 3), Run((1,), 1)]),
+    ("interleaved", [Run((0, 1), 1), Run((0,), 2)]),
+])
+def test_for_mode(mode, expected):
+    assert SequencePlan.for_mode([3, 1], mode).runs == expected
+
+
+def test_for_mode_optimized_needs_estimates():
+    with pytest.raises(ValueError):
+        SequencePlan.for_mode([1, 1], "optimized")
+
+
+def test_from_order_round_trip():
+    rng = random.Random(0)
+    for _ in range(2000):
+        order = [rng.randrange(rng.randint(1, 4)) for _ in range(rng.randint(0, 40))]
+        plan = SequencePlan.from_order(order)
+        assert list(plan) == order
+        assert plan.total_prints == len(order)
+
+
+@pytest.mark.parametrize("order, runs", [
+    ([0] * 5000 + [1] * 3000, [Run((0,), 5000), Run((1,), 3000)]),
+    ([0, 1] * 5000, [Run((0, 1), 5000)]),
+    ([0, 1, 2] * 1000 + [2] * 10, [Run((0, 1, 2), 1000), Run((2,), 10)]),
+    ([2] + [0, 1] * 4000 + [0] * 7, [Run((2,), 1), Run((0, 1), 4000), Run((0,), 7)]),
+])
+def test_from_order_compresses_repeated_patterns(order, runs):
+    assert SequencePlan.from_order(order).runs == runs
+
+
+def test_from_order_worst_case_size():
+    # sin repeticiones seguidas no hay nada que comprimir: un run de una vuelta
+    order = list(range(1000))
+    assert SequencePlan.from_order(order).runs == [Run(tuple(order), 1)]
+    rng = random.Random(1)
+    order = [rng.randrange(3) for _ in range(20000)]
+    plan = SequencePlan.from_order(order)
+    assert sum(len(r.models) for r in plan.runs) <= len(order)